@@ -0,0 +1,98 @@
+from __future__ import annotations
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from ..state import DB, Message
+from ..tokens import count_tokens
+from ..api.llm_client import ChatClient
+
+# Conversation memory: the most recent turns go verbatim into the prompt under a token
+# budget; older turns are folded into a rolling summary stored on the Conversation row.
+# The summary is refreshed by a background worker after each turn, never on the hot path.
+
+SUMMARY_PROMPT_FR = """Tu résumes une conversation entre un statisticien de l'Insee et un assistant R.
+Mets à jour le résumé existant avec les nouveaux échanges. Garde les faits utiles pour la suite :
+objectif de l'utilisateur, données et variables manipulées, packages et fonctions retenus,
+décisions prises, questions encore ouvertes. 10 lignes maximum, en français, sans code long.
+"""
+
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="canar-summary")
+_IN_FLIGHT: set[int] = set()
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def _split_recent(msgs: List[Message], budget: int) -> int:
+    """
+    Index of the first message kept verbatim: newest messages fitting in `budget` tokens,
+    and at least the newest one (a long answer alone may exceed the budget).
+    """
+    used = 0
+    start = max(0, len(msgs) - 1)
+    for i in range(len(msgs) - 1, -1, -1):
+        used += count_tokens(msgs[i].content)
+        if used > budget and i < len(msgs) - 1:
+            break
+        start = i
+    return start
+
+
+def history_messages(db: DB, user_id: int, conv_id: int, budget: int = 1500,
+                     max_messages: int = 20) -> list[dict]:
+    """Chat messages to put between the system prompt and the new question."""
+    conv = db.get_conversation(conv_id)
+    if not conv or conv.user_id != user_id:
+        return []
+    msgs = db.get_messages(user_id, conv_id, limit=max_messages)
+    recent = msgs[_split_recent(msgs, budget):]
+    out = []
+    if conv.summary:
+        out.append({"role": "system",
+                    "content": f"Résumé de la conversation précédente :\n{conv.summary}"})
+    # messages already folded into the summary are not repeated
+    out += [{"role": m.role, "content": m.content} for m in recent
+            if m.id > conv.summary_upto and m.role in ("user", "assistant")]
+    return out
+
+
+def _refresh_summary(db: DB, chat: ChatClient, user_id: int, conv_id: int, budget: int,
+                     max_messages: int):
+    try:
+        conv = db.get_conversation(conv_id)
+        if not conv or conv.user_id != user_id:
+            return
+        # only the messages that left the verbatim window are summarized
+        recent = db.get_messages(user_id, conv_id, limit=max_messages)
+        if not recent:
+            return
+        first_verbatim = recent[_split_recent(recent, budget)].id
+        pending = db.get_messages(user_id, conv_id, after_id=conv.summary_upto,
+                                  before_id=first_verbatim)
+        summary, upto = conv.summary, conv.summary_upto
+        # oldest first, in batches; `summary_upto` only covers what was actually summarized
+        for i in range(0, len(pending), 2 * max_messages):
+            batch = pending[i:i + 2 * max_messages]
+            transcript = "\n\n".join(f"{m.role.upper()}: {m.content}" for m in batch)
+            prompt = f"Résumé existant :\n{summary or '(aucun)'}\n\nNouveaux échanges :\n{transcript}"
+            new = "".join(chat.stream_chat(
+                [{"role": "system", "content": SUMMARY_PROMPT_FR}, {"role": "user", "content": prompt}],
+                temperature=0.0, max_tokens=400,
+            )).strip()
+            if not new:
+                break
+            summary, upto = new, batch[-1].id
+            db.update_summary(user_id, conv_id, summary, upto)
+    except Exception as e:
+        print(f"[canar] summary refresh failed for conversation {conv_id}: {e}")
+    finally:
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.discard(conv_id)
+
+
+def schedule_summary(db: DB, chat: ChatClient, user_id: int, conv_id: int, budget: int = 1500,
+                     max_messages: int = 20):
+    """Refresh the rolling summary in the background (at most one job per conversation)."""
+    with _IN_FLIGHT_LOCK:
+        if conv_id in _IN_FLIGHT:
+            return
+        _IN_FLIGHT.add(conv_id)
+    _POOL.submit(_refresh_summary, db, chat, user_id, conv_id, budget, max_messages)
@@ -1,5 +1,7 @@
 from __future__ import annotations
+import hashlib
 from typing import List, Dict
+from ..tokens import count_tokens
 
 SYSTEM_PROMPT_FR = """Tu es un assistant R pour des statisticiens de l'Insee.
 - Donne des réponses pratiques, idiomatiques (tidyverse).
@@ -11,31 +13,94 @@ SYSTEM_PROMPT_FR = """Tu es un assistant R pour des statisticiens de l'Insee.
 """
 
 
-def assemble_context(citations: List[Dict]) -> tuple[str, list[dict]]:
+def _shingles(text: str, n: int = 5) -> set[str]:
+    words = text.lower().split()
+    return {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def _near_duplicate(sh: set[str], seen: list[set[str]], threshold: float) -> bool:
+    for other in seen:
+        inter = len(sh & other)
+        if inter and inter / len(sh | other) >= threshold:
+            return True
+    return False
+
+
+def _touches(block: dict, url: str | None, collection: str | None, pos: int | None) -> bool:
+    """`pos` is right before or after the chunks of `block` on the same page."""
+    if not url or pos is None or block["url"] != url or block["collection"] != collection:
+        return False
+    positions = [q[0] for q in block["pieces"]]
+    return None not in positions and pos in (min(positions) - 1, max(positions) + 1)
+
+
+def assemble_context(citations: List[Dict], token_budget: int | None = None,
+                     dup_threshold: float = 0.8) -> tuple[str, list[dict]]:
     """
     Map citations to labels [S1].. and return (context_text, source_list_for_ui)
+
+    Hits are taken in order (best first): exact and near-duplicate chunks (Jaccard over
+    5-word shingles) are dropped, consecutive chunks of a page (by the `position` stored
+    at ingest) are merged under one label in document order, and blocks are added
+    greedily while they fit in `token_budget` (None = unbounded).
     """
-    lines = []
-    srcs = []
-    for i, h in enumerate(citations, 1):
+    blocks: list[dict] = []
+    seen_hashes: set[str] = set()
+    seen_shingles: list[set[str]] = []
+    used = 0
+    for h in citations:
         p = h["payload"] or {}
-        label = f"S{i}"
         url = p.get("url") or p.get("source_url")
         section = p.get("section") or ""
         text = p.get("text") or ""
+        pos = p.get("position")
+        digest = hashlib.sha1(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+        if digest in seen_hashes:
+            continue
+        sh = _shingles(text)
+        if _near_duplicate(sh, seen_shingles, dup_threshold):
+            continue
+        # a chunk can also bridge two blocks of the same page
+        touching = [b for b in blocks if _touches(b, url, h.get("collection"), pos)]
+        piece = text if touching else f"{section}\n{text}\n"
+        cost = count_tokens(piece)
+        if token_budget is not None and used + cost > token_budget:
+            continue
+        used += cost
+        seen_hashes.add(digest)
+        seen_shingles.append(sh)
+        if touching:
+            block = touching[0]
+            for other in touching[1:]:
+                block["pieces"] += other["pieces"]
+                blocks.remove(other)
+            block["pieces"].append((pos, section, text))
+            continue
+        blocks.append({"url": url, "pieces": [(pos, section, text)],
+                       "collection": h.get("collection")})
+
+    lines = []
+    srcs = []
+    for i, b in enumerate(blocks, 1):
+        label = f"S{i}"
+        pieces = sorted(b["pieces"], key=lambda q: q[0]) if len(b["pieces"]) > 1 else b["pieces"]
+        section = " / ".join(dict.fromkeys(sec for _, sec, _ in pieces if sec))
+        text = "\n\n".join(t for _, _, t in pieces)
         lines.append(f"[{label}] {section}\n{text}\n")
-        srcs.append({"label": label, "url": url, "section": section,
-                    "collection": h.get("collection")})
+        srcs.append({"label": label, "url": b["url"], "section": section,
+                    "collection": b["collection"]})
     context = "\n---\n".join(lines)
     return context, srcs
 
 
-def build_messages(query: str, citations: List[Dict]) -> tuple[list[dict], list[dict]]:
-    context_text, src_list = assemble_context(citations)
+def build_messages(query: str, citations: List[Dict], token_budget: int | None = None,
+                   history: list[dict] | None = None) -> tuple[list[dict], list[dict]]:
+    context_text, src_list = assemble_context(citations, token_budget=token_budget)
     user_msg = f"Question: {query}\n\nContexte (extraits documentaires):\n{context_text}\n\n" \
                f"Consigne: Utilise uniquement les extraits pertinents. Cite [S1], [S2] si utilisés."
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT_FR},
+        *(history or []),
         {"role": "user", "content": user_msg}
     ]
     return messages, src_list
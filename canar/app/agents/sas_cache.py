@@ -0,0 +1,87 @@
+from __future__ import annotations
+import hashlib
+import re
+import threading
+from ..state import DB
+from ..tracing import METRICS
+from .sas_lexer import COMMENT, STRING, sas_tokens
+
+# Content-addressed cache of SAS→R translations. SAS code is normalized (comments
+# stripped, whitespace collapsed, case folded outside string literals) before hashing,
+# so cosmetic edits of a block still hit. The user's instructions are part of the key
+# (a follow-up on the same upload is not a replay). Bump PROMPT_VERSION when the prompts change.
+
+PROMPT_VERSION = "sas2r-v1"
+
+def normalize_sas(code: str) -> str:
+    out = []
+    for kind, start, end in sas_tokens(code):
+        if kind == COMMENT:  # `/* */`, `* ...;` and `%* ...;`
+            out.append(" ")
+        elif kind == STRING:
+            out.append(code[start:end])
+        else:
+            out.append(code[start:end].lower())
+    text = re.sub(r"\s+", " ", "".join(out))
+    return re.sub(r"\s*([;=(),])\s*", r"\1", text).strip()
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(normalize_sas(code).encode("utf-8")).hexdigest()
+
+
+def context_hash(text: str | None) -> str:
+    """Hash of the user's text sent with the code (case / spacing folded), "" when empty."""
+    norm = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()[:16] if norm else ""
+
+
+class TranslationCache:
+    def __init__(self, db: DB, model: str, max_entries: int = 5000, prune_every: int = 100):
+        self.db = db
+        self.model = model
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def key(self, code: str, kind: str = "block", digest: str | None = None,
+            context: str = "") -> str:
+        # "block": R code of one DATA/PROC/macro block; "file": full answer for a whole upload
+        # `digest`: code_hash(code) when already computed (e.g. when the file was uploaded)
+        # `context`: context_hash of the user's text
+        return f"{kind}:{digest or code_hash(code)}:{context}:{self.model}:{PROMPT_VERSION}"
+
+    def get_many(self, codes: list[str], kind: str = "block",
+                 digests: list[str] | None = None, context: str = "") -> dict[int, str]:
+        """Cached translations by index in `codes`."""
+        keys = [self.key(c, kind, d, context)
+                for c, d in zip(codes, digests or [None] * len(codes))]
+        found = self.db.get_translations(sorted(set(keys)))
+        out = {i: found[k] for i, k in enumerate(keys) if k in found}
+        with self._lock:
+            self.hits += len(out)
+            self.misses += len(codes) - len(out)
+        METRICS.inc("sas_to_r", "translation_cache_hits", len(out))
+        METRICS.inc("sas_to_r", "translation_cache_misses", len(codes) - len(out))
+        return out
+
+    def get(self, code: str, kind: str = "block", digest: str | None = None,
+            context: str = "") -> str | None:
+        return self.get_many([code], kind, [digest] if digest else None, context).get(0)
+
+    def put(self, code: str, r_code: str, kind: str = "block", digest: str | None = None,
+            context: str = ""):
+        self.db.put_translation(self.key(code, kind, digest, context), r_code)
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % self.prune_every == 0
+        if prune:
+            self.db.prune_translations(self.max_entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
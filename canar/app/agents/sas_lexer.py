@@ -0,0 +1,43 @@
+from __future__ import annotations
+import re
+from typing import Iterator
+
+# Minimal SAS tokenizer shared by the block splitter (sas_pipeline) and the cache
+# normalization (sas_cache). `* ...;` and `%* ...;` are comments only at the start of a
+# statement, and their text is free: an apostrophe in them (`* l'année;`) must not open
+# a string literal that would swallow the rest of the program.
+
+_TOKEN_RE = re.compile(r"""(?P<comment>/\*.*?(?:\*/|\Z))
+                          |(?P<string>'[^']*(?:'|\Z)|"[^"]*(?:"|\Z))
+                          |(?P<semi>;)
+                          |(?P<space>\s+)
+                          |(?P<code>[^'"/;\s]+|/)""", re.S | re.X)
+_STMT_COMMENT_RE = re.compile(r"%?\*[^;]*;?")
+
+COMMENT, STRING, SEMI, SPACE, CODE = "comment", "string", "semi", "space", "code"
+
+
+def sas_tokens(code: str) -> Iterator[tuple[str, int, int]]:
+    """(kind, start, end) of every token of `code`; kinds: comment (`/* */` and comment
+    statements, the latter including their `;`), string, semi, space, code."""
+    pos, at_start = 0, True
+    while pos < len(code):
+        if at_start:
+            m = _STMT_COMMENT_RE.match(code, pos)
+            if m:
+                yield COMMENT, pos, m.end()
+                pos = m.end()
+                continue
+        m = _TOKEN_RE.match(code, pos)
+        kind = m.lastgroup
+        if kind == SEMI:
+            at_start = True
+        elif kind in (STRING, CODE):
+            at_start = False
+        yield kind, pos, m.end()
+        pos = m.end()
+
+
+def ends_statement(code: str, kind: str, end: int) -> bool:
+    """True for `;` and for comment statements (which carry their own `;`)."""
+    return kind == SEMI or (kind == COMMENT and code[end - 1] == ";")
@@ -0,0 +1,292 @@
+from __future__ import annotations
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Iterator
+from ..api.admission import CancelToken
+from ..api.llm_client import ChatClient
+from .sas_to_r import SYSTEM_PROMPT_FR
+from .sas_cache import TranslationCache, code_hash, context_hash
+from .sas_lexer import COMMENT, SPACE, ends_statement, sas_tokens
+
+# Translation of large SAS programs: the file is cut at DATA step / PROC / macro
+# boundaries, chunks are translated concurrently with a shared symbol table as context,
+# and the R fragments are stitched back in the original order.
+
+CHUNK_PROMPT_FR = """Voici un fragment ({index}/{total}, lignes {start}-{end}) d'un programme SAS plus long.
+Traduis UNIQUEMENT ce fragment en R. Les autres fragments sont traduits séparément :
+ne redéfinis pas ce qui vient d'ailleurs et garde les mêmes noms de tables et de variables.
+
+Symboles du programme complet :
+{symbols}
+
+```sas
+{code}
+```
+
+Le fragment contient {n} bloc(s) repérés par `/* @bloc k */`. Réponds avec un seul bloc ```r
+(commentaires en français), sans section Notes, où la traduction de chaque bloc commence par
+une ligne `# @bloc k` (même numéro)."""
+
+
+@dataclass
+class SasBlock:
+    kind: str  # "data" | "proc" | "macro" | "global"
+    start: int  # 1-based line numbers
+    end: int
+    code: str
+
+
+@dataclass
+class SymbolTable:
+    datasets: set[str] = field(default_factory=set)
+    macro_vars: set[str] = field(default_factory=set)
+    macros: set[str] = field(default_factory=set)
+    libnames: set[str] = field(default_factory=set)
+
+    def render(self) -> str:
+        def fmt(xs: set[str]) -> str:
+            return ", ".join(sorted(xs)) or "(aucun)"
+        return (f"- Tables : {fmt(self.datasets)}\n- Macro-variables : {fmt(self.macro_vars)}\n"
+                f"- Macros : {fmt(self.macros)}\n- Librairies : {fmt(self.libnames)}")
+
+
+_DS_NAME = r"([A-Za-z_&][\w.&]*)"
+
+
+def _statements(code: str) -> list[tuple[int, int, str]]:
+    """(start offset, end offset, text) of each `;`-terminated statement, ignoring ; in comments/strings."""
+    out = []
+    start = 0
+    for kind, _, end in sas_tokens(code):
+        if ends_statement(code, kind, end):
+            out.append((start, end, code[start:end]))
+            start = end
+    if code[start:].strip():
+        out.append((start, len(code), code[start:]))
+    return out
+
+
+def _head(stmt: str) -> str:
+    # statement text without leading comments, lowercased
+    for kind, start, _ in sas_tokens(stmt):
+        if kind not in (COMMENT, SPACE):
+            return stmt[start:].lower()
+    return ""
+
+
+def split_sas(code: str) -> list[SasBlock]:
+    blocks: list[SasBlock] = []
+    cur_kind, cur_start = None, 0
+
+    def close(end: int):
+        nonlocal cur_kind
+        text = code[cur_start:end]
+        if cur_kind is not None and text.strip():
+            first = cur_start + len(text) - len(text.lstrip())
+            blocks.append(SasBlock(cur_kind, code.count("\n", 0, first) + 1,
+                                   code.count("\n", 0, end) + 1, text.strip()))
+        cur_kind = None
+
+    for s, e, stmt in _statements(code):
+        h = _head(stmt)
+        if cur_kind == "macro":
+            if h.startswith("%mend"):
+                close(e)
+            continue
+        if h.startswith("%macro"):
+            close(s)
+            cur_kind, cur_start = "macro", s
+        elif re.match(r"data\s+(?!=)", h) or h.startswith("data;"):
+            close(s)
+            cur_kind, cur_start = "data", s
+        elif h.startswith("proc "):
+            close(s)
+            cur_kind, cur_start = "proc", s
+        elif re.match(r"(run|quit)\s*;", h) and cur_kind in ("data", "proc"):
+            close(e)
+        elif cur_kind is None:
+            cur_kind, cur_start = "global", s
+    close(len(code))
+    return blocks
+
+
+def build_symbols(code: str) -> SymbolTable:
+    sym = SymbolTable()
+    low = re.sub(r"/\*.*?\*/", " ", code, flags=re.S)
+    for m in re.finditer(r"(?i)\bdata\s+([^;=(]+?)\s*;", low):
+        sym.datasets.update(d for d in m.group(1).split() if not d.startswith("/"))
+    for pat in (rf"(?i)\b(?:set|merge|update)\s+{_DS_NAME}", rf"(?i)\b(?:data|out)\s*=\s*{_DS_NAME}",
+                rf"(?i)\bcreate\s+table\s+{_DS_NAME}", rf"(?i)\bfrom\s+{_DS_NAME}"):
+        sym.datasets.update(m.group(1) for m in re.finditer(pat, low))
+    sym.datasets = {d for d in sym.datasets if d.lower() != "_null_" and "&" not in d}
+    sym.macro_vars.update(m.group(1) for m in re.finditer(r"(?i)%let\s+(\w+)\s*=", low))
+    sym.macro_vars.update(m.group(1) for m in re.finditer(r"(?i)\binto\s*:\s*(\w+)", low))
+    sym.macros.update(m.group(1) for m in re.finditer(r"(?i)%macro\s+(\w+)", low))
+    sym.libnames.update(m.group(1) for m in re.finditer(r"(?i)\blibname\s+(\w+)", low))
+    return sym
+
+
+def split_block(b: SasBlock, max_lines: int) -> list[SasBlock]:
+    """`b` cut into pieces of at most `max_lines` lines, preferably after a line ending a
+    statement (a long macro or a program the splitter could not cut)."""
+    lines = b.code.split("\n")
+    if len(lines) <= max_lines:
+        return [b]
+    pieces, i = [], 0
+    while i < len(lines):
+        j = min(i + max_lines, len(lines))
+        if j < len(lines):
+            cut = next((k for k in range(j, i, -1) if lines[k - 1].rstrip().endswith(";")), j)
+            j = cut
+        pieces.append(SasBlock(b.kind, b.start + i, b.start + j - 1, "\n".join(lines[i:j])))
+        i = j
+    return pieces
+
+
+def group_blocks(blocks: list[SasBlock], max_lines: int = 150) -> list[list[SasBlock]]:
+    """Pack consecutive blocks into chunks of at most `max_lines` lines; a block longer
+    than that is split first (see `split_block`)."""
+    chunks: list[list[SasBlock]] = []
+    cur: list[SasBlock] = []
+    lines = 0
+    for b in (p for b in blocks for p in split_block(b, max_lines)):
+        n = b.end - b.start + 1
+        if cur and lines + n > max_lines:
+            chunks.append(cur)
+            cur, lines = [], 0
+        cur.append(b)
+        lines += n
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+def extract_r(text: str) -> str:
+    m = re.search(r"```[rR]\s*\n(.*?)```", text, re.S)
+    return (m.group(1) if m else text).strip()
+
+
+def stitch(sections: list[tuple[str, int, int]]) -> str:
+    """Ordered R script from (r_code, first SAS line, last SAS line); library() calls are hoisted."""
+    libs: list[str] = []
+    body: list[str] = []
+    for code, start, end in sections:
+        body.append(f"# ---- SAS lignes {start}-{end} ----")
+        for line in code.splitlines():
+            if re.match(r"\s*(library|require)\(", line):
+                if line.strip() not in libs:
+                    libs.append(line.strip())
+            else:
+                body.append(line)
+        body.append("")
+    return "\n".join(libs + ([""] if libs else []) + body).strip() + "\n"
+
+
+def split_by_markers(r_code: str, n: int) -> list[str] | None:
+    """Per-block R code from `# @bloc k` markers, or None if the model didn't keep them all."""
+    pieces = re.split(r"(?m)^\s*# @bloc (\d+)\s*$", r_code)
+    found = {int(k): v.strip() for k, v in zip(pieces[1::2], pieces[2::2])}
+    if sorted(found) != list(range(1, n + 1)):
+        return None
+    return [found[k] for k in range(1, n + 1)]
+
+
+@dataclass
+class PreparedSas:
+    """An uploaded program parsed and hashed ahead of the question (see `prepare_sas`)."""
+    code: str
+    digest: str  # code_hash of the whole file (file-level translation cache key)
+    lines: int
+    blocks: list[SasBlock]
+    block_digests: list[str]
+    symbols: str
+    elapsed_s: float = 0.0
+
+
+def prepare_sas(code: str) -> PreparedSas:
+    """Split, hash and extract the symbols of `code`; runs in the background on upload."""
+    t = time.perf_counter()
+    blocks = split_sas(code)
+    return PreparedSas(code, code_hash(code), code.count("\n"), blocks,
+                       [code_hash(b.code) for b in blocks], build_symbols(code).render(),
+                       time.perf_counter() - t)
+
+
+@dataclass
+class ChunkDone:
+    index: int  # 1-based
+    total: int
+    r_code: str
+
+
+def translate_sas(chat: ChatClient, code: str, user_text: str = "", parallelism: int = 4,
+                  max_lines: int = 150, temperature: float = 0.2, max_tokens: int = 4096,
+                  cache: TranslationCache | None = None,
+                  prepared: PreparedSas | None = None,
+                  cancel: CancelToken | None = None) -> Iterator[ChunkDone | str]:
+    """
+    Yield a ChunkDone per translated chunk (completion order), then the stitched R script.
+    At most `parallelism` requests are in flight against the LLM endpoint. With a
+    `cache`, blocks translated before are reused and only the others go to the LLM.
+    `prepared` (same `code`) skips the parsing already done at upload time.
+    Setting `cancel` (from any thread), closing the generator or an error in one chunk
+    aborts the requests in flight and drops the chunks not started yet.
+    """
+    cancel = CancelToken() if cancel is None else cancel
+    prepared = prepared or prepare_sas(code)
+    blocks = prepared.blocks
+    # a block translated under other instructions is not reused
+    ctx = context_hash(user_text)
+    cached = (cache.get_many([b.code for b in blocks], digests=prepared.block_digests, context=ctx)
+              if cache else {})
+    # pieces of a block split by group_blocks are cached under their own hash
+    digests = {(b.start, b.end): d for b, d in zip(blocks, prepared.block_digests)}
+    todo = [b for i, b in enumerate(blocks) if i not in cached]
+    chunks = group_blocks(todo, max_lines)
+    symbols = prepared.symbols
+    extra = f"\n\nContexte/contraintes supplémentaires: {user_text}" if user_text else ""
+
+    def run(i: int, chunk: list[SasBlock]) -> str:
+        sas = "\n".join(f"/* @bloc {k} */\n{b.code}" for k, b in enumerate(chunk, 1))
+        prompt = CHUNK_PROMPT_FR.format(index=i + 1, total=len(chunks), start=chunk[0].start,
+                                        end=chunk[-1].end, symbols=symbols, n=len(chunk),
+                                        code=sas) + extra
+        out = "".join(chat.stream_chat([{"role": "system", "content": SYSTEM_PROMPT_FR},
+                                        {"role": "user", "content": prompt}],
+                                       temperature=temperature, max_tokens=max_tokens,
+                                       cancel=cancel))
+        return extract_r(out)
+
+    # R code per block start line; a chunk whose markers got lost is kept whole
+    by_start: dict[int, tuple[str, int, int]] = {
+        b.start: (cached[i], b.start, b.end) for i, b in enumerate(blocks) if i in cached
+    }
+    pool = ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="canar-sas")
+    finished = False
+    try:
+        futures = {pool.submit(run, i, c): i for i, c in enumerate(chunks)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            chunk = chunks[i]
+            r_code = fut.result()
+            if cancel.is_set():
+                # an aborted chunk holds a truncated translation: neither cached nor used
+                return
+            per_block = split_by_markers(r_code, len(chunk))
+            if per_block is None:
+                by_start[chunk[0].start] = (re.sub(r"(?m)^\s*# @bloc \d+\s*$\n?", "", r_code),
+                                            chunk[0].start, chunk[-1].end)
+            else:
+                for b, rb in zip(chunk, per_block):
+                    by_start[b.start] = (rb, b.start, b.end)
+                    if cache:
+                        cache.put(b.code, rb, digest=digests.get((b.start, b.end)), context=ctx)
+            yield ChunkDone(i + 1, len(chunks), r_code)
+        finished = True
+    finally:
+        if not finished:
+            cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+    yield stitch([by_start[k] for k in sorted(by_start)])
@@ -9,7 +9,8 @@ Exigences:
 """
 
 
-def build_messages(user_text: str, sas_code: str | None) -> list[dict]:
+def build_messages(user_text: str, sas_code: str | None,
+                   history: list[dict] | None = None) -> list[dict]:
     prompt = ""
     if sas_code:
         prompt = f"Voici le code SAS à traduire:\n\n```sas\n{sas_code}\n```\n\n"
@@ -20,5 +21,6 @@ def build_messages(user_text: str, sas_code: str | None) -> list[dict]:
 
     return [
         {"role": "system", "content": SYSTEM_PROMPT_FR},
+        *(history or []),
         {"role": "user", "content": prompt}
     ]
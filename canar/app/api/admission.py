@@ -0,0 +1,359 @@
+from __future__ import annotations
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+from ..tracing import METRICS
+
+# Admission control for the shared model endpoints. Every ChatClient / EmbedClient of
+# the process goes through one controller per backend, which lets at most `limit`
+# requests in flight and adapts that limit AIMD-style: +1/limit per request answered
+# (first token) under `target_s`, x`backoff` (at most once per `cooldown_s`) when the
+# latency goes over target or the backend answers 429/503. With `state_path`, the
+# in-flight count and the limit live in a SQLite file shared by the processes of the
+# host (multi-worker deployments).
+
+T = TypeVar("T")
+RETRY_STATUSES = {429, 503}
+BACKOFF_BASE_S, BACKOFF_CAP_S = 0.5, 20.0
+MAX_RETRY_AFTER_S = 60.0  # a longer server Retry-After is not waited for in full
+
+
+class Overloaded(RuntimeError):
+    """No slot freed up within the queue timeout."""
+
+    def __init__(self, name: str, retry_after_s: float):
+        super().__init__(f"{name}: service saturé, réessayez dans ~{retry_after_s:.0f} s")
+        self.retry_after_s = retry_after_s
+
+
+class CancelToken(threading.Event):
+    """An Event that also runs callbacks when set, e.g. to close an upstream stream that
+    is blocked waiting for its first token."""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks: list[Callable[[], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def on_set(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """Run `fn` when the token is set (right away if it already is); returns a
+        function that unregisters it."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(fn)
+                return lambda: self._discard(fn)
+        fn()
+        return lambda: None
+
+    def _discard(self, fn: Callable[[], None]):
+        with self._callbacks_lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+
+class _SharedSlots:
+    """
+    Cross-process leases in a SQLite file. The leases held by this process are renewed
+    in the background, so they last as long as their stream; those of a crashed process
+    expire after `lease_ttl_s`.
+    """
+
+    def __init__(self, path: str, lease_ttl_s: float = 60.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lease_ttl_s = lease_ttl_s
+        self._local = threading.local()
+        self._held: set[int] = set()
+        self._held_lock = threading.Lock()
+        threading.Thread(target=self._renew, name="canar-admission-leases", daemon=True).start()
+        with self._conn() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS lease (id INTEGER PRIMARY KEY, name TEXT, "
+                      "pid INTEGER, ts REAL)")
+            c.execute("CREATE TABLE IF NOT EXISTS lim (name TEXT PRIMARY KEY, value REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0,
+                                                      isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def take(self, name: str, limit: int) -> Optional[int]:
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("DELETE FROM lease WHERE ts < ?", (time.time() - self.lease_ttl_s,))
+            (n,) = c.execute("SELECT COUNT(*) FROM lease WHERE name = ?", (name,)).fetchone()
+            lease = None
+            if n < limit:
+                lease = c.execute("INSERT INTO lease (name, pid, ts) VALUES (?, ?, ?)",
+                                  (name, os.getpid(), time.time())).lastrowid
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        if lease is not None:
+            with self._held_lock:
+                self._held.add(lease)
+        return lease
+
+    def release(self, lease: int):
+        with self._held_lock:
+            self._held.discard(lease)
+        self._conn().execute("DELETE FROM lease WHERE id = ?", (lease,))
+
+    def count(self, name: str) -> int:
+        """Live leases of `name` across the processes."""
+        (n,) = self._conn().execute("SELECT COUNT(*) FROM lease WHERE name = ? AND ts >= ?",
+                                    (name, time.time() - self.lease_ttl_s)).fetchone()
+        return n
+
+    def _renew(self):
+        while True:
+            time.sleep(self.lease_ttl_s / 3)
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self._conn().execute(
+                    f"UPDATE lease SET ts = ? WHERE id IN ({','.join('?' * len(held))})",
+                    (time.time(), *held))
+            except sqlite3.Error as e:
+                print(f"[canar] admission lease renewal failed: {e}")
+
+    def load_limit(self, name: str) -> Optional[float]:
+        row = self._conn().execute("SELECT value FROM lim WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def store_limit(self, name: str, value: float):
+        self._conn().execute("INSERT OR REPLACE INTO lim (name, value) VALUES (?, ?)", (name, value))
+
+
+class AdmissionController:
+    def __init__(self, name: str, initial_limit: float = 8, min_limit: float = 1,
+                 max_limit: float = 64, target_s: float = 2.0, backoff: float = 0.7,
+                 cooldown_s: float = 2.0, queue_timeout_s: float = 120.0, state_path: str = ""):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_s = target_s
+        self.backoff = backoff
+        self.cooldown_s = cooldown_s
+        self.queue_timeout_s = queue_timeout_s
+        self.inflight = 0
+        self.waiting = 0
+        self.hold_s = 1.0  # EWMA of how long a slot is held, for wait estimates
+        self._last_decrease = 0.0
+        self._cv = threading.Condition()
+        self._shared = _SharedSlots(state_path) if state_path else None
+        if self._shared:
+            self.limit = self._shared.load_limit(name) or self.limit
+
+    # -- slots --
+
+    def try_acquire(self) -> Optional[tuple]:
+        """A lease if a slot is free right now, else None (never blocks)."""
+        with self._cv:
+            if self._shared:
+                self.limit = self._shared.load_limit(self.name) or self.limit
+                lease = self._shared.take(self.name, max(1, int(self.limit)))
+                if lease is None:
+                    return None
+            elif self.inflight >= max(1, int(self.limit)):
+                return None
+            else:
+                lease = 0
+            self.inflight += 1
+            return lease, time.monotonic()
+
+    def acquire(self, timeout_s: Optional[float] = None,
+                cancel: Optional[threading.Event] = None) -> Optional[tuple]:
+        """A lease, waiting at most the queue timeout (then Overloaded); None when `cancel`
+        is set while waiting."""
+        t0 = time.monotonic()
+        deadline = t0 + (self.queue_timeout_s if timeout_s is None else timeout_s)
+        with self._cv:
+            self.waiting += 1
+        try:
+            while True:
+                lease = self.try_acquire()
+                if lease is not None:
+                    METRICS.observe(self.name, "admission_wait", time.monotonic() - t0)
+                    return lease
+                if cancel is not None and cancel.is_set():
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    METRICS.inc(self.name, "admission_rejected", 1)
+                    raise Overloaded(self.name, self.estimated_wait_s())
+                with self._cv:
+                    # other processes free slots without notifying us (nor does a
+                    # cancel): poll when shared or cancellable
+                    poll = self._shared or cancel is not None
+                    self._cv.wait(min(remaining, 0.05) if poll else remaining)
+        finally:
+            with self._cv:
+                self.waiting -= 1
+
+    async def aacquire(self, timeout_s: Optional[float] = None) -> tuple:
+        """`acquire` for event loops: polls instead of blocking a thread."""
+        t0 = time.monotonic()
+        deadline = t0 + (self.queue_timeout_s if timeout_s is None else timeout_s)
+        with self._cv:
+            self.waiting += 1
+        try:
+            # the shared slots are taken in a SQLite transaction (up to a 5 s busy wait):
+            # off the event loop
+            while (lease := (await asyncio.to_thread(self.try_acquire) if self._shared
+                             else self.try_acquire())) is None:
+                if time.monotonic() >= deadline:
+                    METRICS.inc(self.name, "admission_rejected", 1)
+                    raise Overloaded(self.name, self.estimated_wait_s())
+                await asyncio.sleep(0.02)
+            METRICS.observe(self.name, "admission_wait", time.monotonic() - t0)
+            return lease
+        finally:
+            with self._cv:
+                self.waiting -= 1
+
+    def release(self, lease: tuple):
+        lease_id, t0 = lease
+        with self._cv:
+            if self._shared:
+                self._shared.release(lease_id)
+            self.inflight -= 1
+            self.hold_s = 0.8 * self.hold_s + 0.2 * (time.monotonic() - t0)
+            self._cv.notify()
+
+    @contextmanager
+    def slot(self, timeout_s: Optional[float] = None) -> Iterator[None]:
+        lease = self.acquire(timeout_s)
+        try:
+            yield
+        finally:
+            self.release(lease)
+
+    # -- feedback --
+
+    def record(self, latency_s: Optional[float] = None, overloaded: bool = False):
+        """Feed one observation: a first-token / response latency, or an overload signal."""
+        with self._cv:
+            now = time.monotonic()
+            if overloaded or (latency_s is not None and latency_s > self.target_s):
+                if now - self._last_decrease < self.cooldown_s:
+                    return
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+            elif latency_s is not None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._cv.notify()
+            else:
+                return
+            if self._shared:
+                self._shared.store_limit(self.name, self.limit)
+
+    def estimated_wait_s(self) -> float:
+        """Rough queueing delay for a request arriving now (0 when a slot is free)."""
+        # with shared slots, those of the other processes count too
+        inflight = self._shared.count(self.name) if self._shared else self.inflight
+        with self._cv:
+            limit = max(1, int(self.limit))
+            if inflight < limit and not self.waiting:
+                return 0.0
+            return (self.waiting + 1) * self.hold_s / limit
+
+    def stats(self) -> dict:
+        return {"limit": round(self.limit, 2), "inflight": self.inflight, "waiting": self.waiting,
+                "hold_s": round(self.hold_s, 3)}
+
+
+def backoff_delay(attempt: int, base_s: float = BACKOFF_BASE_S, cap_s: float = BACKOFF_CAP_S,
+                  retry_after_s: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff; a server Retry-After (up to MAX_RETRY_AFTER_S) is
+    honoured as a floor."""
+    delay = random.uniform(0, min(cap_s, base_s * 2 ** attempt))
+    return max(delay, min(retry_after_s or 0.0, MAX_RETRY_AFTER_S))
+
+
+def retry_budget_s(attempts: int, attempt_timeout_s: float) -> float:
+    """Longest `call_with_retries(fn, attempts)` can take when one call of `fn` takes at
+    most `attempt_timeout_s`: every attempt plus the longest backoff before each retry."""
+    return ((attempts + 1) * attempt_timeout_s
+            + sum(max(min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** a), MAX_RETRY_AFTER_S)
+                  for a in range(attempts)))
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Retry-After in seconds (0 if absent) when `exc` is an HTTP 429/503 (openai or requests), else None."""
+    resp = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(resp, "status_code", None)
+    if status not in RETRY_STATUSES:
+        return None
+    try:
+        return float(resp.headers.get("retry-after") or 0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+def call_with_retries(fn: Callable[[], T], attempts: int = 3,
+                      controller: Optional[AdmissionController] = None) -> T:
+    """Call `fn`, retrying 429/503 answers with jittered backoff; each one is fed to `controller`."""
+    for attempt in range(attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            wait = retry_after(e)
+            if wait is None or attempt == attempts:
+                raise
+            if controller:
+                controller.record(overloaded=True)
+                METRICS.inc(controller.name, "upstream_retries", 1)
+            time.sleep(backoff_delay(attempt, retry_after_s=wait))
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retries(fn: Callable[[], Awaitable[T]], attempts: int = 3,
+                             controller: Optional[AdmissionController] = None) -> T:
+    for attempt in range(attempts + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            wait = retry_after(e)
+            if wait is None or attempt == attempts:
+                raise
+            if controller:
+                controller.record(overloaded=True)
+                METRICS.inc(controller.name, "upstream_retries", 1)
+            await asyncio.sleep(backoff_delay(attempt, retry_after_s=wait))
+    raise AssertionError("unreachable")
+
+
+_CONTROLLERS: dict[str, AdmissionController] = {}
+_CONTROLLERS_LOCK = threading.Lock()
+
+
+def get_controller(name: str, **kwargs) -> AdmissionController:
+    """Process-wide controller per backend name (first caller's settings win)."""
+    with _CONTROLLERS_LOCK:
+        if name not in _CONTROLLERS:
+            _CONTROLLERS[name] = AdmissionController(name, **kwargs)
+        return _CONTROLLERS[name]
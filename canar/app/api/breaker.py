@@ -0,0 +1,76 @@
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from typing import Callable, TypeVar
+from ..tracing import METRICS
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """
+    Latency/error circuit breaker over the last `window` calls. It opens when their
+    p95 latency exceeds `p95_s` or their error rate reaches `error_rate` (after at least
+    `min_calls`), sends callers to the fallback for `open_s`, then lets a single probe
+    call through: a fast success closes it again, anything else re-opens it.
+    """
+
+    def __init__(self, name: str, p95_s: float = 2.0, error_rate: float = 0.5,
+                 window: int = 50, min_calls: int = 10, open_s: float = 30.0):
+        self.name = name
+        self.p95_s = p95_s
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.open_s = open_s
+        self.state = "closed"
+        self._calls: deque[tuple[float, bool]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.open_s:
+                self.state, self._probing = "half_open", False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def _open(self):
+        self.state, self._opened_at = "open", time.monotonic()
+        self._calls.clear()
+        METRICS.inc(self.name, "breaker_open", 1)
+
+    def record(self, latency_s: float, ok: bool):
+        with self._lock:
+            if self.state == "half_open":
+                if ok and latency_s <= self.p95_s:
+                    self.state = "closed"
+                else:
+                    self._open()
+                return
+            self._calls.append((latency_s, ok))
+            if len(self._calls) < self.min_calls:
+                return
+            errors = sum(1 for _, good in self._calls if not good) / len(self._calls)
+            lat = sorted(t for t, _ in self._calls)
+            if errors >= self.error_rate or lat[int(0.95 * (len(lat) - 1))] > self.p95_s:
+                self._open()
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        t = time.monotonic()
+        try:
+            out = fn(*args, **kwargs)
+        except Exception:
+            self.record(time.monotonic() - t, ok=False)
+            raise
+        self.record(time.monotonic() - t, ok=True)
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "calls": len(self._calls)}
@@ -1,21 +1,170 @@
 from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Optional
 import requests
 import numpy as np
+from .admission import AdmissionController, call_with_retries, retry_budget_s
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    return m
+
+
+class _Coalescer:
+    """
+    Background micro-batcher of one EmbedClient: queries submitted within `window_ms`
+    of each other (up to `max_batch`) are sent to the backend as a single /embeddings call.
+    Batches are sent by up to `senders` threads, so a slow call does not hold the next ones.
+    """
+
+    def __init__(self, client: EmbedClient, window_ms: float, max_batch: int, senders: int):
+        self.client = client
+        self.window_s = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.q: queue.Queue[tuple[str, Future] | None] = queue.Queue()  # None: stop
+        self.pool = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="canar-embed")
+        threading.Thread(target=self._run, name="canar-embed-batcher", daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self.q.put((text, fut))
+        return fut
+
+    def close(self):
+        self.q.put(None)
+
+    def _run(self):
+        while (first := self.q.get()) is not None:
+            batch = [first]
+            try:
+                # first item arrived: wait at most one window for companions
+                batch.append(self.q.get(timeout=self.window_s))
+                while len(batch) < self.max_batch:
+                    batch.append(self.q.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:  # closed while batching: serve the batch, then stop
+                batch = [b for b in batch if b is not None]
+                self.q.put(None)
+            self.pool.submit(self._send, batch)
+        self.pool.shutdown(wait=False)
+
+    def _send(self, batch: list[tuple[str, Future]]):
+        try:
+            vecs = self.client.embed_many([t for t, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for (_, fut), v in zip(batch, vecs):
+            fut.set_result(v)
 
 
 class EmbedClient:
-    def __init__(self, base_url: str, model: str, api_key: str = ""):
+    def __init__(self, base_url: str, model: str, api_key: str = "",
+                 coalesce: bool = True, window_ms: float = 5.0, max_batch: int = 32,
+                 admission: Optional[AdmissionController] = None, retries: int = 3):
         self.url = base_url.rstrip("/") + "/embeddings"
         self.model = model
         self.key = api_key
+        self.max_batch = max_batch
+        self.admission = admission
+        self.retries = retries
+        self.timeout_s = 60.0  # per HTTP attempt
+        # persistent session: keep-alive connections, no TLS handshake per query
+        self.session = requests.Session()
+        self.session.headers["Content-Type"] = "application/json"
+        if self.key:
+            self.session.headers["Authorization"] = f"Bearer {self.key}"
+        # one per client; the app shares its client between all sessions of the process.
+        # Batches in flight are bounded by the admission limit (each one holds a slot)
+        senders = int(admission.max_limit) if admission else 4
+        self._coalescer = _Coalescer(self, window_ms, max_batch, senders) if coalesce else None
+
+    def embed_many(self, texts: list[str]) -> list[list[float]]:
+        """Embed `texts` in chunks of `max_batch`, L2-normalized as a whole matrix."""
+        out: list[list[float]] = []
+        for i in range(0, len(texts), self.max_batch):
+            chunk = texts[i:i + self.max_batch]
+            r = self._post(chunk)
+            data = sorted(r.json()["data"], key=lambda d: d.get("index", 0))
+            m = np.array([d["embedding"] for d in data], dtype="float32")
+            out.extend(_normalize(m).tolist())
+        return out
+
+    def _post(self, chunk: list[str]) -> requests.Response:
+        latency = 0.0
+
+        def post():
+            nonlocal latency
+            t = time.monotonic()
+            r = self.session.post(self.url, json={"model": self.model, "input": chunk},
+                                  timeout=self.timeout_s)
+            latency = time.monotonic() - t
+            r.raise_for_status()
+            return r
+
+        with self.admission.slot() if self.admission else nullcontext():
+            r = call_with_retries(post, self.retries, self.admission)
+        if self.admission:
+            self.admission.record(latency)
+        return r
+
+    def close(self):
+        if self._coalescer is not None:
+            self._coalescer.close()
+        self.session.close()
+
+    def max_wait_s(self) -> float:
+        """Longest a call can legitimately take: the admission queue, then the retries."""
+        queue_s = self.admission.queue_timeout_s if self.admission else 0.0
+        return queue_s + retry_budget_s(self.retries, self.timeout_s)
 
     def embed_query(self, text: str) -> list[float]:
-        headers = {"Content-Type": "application/json"}
-        if self.key:
-            headers["Authorization"] = f"Bearer {self.key}"
-        r = requests.post(self.url, json={"model": self.model, "input": [text]},
-                          headers=headers, timeout=60)
-        r.raise_for_status()
-        v = np.array(r.json()["data"][0]["embedding"], dtype="float32")
-        v /= (np.linalg.norm(v) + 1e-12)
-        return v.tolist()
+        if self._coalescer is None:
+            return self.embed_many([text])[0]
+        # a coalesced query waits for its batch: never give up before the batch call would
+        fut = self._coalescer.submit(text)
+        return fut.result(timeout=self.max_wait_s() + self._coalescer.window_s)
+
+
+class OnnxEmbedder:
+    """
+    Query embeddings computed in-process with ONNX Runtime, used when the embedding
+    service is unreachable. `model_dir` (model.onnx + tokenizer.json) must be an export
+    of the very model behind EMBED_BASE, otherwise vectors are not comparable.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 512, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), opts,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def embed_many(self, texts: list[str]) -> list[list[float]]:
+        enc = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in enc], dtype="int64")
+        feeds = {"input_ids": np.array([e.ids for e in enc], dtype="int64"), "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in enc], dtype="int64")
+        out = self.session.run(None, feeds)[0]
+        if out.ndim == 3:  # token embeddings: mean pooling over the attention mask
+            out = (out * mask[..., None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+        return _normalize(out.astype("float32")).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_many([text])[0]
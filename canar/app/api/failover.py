@@ -0,0 +1,99 @@
+from __future__ import annotations
+import threading
+from typing import Any, Dict, Optional
+from .breaker import CircuitBreaker
+from .embed_client import EmbedClient, OnnxEmbedder
+from .local_index import LocalRetrievalEngine, get_local_engine
+from .retrieval import RetrievalBackend, get_engine
+
+
+class FailoverRetriever:
+    """
+    Query embedding + retrieval for r_helpdesk with a local fallback.
+
+    mode "qdrant": remote embedding service and Qdrant only (no fallback).
+    mode "local":  the local snapshot (see local_index) serves every search.
+    mode "auto":   remote first; a circuit breaker per remote dependency switches to the
+                   local snapshot / local embedder when its p95 latency or error rate
+                   crosses the threshold, and probes the remote again after `open_s`.
+    Without any embedding (service down, no local embedder), retrieval is BM25-only.
+    """
+
+    def __init__(self, embed: EmbedClient, qdrant_url: str, api_key: str | None,
+                 mode: str = "qdrant", local_dir: str = "",
+                 local_embedder: Optional[OnnxEmbedder] = None,
+                 p95_s: float = 2.0, error_rate: float = 0.5, open_s: float = 30.0,
+                 payload_cache_size: int = 4096):
+        self.embed = embed
+        self.qdrant_url = qdrant_url
+        self.api_key = api_key
+        self.mode = mode
+        self.local_dir = local_dir
+        self.local_embedder = local_embedder
+        self.payload_cache_size = payload_cache_size
+        self.embed_breaker = CircuitBreaker("embed", p95_s=p95_s, error_rate=error_rate, open_s=open_s)
+        self.search_breaker = CircuitBreaker("qdrant", p95_s=p95_s, error_rate=error_rate,
+                                             open_s=open_s)
+
+    def _local(self) -> LocalRetrievalEngine | None:
+        return get_local_engine(self.local_dir) if self.mode != "qdrant" and self.local_dir else None
+
+    def embed_query(self, text: str) -> Optional[list[float]]:
+        if self.mode == "qdrant":
+            return self.embed.embed_query(text)
+        if self.mode == "local" and self.local_embedder:
+            return self.local_embedder.embed_query(text)
+        if self.embed_breaker.allow():
+            try:
+                return self.embed_breaker.call(self.embed.embed_query, text)
+            except Exception:
+                pass
+        return self.local_embedder.embed_query(text) if self.local_embedder else None
+
+    def search(self, collections: list[str], query_vector: Optional[list[float]], question: str,
+               **kwargs) -> tuple[list[Dict[str, Any]], str]:
+        """(hits, name of the backend that served them); `kwargs` as `RetrievalEngine.search`."""
+        if query_vector is None:
+            kwargs["query_text"] = question  # no embedding: lexical retrieval only
+        local = self._local()
+        if self.mode == "local" and local:
+            return local.search(collections, query_vector, **kwargs), "local"
+        remote: RetrievalBackend = get_engine(self.qdrant_url, self.api_key,
+                                              payload_cache_size=self.payload_cache_size)
+        if local is None:
+            return remote.search(collections, query_vector, **kwargs), "qdrant"
+        if self.search_breaker.allow():
+            try:
+                return self.search_breaker.call(remote.search, collections, query_vector,
+                                                strict=True, **kwargs), "qdrant"
+            except Exception:
+                pass
+        return local.search(collections, query_vector, **kwargs), "local"
+
+    def version(self, collections: list[str]) -> tuple:
+        """Identity of the indexed content, for caches of answers built on it: the physical
+        collections behind the aliases (they change when canar-ingest switches them)."""
+        if self.mode == "local":
+            return ("local", *collections)  # the snapshot is loaded once per process
+        return get_engine(self.qdrant_url, self.api_key,
+                          payload_cache_size=self.payload_cache_size).physical(collections)
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "embed": self.embed_breaker.stats(),
+                "qdrant": self.search_breaker.stats(), "local_index": self._local() is not None}
+
+
+_RETRIEVERS: dict[tuple, FailoverRetriever] = {}
+_RETRIEVERS_LOCK = threading.Lock()
+
+
+def get_retriever(embed: EmbedClient, qdrant_url: str, api_key: str | None, mode: str = "qdrant",
+                  local_dir: str = "", local_embed_model_dir: str = "", **kwargs) -> FailoverRetriever:
+    """Process-wide retriever (breaker state is shared by all sessions)."""
+    key = (qdrant_url, api_key or "", mode, local_dir, local_embed_model_dir)
+    with _RETRIEVERS_LOCK:
+        if key not in _RETRIEVERS:
+            local_embedder = OnnxEmbedder(local_embed_model_dir) if local_embed_model_dir else None
+            _RETRIEVERS[key] = FailoverRetriever(embed, qdrant_url, api_key, mode, local_dir,
+                                                 local_embedder, **kwargs)
+        return _RETRIEVERS[key]
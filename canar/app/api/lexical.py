@@ -0,0 +1,91 @@
+from __future__ import annotations
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Filter
+
+# identifiers such as `pivot_longer`, `data.table` or `fread` are kept as single tokens
+_TOKEN_RE = re.compile(r"[\w][\w.]*\w|\w", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t.lower() for t in _TOKEN_RE.findall(text or "")]
+
+
+class BM25Index:
+    """In-memory Okapi BM25 inverted index over the `text` payload of one collection."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: list[Any] = []
+        self.payloads: list[dict] = []
+        self.doc_len: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        self.avgdl = 0.0
+
+    def add(self, point_id: Any, payload: dict):
+        tokens = tokenize((payload or {}).get("text", ""))
+        doc = len(self.ids)
+        self.ids.append(point_id)
+        self.payloads.append(payload or {})
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings[term].append((doc, tf))
+
+    def finalize(self):
+        self.avgdl = (sum(self.doc_len) / len(self.doc_len)) if self.doc_len else 0.0
+
+    @classmethod
+    def from_collection(cls, client: QdrantClient, collection: str, flt: Filter | None = None,
+                        batch: int = 512) -> BM25Index:
+        idx = cls()
+        offset = None
+        while True:
+            points, offset = client.scroll(collection_name=collection, scroll_filter=flt, limit=batch,
+                                           offset=offset, with_payload=True, with_vectors=False)
+            for p in points:
+                idx.add(p.id, p.payload)
+            if offset is None:
+                break
+        idx.finalize()
+        return idx
+
+    def search(self, query: str, limit: int = 10) -> list[Dict[str, Any]]:
+        n = len(self.ids)
+        if not n:
+            return []
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc] / (self.avgdl or 1.0))
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [{"id": self.ids[d], "score": s, "payload": self.payloads[d]} for d, s in best]
+
+
+def reciprocal_rank_fusion(ranked_lists: list[tuple[float, list[Dict[str, Any]]]],
+                           k: int = 60) -> list[Dict[str, Any]]:
+    """
+    Fuse several ranked hit lists given as (weight, hits). Hits are identified by
+    (collection, id); each one gets sum(weight / (k + rank)) over the lists it appears in.
+    """
+    fused: dict[tuple[str, Any], Dict[str, Any]] = {}
+    for weight, hits in ranked_lists:
+        for rank, h in enumerate(hits, 1):
+            key = (h["collection"], h["id"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**h, "score": 0.0}
+            entry["score"] += weight / (k + rank)
+    out = sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+    top = out[0]["score"] if out else 1.0
+    for h in out:
+        h["score_norm"] = h["score"] / top
+    return out
@@ -1,20 +1,113 @@
 from __future__ import annotations
-from typing import Iterable
-from openai import OpenAI
+import time
+from typing import AsyncIterator, Iterable, Optional
+from openai import AsyncOpenAI, OpenAI
+from .admission import AdmissionController, CancelToken, acall_with_retries, call_with_retries
 
 
 class ChatClient:
-    def __init__(self, base_url: str, api_key: str, model: str):
-        self.client = OpenAI(base_url=base_url.rstrip("/"), api_key=api_key or "EMPTY")
+    """
+    Streaming chat client. With an `admission` controller, each stream holds one of its
+    slots until it ends and reports its time-to-first-token; 429/503 answers are retried
+    here with jittered backoff (the SDK's own retries are off).
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str,
+                 admission: Optional[AdmissionController] = None, retries: int = 3):
+        self.client = OpenAI(base_url=base_url.rstrip("/"), api_key=api_key or "EMPTY", max_retries=0)
         self.model = model
+        self.admission = admission
+        self.retries = retries
+        self._base_url = base_url.rstrip("/")
+        self._api_key = api_key or "EMPTY"
+        self._aclient: AsyncOpenAI | None = None
+
+    def close(self):
+        self.client.close()
+
+    def estimated_wait_s(self) -> float:
+        return self.admission.estimated_wait_s() if self.admission else 0.0
 
     def stream_chat(self, messages: list[dict], temperature: float = 0.2, top_p: float = 1.0,
-                    max_tokens: int = 2048) -> Iterable[str]:
-        resp = self.client.chat.completions.create(
-            model=self.model, messages=messages, temperature=temperature, top_p=top_p,
-            max_tokens=max_tokens, stream=True
-        )
-        for chunk in resp:
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                yield delta.content
+                    max_tokens: int = 2048, cancel: Optional[CancelToken] = None) -> Iterable[str]:
+        """With `cancel`, the stream ends without a token when it is set before a slot is
+        granted, and the upstream stream is closed as soon as it is set afterwards (also
+        while waiting for the first token), which ends this stream early."""
+        if cancel is not None and cancel.is_set():
+            return
+        lease = self.admission.acquire(cancel=cancel) if self.admission else None
+        if cancel is not None and cancel.is_set():
+            if lease:
+                self.admission.release(lease)
+            return
+        t0 = time.monotonic()
+
+        def create():
+            nonlocal t0
+            t0 = time.monotonic()
+            return self.client.chat.completions.create(
+                model=self.model, messages=messages, temperature=temperature, top_p=top_p,
+                max_tokens=max_tokens, stream=True
+            )
+
+        resp = None
+        unregister = None
+        try:
+            resp = call_with_retries(create, self.retries, self.admission)
+            if cancel is not None:
+                unregister = cancel.on_set(resp.close)
+            first = True
+            for chunk in resp:
+                delta = chunk.choices[0].delta
+                if delta and delta.content:
+                    if first and self.admission:
+                        self.admission.record(time.monotonic() - t0)
+                    first = False
+                    yield delta.content
+        except Exception:
+            # the read interrupted by a cancel
+            if cancel is not None and cancel.is_set():
+                return
+            raise
+        finally:
+            # also runs when the consumer stops early: release the upstream stream
+            if unregister:
+                unregister()
+            if resp is not None:
+                resp.close()
+            if lease:
+                self.admission.release(lease)
+
+    async def astream_chat(self, messages: list[dict], temperature: float = 0.2, top_p: float = 1.0,
+                           max_tokens: int = 2048, admitted: bool = False) -> AsyncIterator[str]:
+        """Async twin of `stream_chat` (the async client is created on first use). With
+        `admitted`, the caller holds (and releases) the admission slot of this stream."""
+        if self._aclient is None:
+            self._aclient = AsyncOpenAI(base_url=self._base_url, api_key=self._api_key, max_retries=0)
+        lease = await self.admission.aacquire() if self.admission and not admitted else None
+        t0 = time.monotonic()
+
+        async def create():
+            nonlocal t0
+            t0 = time.monotonic()
+            return await self._aclient.chat.completions.create(
+                model=self.model, messages=messages, temperature=temperature, top_p=top_p,
+                max_tokens=max_tokens, stream=True
+            )
+
+        resp = None
+        try:
+            resp = await acall_with_retries(create, self.retries, self.admission)
+            first = True
+            async for chunk in resp:
+                delta = chunk.choices[0].delta
+                if delta and delta.content:
+                    if first and self.admission:
+                        self.admission.record(time.monotonic() - t0)
+                    first = False
+                    yield delta.content
+        finally:
+            if resp is not None:
+                await resp.close()
+            if lease:
+                self.admission.release(lease)
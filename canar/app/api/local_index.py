@@ -0,0 +1,221 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict
+import numpy as np
+from .lexical import BM25Index
+from .retrieval import merge_results, with_norm
+
+# Local snapshot of Qdrant collections, served in-process. One directory per collection:
+#   meta.json        {"collection", "dim", "dtype", "count", "sources"}
+#   vectors.npy      (count, dim) float16, or int8 with per-row scales in scales.npy
+#   source.npy       int16 code of the `source` payload field (-1 if absent)
+#   payloads.jsonl   one {"id", "payload"} line per point, byte offsets in offsets.npy
+# Arrays are memory-mapped; a query is one blocked mat-vec product + argpartition,
+# well under a millisecond for the utilitr collections. Vectors are L2-normalized at
+# snapshot time, so scores are cosine similarities as in Qdrant.
+
+_BLOCK = 65536
+
+
+class LocalCollection:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = (np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+                       if self.meta["dtype"] == "int8" else None)
+        self.source = np.load(os.path.join(path, "source.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self._payloads = open(os.path.join(path, "payloads.jsonl"), "rb")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return int(self.meta["count"])
+
+    def point(self, i: int) -> dict:
+        with self._lock:
+            self._payloads.seek(int(self.offsets[i]))
+            return json.loads(self._payloads.read(int(self.offsets[i + 1] - self.offsets[i])))
+
+    def mask(self, source_filter: str | None) -> np.ndarray | None:
+        if not source_filter:
+            return None
+        sources = self.meta["sources"]
+        code = sources.index(source_filter) if source_filter in sources else -2
+        return np.asarray(self.source) == code
+
+    def search(self, query_vector: list[float], limit: int,
+               source_filter: str | None = None) -> list[Dict[str, Any]]:
+        n = len(self)
+        if not n:
+            return []
+        q = np.asarray(query_vector, dtype="float32")
+        q /= (np.linalg.norm(q) + 1e-12)
+        scores = np.empty(n, dtype="float32")
+        for s in range(0, n, _BLOCK):
+            scores[s:s + _BLOCK] = self.vectors[s:s + _BLOCK].astype("float32") @ q
+        if self.scales is not None:
+            scores *= self.scales
+        mask = self.mask(source_filter)
+        if mask is not None:
+            scores[~mask] = -np.inf
+        k = min(limit, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        out = []
+        for i in top:
+            if not np.isfinite(scores[i]):
+                break
+            p = self.point(int(i))
+            out.append({"id": p["id"], "score": float(scores[i]), "payload": p["payload"]})
+        return out
+
+    def close(self):
+        self._payloads.close()
+
+
+class LocalRetrievalEngine:
+    """`RetrievalBackend` over the snapshots found in `index_dir` (same results shape as Qdrant)."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.collections: dict[str, LocalCollection] = {}
+        for name in sorted(os.listdir(index_dir)):
+            if os.path.exists(os.path.join(index_dir, name, "meta.json")):
+                self.collections[name] = LocalCollection(os.path.join(index_dir, name))
+        self._lexical: dict[tuple[str, str | None], BM25Index] = {}
+        self._lexical_lock = threading.Lock()
+
+    def _lexical_index(self, col: str, source_filter: str | None) -> BM25Index:
+        key = (col, source_filter)
+        with self._lexical_lock:
+            idx = self._lexical.get(key)
+            if idx is None:
+                lc = self.collections[col]
+                mask = lc.mask(source_filter)
+                idx = BM25Index()
+                for i in range(len(lc)):
+                    if mask is None or mask[i]:
+                        p = lc.point(i)
+                        idx.add(p["id"], p["payload"])
+                idx.finalize()
+                self._lexical[key] = idx
+            return idx
+
+    def search(self, collections: list[str], query_vector: list[float] | None,
+               top_k_per_collection: int = 5, source_filter: str | None = "utilitr",
+               timeout_s: float | None = None, query_text: str | None = None,
+               rrf_k: int = 60, collection_weights: dict[str, float] | None = None,
+               top_k: int = 8, strict: bool = False,
+               profile: str | None = None) -> list[Dict[str, Any]]:
+        # brute force over the snapshot: always exact, `profile` does not apply
+        cols = [c for c in collections if c in self.collections]
+        results = []
+        if query_vector is not None:
+            results += [(c, with_norm(c, self.collections[c].search(query_vector, top_k_per_collection,
+                                                                    source_filter)))
+                        for c in cols]
+        if query_text:
+            results += [(c, [{**h, "collection": c} for h in
+                             self._lexical_index(c, source_filter).search(query_text,
+                                                                          top_k_per_collection)])
+                        for c in cols]
+        return merge_results(results, query_text, rrf_k, collection_weights, top_k)
+
+    def close(self):
+        for lc in self.collections.values():
+            lc.close()
+
+
+def snapshot_collection(client, collection: str, out_dir: str, dtype: str = "float16",
+                        batch: int = 512) -> int:
+    """
+    Dump `collection` (vectors + payloads) to `out_dir/collection`. Written next to the
+    live snapshot, then swapped in, so a running engine never sees a partial one.
+    Returns the number of points.
+    """
+    final = os.path.join(out_dir, collection)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    vecs: list[np.ndarray] = []
+    sources: list[str | None] = []
+    offsets = [0]
+    offset = None
+    with open(os.path.join(tmp, "payloads.jsonl"), "wb") as f:
+        while True:
+            points, offset = client.scroll(collection_name=collection, limit=batch, offset=offset,
+                                           with_payload=True, with_vectors=True)
+            for p in points:
+                v = p.vector
+                if isinstance(v, dict):  # named vectors: the first one
+                    v = next(iter(v.values()))
+                vecs.append(np.asarray(v, dtype="float32"))
+                sources.append((p.payload or {}).get("source"))
+                line = (json.dumps({"id": p.id, "payload": p.payload}, ensure_ascii=False)
+                        + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+            if offset is None:
+                break
+    m = np.vstack(vecs) if vecs else np.zeros((0, 0), dtype="float32")
+    m /= (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+    if dtype == "int8":
+        scales = np.abs(m).max(axis=1) / 127.0 + 1e-12
+        np.save(os.path.join(tmp, "vectors.npy"), np.round(m / scales[:, None]).astype("int8"))
+        np.save(os.path.join(tmp, "scales.npy"), scales.astype("float32"))
+    else:
+        np.save(os.path.join(tmp, "vectors.npy"), m.astype("float16"))
+    values = sorted({s for s in sources if s is not None})
+    np.save(os.path.join(tmp, "source.npy"),
+            np.array([values.index(s) if s is not None else -1 for s in sources], dtype="int16"))
+    np.save(os.path.join(tmp, "offsets.npy"), np.array(offsets, dtype="int64"))
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"collection": collection, "dim": int(m.shape[1]) if len(m) else 0,
+                   "dtype": dtype, "count": len(vecs), "sources": values}, f)
+    old = final + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(final):
+        os.rename(final, old)
+    os.rename(tmp, final)
+    shutil.rmtree(old, ignore_errors=True)
+    return len(vecs)
+
+
+_LOCAL: dict[str, LocalRetrievalEngine] = {}
+_LOCAL_LOCK = threading.Lock()
+
+
+def get_local_engine(index_dir: str) -> LocalRetrievalEngine | None:
+    """Process-wide engine over `index_dir`, None when no snapshot is there."""
+    with _LOCAL_LOCK:
+        if index_dir not in _LOCAL:
+            if not os.path.isdir(index_dir):
+                return None
+            eng = LocalRetrievalEngine(index_dir)
+            if not eng.collections:
+                return None
+            _LOCAL[index_dir] = eng
+        return _LOCAL[index_dir]
+
+
+def main(argv: list[str] | None = None):
+    """`canar-snapshot`: copy the Qdrant collections to a local index (offline / fallback retrieval)."""
+    from qdrant_client import QdrantClient
+    from canar.app.config import AppConfig
+
+    cfg = AppConfig()
+    ap = argparse.ArgumentParser(prog="canar-snapshot", description=main.__doc__)
+    ap.add_argument("--collections", nargs="*", default=list(cfg.qdrant_collections))
+    ap.add_argument("--out", default=cfg.local_index_dir)
+    ap.add_argument("--dtype", choices=["float16", "int8"], default=cfg.local_index_dtype)
+    args = ap.parse_args(argv)
+    client = QdrantClient(url=cfg.qdrant_url, api_key=cfg.qdrant_api_key or None)
+    os.makedirs(args.out, exist_ok=True)
+    for col in args.collections:
+        n = snapshot_collection(client, col, args.out, args.dtype)
+        print(f"[canar] {col}: {n} points -> {os.path.join(args.out, col)} ({args.dtype})")
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+import numpy as np
+
+
+class Reranker:
+    """
+    Cross-encoder reranker run on CPU with ONNX Runtime.
+
+    `model_dir` holds `model.onnx` and `tokenizer.json` (e.g. an exported
+    bge-reranker / ms-marco MiniLM). (query, chunk) pairs are scored in batches; scores
+    are cached per (chunk, query) and scoring stops once `budget_ms` is spent, the
+    unscored tail keeping its retrieval order.
+    """
+
+    def __init__(self, model_dir: str, batch_size: int = 16, max_length: int = 384,
+                 budget_ms: float = 300.0, cache_size: int = 20000, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), opts,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"calls": 0, "pairs_scored": 0, "cache_hits": 0,
+                        "budget_exceeded": 0, "last_ms": 0.0, "total_ms": 0.0}
+
+    def _score_batch(self, query: str, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch([(query, t) for t in texts])
+        feeds = {
+            "input_ids": np.array([e.ids for e in enc], dtype="int64"),
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype="int64"),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in enc], dtype="int64")
+        logits = self.session.run(None, feeds)[0].reshape(len(texts), -1)
+        if logits.shape[1] == 1:
+            return logits[:, 0]
+        # (irrelevant, relevant) classifier head: log-odds of the relevant class, which
+        # orders like its softmax probability and stays on the single-logit scale
+        return logits[:, -1] - logits[:, 0]
+
+    def rerank(self, query: str, hits: list[Dict[str, Any]], top_n: int) -> list[Dict[str, Any]]:
+        t0 = time.perf_counter()
+        qhash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        keys = [(h.get("collection"), h.get("id"), qhash) for h in hits]
+        scores: list[float | None] = [None] * len(hits)
+        with self._lock:
+            for i, k in enumerate(keys):
+                if k in self._cache:
+                    self._cache.move_to_end(k)
+                    scores[i] = self._cache[k]
+                    self.metrics["cache_hits"] += 1
+
+        todo = [i for i, s in enumerate(scores) if s is None]
+        for start in range(0, len(todo), self.batch_size):
+            if (time.perf_counter() - t0) * 1000 > self.budget_ms:
+                self.metrics["budget_exceeded"] += 1
+                break
+            batch = todo[start:start + self.batch_size]
+            out = self._score_batch(query, [(hits[i]["payload"] or {}).get("text") or "" for i in batch])
+            with self._lock:
+                for i, s in zip(batch, out):
+                    scores[i] = float(s)
+                    self._cache[keys[i]] = float(s)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self.metrics["pairs_scored"] += len(batch)
+
+        # scored hits first (by rerank score), then the unscored ones in retrieval order
+        order = sorted(range(len(hits)),
+                       key=lambda i: (scores[i] is not None, scores[i] or 0.0), reverse=True)
+        out = [{**hits[i], "rerank_score": scores[i]} for i in order[:top_n]]
+        elapsed = (time.perf_counter() - t0) * 1000
+        self.metrics["calls"] += 1
+        self.metrics["last_ms"] = elapsed
+        self.metrics["total_ms"] += elapsed
+        return out
+
+
+_RERANKER: Reranker | None = None
+_RERANKER_LOCK = threading.Lock()
+
+
+def get_reranker(model_dir: str, **kwargs) -> Reranker:
+    """Process-wide reranker (the ONNX session is loaded once)."""
+    global _RERANKER
+    with _RERANKER_LOCK:
+        if _RERANKER is None:
+            _RERANKER = Reranker(model_dir, **kwargs)
+        return _RERANKER
@@ -1,40 +1,304 @@
 from __future__ import annotations
-from typing import Dict, Any
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Any, Protocol
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+from qdrant_client.http.models import (Filter, FieldCondition, MatchValue, QuantizationSearchParams,
+                                       SearchParams)
+from .lexical import BM25Index, reciprocal_rank_fusion
+from ..tracing import METRICS
 
+# payload fields fetched with the search itself; `text` (the bulk of each point) is only
+# fetched for the hits that survive fusion / pruning
+LIGHT_FIELDS = ["source", "url", "section"]
 
-def search_qdrant(qdrant_url: str, api_key: str | None, collections: list[str],
-                  query_vector: list[float], top_k_per_collection: int = 5,
-                  source_filter: str | None = "utilitr") -> list[Dict[str, Any]]:
+PROFILES = ("fast", "balanced", "exact")
+
+
+class RetrievalUnavailable(RuntimeError):
+    """No collection answered in time (raised by `search(..., strict=True)`)."""
+
+
+class RetrievalBackend(Protocol):
+    """What the agents need from a retrieval backend (Qdrant or a local snapshot)."""
+
+    def search(self, collections: list[str], query_vector: list[float] | None,
+               top_k_per_collection: int = 5, source_filter: str | None = "utilitr",
+               timeout_s: float | None = None, query_text: str | None = None,
+               rrf_k: int = 60, collection_weights: dict[str, float] | None = None,
+               top_k: int = 8, strict: bool = False,
+               profile: str | None = None) -> list[Dict[str, Any]]: ...
+
+
+def search_params(profile: str | None) -> SearchParams | None:
     """
-    Returns a unified list of hits across collections with normalized per-collection score.
+    Qdrant search parameters of a retrieval profile (RETRIEVAL_PROFILE):
+      fast      small HNSW beam, quantized vectors only (no rescoring)
+      balanced  wider beam, 2x oversampled quantized candidates rescored on the originals
+      exact     full scan of the original vectors (the reference for recall@k)
+    Quantization settings are ignored on collections created without quantization.
+    None (no profile) keeps the collection defaults.
     """
-    client = QdrantClient(url=qdrant_url, api_key=api_key or None)
-    all_hits = []
-    for col in collections:
-        flt = None
-        if source_filter:
-            flt = Filter(must=[FieldCondition(key="source", match=MatchValue(value=source_filter))])
-        hits = client.search(collection_name=col, query_vector=query_vector,
-                             limit=top_k_per_collection,
-                             with_payload=True, with_vectors=False, query_filter=flt)
-        if not hits:
-            continue
-        # min-max normalize within the collection to make cross-collection fusion saner
-        scores = [h.score for h in hits]
-        lo, hi = min(scores), max(scores)
-        rng = (hi - lo) or 1.0
-        for h in hits:
-            norm = (h.score - lo) / rng
-            all_hits.append({
-                "collection": col,
-                "score": h.score,
-                "score_norm": norm,
-                "payload": h.payload
-            })
+    if profile == "fast":
+        return SearchParams(hnsw_ef=32, quantization=QuantizationSearchParams(rescore=False))
+    if profile == "balanced":
+        return SearchParams(hnsw_ef=128,
+                            quantization=QuantizationSearchParams(rescore=True, oversampling=2.0))
+    if profile == "exact":
+        return SearchParams(exact=True, quantization=QuantizationSearchParams(ignore=True))
+    return None
+
+
+def dense_search(client: QdrantClient, col: str, query_vector: list[float], limit: int,
+                 flt: Filter | None = None, params: SearchParams | None = None,
+                 with_payload: Any = True) -> list:
+    """Scored points of a vector search (`query_points` on clients that dropped `search`)."""
+    if hasattr(client, "query_points"):
+        return client.query_points(collection_name=col, query=query_vector, limit=limit,
+                                   query_filter=flt, search_params=params,
+                                   with_payload=with_payload, with_vectors=False).points
+    return client.search(collection_name=col, query_vector=query_vector, limit=limit,
+                         query_filter=flt, search_params=params,
+                         with_payload=with_payload, with_vectors=False)
+
+
+def with_norm(col: str, hits: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    """Tag dense hits with their collection and a min-max normalized score within it."""
+    if not hits:
+        return []
+    scores = [h["score"] for h in hits]
+    lo, hi = min(scores), max(scores)
+    rng = (hi - lo) or 1.0
+    return [{**h, "collection": col, "score_norm": (h["score"] - lo) / rng} for h in hits]
+
+
+def merge_results(results: list[tuple[str, list[Dict[str, Any]]]], query_text: str | None,
+                  rrf_k: int = 60, collection_weights: dict[str, float] | None = None,
+                  top_k: int = 8) -> list[Dict[str, Any]]:
+    """Merge per-collection hit lists: RRF in hybrid mode, normalized scores otherwise."""
+    if query_text:
+        weights = collection_weights or {}
+        return reciprocal_rank_fusion(
+            [(weights.get(col, 1.0), hits) for col, hits in results], k=rrf_k
+        )[:top_k]
+
+    all_hits = [h for _, hits in results for h in hits]
     # sort by normalized score then raw score
     all_hits.sort(key=lambda x: (x["score_norm"], x["score"]), reverse=True)
     # filter out weak tails (often irrelevant): keep those with score_norm >= 0.35 or the top-3
     pruned = [h for h in all_hits if h["score_norm"] >= 0.35] or all_hits[:3]
     return pruned
+
+
+class RetrievalEngine:
+    """
+    Long-lived Qdrant client + thread pool fanning searches out over collections.
+    One engine per (url, api_key), shared by every Streamlit session of the process.
+    Full payloads of the returned hits are kept in an LRU cache keyed by (collection, id).
+    """
+
+    def __init__(self, qdrant_url: str, api_key: str | None = None,
+                 max_workers: int = 8, timeout_s: float = 5.0, payload_cache_size: int = 4096):
+        if qdrant_url == ":memory:":
+            # local in-process Qdrant (benchmarks, tests)
+            self.client = QdrantClient(location=":memory:")
+        else:
+            # a hung request must not hold a pool thread past the search timeout
+            self.client = QdrantClient(url=qdrant_url, api_key=api_key or None,
+                                       timeout=max(1, math.ceil(timeout_s)))
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="canar-qdrant")
+        self.timeout_s = timeout_s
+        self._lexical: dict[tuple[str, str | None], Future] = {}
+        self._lexical_lock = threading.Lock()
+        # BM25 builds scroll whole collections: kept off the search pool
+        self._lexical_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="canar-bm25")
+        self._aliases: dict[str, str] = {}
+        self._aliases_at = 0.0
+        self.payload_cache_size = payload_cache_size
+        self._payloads: OrderedDict[tuple[str, Any], dict] = OrderedDict()
+        self._payloads_lock = threading.Lock()
+
+    def _physical(self, col: str) -> str:
+        # collection names may be aliases switched by canar-ingest (blue/green): BM25
+        # indexes are keyed by the collection behind the alias, re-resolved every minute
+        if time.monotonic() - self._aliases_at > 60:
+            try:
+                self._aliases = {a.alias_name: a.collection_name
+                                 for a in self.client.get_aliases().aliases}
+            except Exception:
+                pass
+            self._aliases_at = time.monotonic()
+        return self._aliases.get(col, col)
+
+    def physical(self, collections: list[str]) -> tuple[str, ...]:
+        """Collections actually behind `collections` (aliases resolved, at most a minute old)."""
+        return tuple(self._physical(c) for c in collections)
+
+    def _search_one(self, col: str, query_vector: list[float], limit: int,
+                    flt: Filter | None, params: SearchParams | None = None) -> list[Dict[str, Any]]:
+        hits = dense_search(self.client, col, query_vector, limit, flt, params, LIGHT_FIELDS)
+        # min-max normalize within the collection to make cross-collection fusion saner
+        return with_norm(col, [{"id": h.id, "score": h.score, "payload": h.payload} for h in hits])
+
+    def _lexical_index(self, col: str, source_filter: str | None, flt: Filter | None) -> BM25Index:
+        # built in the background from the collection payloads, once per process (and per
+        # version); until it is ready (or when the build failed, retried on the next query)
+        # the collection is searched dense-only
+        physical = self._physical(col)
+        key = (physical, source_filter)
+        with self._lexical_lock:
+            fut = self._lexical.get(key)
+            if fut is None or (fut.done() and fut.exception() is not None):
+                # drop the indexes of the versions the alias moved away from
+                for stale in [k for k in self._lexical
+                              if k[0] != physical and k[0].startswith(f"{col}__")]:
+                    del self._lexical[stale]
+                fut = self._lexical[key] = self._lexical_pool.submit(
+                    BM25Index.from_collection, self.client, physical, flt)
+        if not fut.done() or fut.exception() is not None:
+            raise RetrievalUnavailable(f"BM25 index of {col} not ready")
+        return fut.result()
+
+    def _lexical_one(self, col: str, query_text: str, limit: int, source_filter: str | None,
+                     flt: Filter | None) -> list[Dict[str, Any]]:
+        hits = self._lexical_index(col, source_filter, flt).search(query_text, limit)
+        return [{**h, "collection": col} for h in hits]
+
+    def _fetch_payloads(self, col: str, ids: list[Any]) -> dict[Any, dict]:
+        recs = self.client.retrieve(collection_name=col, ids=ids, with_payload=True,
+                                    with_vectors=False)
+        return {r.id: r.payload or {} for r in recs}
+
+    def _hydrate(self, hits: list[Dict[str, Any]], deadline: float) -> list[Dict[str, Any]]:
+        """Full payloads for `hits` (cache, then one `retrieve` per collection); hits whose
+        payload could not be fetched in time are dropped."""
+        keys = {id(h): (self._physical(h["collection"]), h["id"]) for h in hits
+                if "text" not in (h.get("payload") or {})}
+        full: dict[tuple[str, Any], dict] = {}
+        missing: dict[str, list[Any]] = {}
+        with self._payloads_lock:
+            for key in set(keys.values()):
+                if key in self._payloads:
+                    self._payloads.move_to_end(key)
+                    full[key] = self._payloads[key]
+                else:
+                    missing.setdefault(key[0], []).append(key[1])
+        METRICS.inc("retrieval", "payload_cache_hits", len(full))
+        if missing:
+            jobs = {self.pool.submit(self._fetch_payloads, col, ids): col for col, ids in missing.items()}
+            done, not_done = wait(jobs, timeout=max(0.0, deadline - time.monotonic()))
+            for f in not_done:
+                f.cancel()
+            fetched = {(jobs[f], pid): p for f in done if f.exception() is None
+                       for pid, p in f.result().items()}
+            METRICS.inc("retrieval", "payload_fetches", len(fetched))
+            full.update(fetched)
+            with self._payloads_lock:
+                self._payloads.update(fetched)
+                while len(self._payloads) > self.payload_cache_size:
+                    self._payloads.popitem(last=False)
+        out = []
+        for h in hits:
+            key = keys.get(id(h))
+            if key is None:
+                out.append(h)
+            elif key in full:
+                out.append({**h, "payload": full[key]})
+        return out
+
+    def refresh_lexical(self):
+        with self._lexical_lock:
+            self._lexical.clear()
+
+    def search(self, collections: list[str], query_vector: list[float] | None,
+               top_k_per_collection: int = 5,
+               source_filter: str | None = "utilitr",
+               timeout_s: float | None = None,
+               query_text: str | None = None,
+               rrf_k: int = 60,
+               collection_weights: dict[str, float] | None = None,
+               top_k: int = 8,
+               strict: bool = False,
+               profile: str | None = None) -> list[Dict[str, Any]]:
+        """
+        Query every collection concurrently. Collections that fail or exceed the
+        timeout are skipped: the caller gets whatever came back in time (with `strict`,
+        RetrievalUnavailable is raised when nothing did).
+        With `query_text`, a BM25 search runs next to the dense one and all lists are
+        merged by reciprocal-rank fusion (weighted per collection), keeping `top_k` hits.
+        Without `query_vector` (embedding unavailable), only the BM25 search runs.
+        `profile` trades recall for speed on the dense search (see `search_params`).
+        """
+        deadline = time.monotonic() + (timeout_s or self.timeout_s)
+        flt = None
+        if source_filter:
+            flt = Filter(must=[FieldCondition(key="source", match=MatchValue(value=source_filter))])
+        jobs = []
+        if query_vector is not None:
+            params = search_params(profile)
+            jobs += [(col, "dense", self.pool.submit(self._search_one, col, query_vector,
+                                                     top_k_per_collection, flt, params))
+                     for col in collections]
+        if query_text:
+            # the first query of a collection starts building its BM25 index: the turns
+            # before it is ready are dense-only
+            jobs += [(col, "bm25", self.pool.submit(self._lexical_one, col, query_text,
+                                                    top_k_per_collection, source_filter, flt))
+                     for col in collections]
+        done, not_done = wait([f for _, _, f in jobs], timeout=timeout_s or self.timeout_s)
+        results = []
+        for col, kind, f in jobs:
+            if f not in done:
+                f.cancel()
+                METRICS.inc("retrieval", "collection_timeouts", 1)
+                print(f"[canar] {kind} search on {col} timed out")
+            elif f.exception() is not None:
+                if not isinstance(f.exception(), RetrievalUnavailable):  # BM25 index not ready
+                    METRICS.inc("retrieval", "collection_errors", 1)
+                    print(f"[canar] {kind} search on {col} failed: {f.exception()!r}")
+            else:
+                results.append((col, f.result()))
+        if strict and not results:
+            raise RetrievalUnavailable(f"no answer from {', '.join(collections)}")
+        hits = merge_results(results, query_text, rrf_k, collection_weights, top_k)
+        # the payload fetch gets what is left of the time budget (at least a short grace)
+        out = self._hydrate(hits, max(deadline, time.monotonic() + 0.5))
+        if strict and hits and not out:
+            raise RetrievalUnavailable(f"no payload from {', '.join(collections)}")
+        return out
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self._lexical_pool.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+
+
+_ENGINES: dict[tuple[str, str], RetrievalEngine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(qdrant_url: str, api_key: str | None = None, **kwargs) -> RetrievalEngine:
+    """Process-wide engine registry (created on first use, then reused)."""
+    key = (qdrant_url, api_key or "")
+    with _ENGINES_LOCK:
+        eng = _ENGINES.get(key)
+        if eng is None:
+            eng = _ENGINES[key] = RetrievalEngine(qdrant_url, api_key, **kwargs)
+        return eng
+
+
+def search_qdrant(qdrant_url: str, api_key: str | None, collections: list[str],
+                  query_vector: list[float] | None, top_k_per_collection: int = 5,
+                  source_filter: str | None = "utilitr",
+                  timeout_s: float | None = None, query_text: str | None = None,
+                  **hybrid) -> list[Dict[str, Any]]:
+    """
+    Returns a unified list of hits across collections with normalized per-collection score.
+    Passing `query_text` switches to hybrid (dense + BM25, RRF-fused) retrieval.
+    """
+    eng = get_engine(qdrant_url, api_key)
+    return eng.search(collections, query_vector, top_k_per_collection, source_filter, timeout_s,
+                      query_text=query_text, **hybrid)
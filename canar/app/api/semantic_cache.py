@@ -0,0 +1,85 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Any
+import numpy as np
+
+
+class SemanticCache:
+    """
+    In-memory answer cache keyed on (normalized) query embeddings.
+    Vectors live in one preallocated float32 matrix; a lookup is a single mat-vec product.
+    Entries expire after `ttl_s`, the least recently used one is evicted when full, and
+    the whole cache is flushed when `version` (the physical collections behind the aliases,
+    see FailoverRetriever.version) changes. A query vector of another dimension (embedder
+    switched, e.g. to the local fallback) is a miss.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl_s: float = 86400.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.version: Any = None
+        self._lock = threading.Lock()
+        self._vecs: np.ndarray | None = None  # (max_entries, dim)
+        self._used = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries, dtype="float64")
+        self._last_hit = np.zeros(max_entries, dtype="float64")
+        self._values: list[dict | None] = [None] * max_entries
+
+    def _check_version(self, version: Any):
+        if version != self.version:
+            self._used[:] = False
+            self._values = [None] * self.max_entries
+            self.version = version
+
+    def get(self, qvec: list[float], version: Any = None) -> dict | None:
+        """Return {"answer", "citations", "similarity"} for the closest fresh entry above threshold."""
+        with self._lock:
+            self._check_version(version)
+            if self._vecs is None or not self._used.any() or self._vecs.shape[1] != len(qvec):
+                return None
+            now = time.time()
+            self._used &= (now - self._created) < self.ttl_s
+            sims = self._vecs @ np.asarray(qvec, dtype="float32")
+            sims[~self._used] = -np.inf
+            i = int(np.argmax(sims))
+            if sims[i] < self.threshold:
+                return None
+            self._last_hit[i] = now
+            return {**self._values[i], "similarity": float(sims[i])}
+
+    def put(self, qvec: list[float], answer: str, citations: list[dict], version: Any = None):
+        v = np.asarray(qvec, dtype="float32")
+        with self._lock:
+            self._check_version(version)
+            if self._vecs is None or self._vecs.shape[1] != v.shape[0]:
+                self._vecs = np.zeros((self.max_entries, v.shape[0]), dtype="float32")
+                self._used[:] = False
+            free = np.flatnonzero(~self._used)
+            # free slot if any, otherwise evict the least recently used entry
+            i = int(free[0]) if free.size else int(np.argmin(self._last_hit))
+            now = time.time()
+            self._vecs[i] = v
+            self._used[i] = True
+            self._created[i] = now
+            self._last_hit[i] = now
+            self._values[i] = {"answer": answer, "citations": citations}
+
+    def clear(self):
+        with self._lock:
+            self._used[:] = False
+            self._values = [None] * self.max_entries
+
+
+_CACHE: SemanticCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_semantic_cache(**kwargs) -> SemanticCache:
+    """Process-wide cache shared by every Streamlit session."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = SemanticCache(**kwargs)
+        return _CACHE
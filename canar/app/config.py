@@ -1,8 +1,9 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 
-load_dotenv(override=True)
+# workers started by the `canar` cluster launcher inherit its already resolved environment
+load_dotenv(override=not os.getenv("CANAR_CLUSTER_WORKER"))
 
 
 @dataclass
@@ -14,14 +15,143 @@ class AppConfig:
     embed_base: str = os.getenv("EMBED_API_BASE", "")
     embed_key: str = os.getenv("EMBED_API_KEY", "")
     embed_model: str = os.getenv("EMBED_MODEL", "BAAI/bge-multilingual-gemma2")
+    embed_batch_window_ms: float = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+    embed_max_batch: int = int(os.getenv("EMBED_MAX_BATCH", "32"))
 
     qdrant_url: str = os.getenv("QDRANT_URL", "http://localhost:6333")
     qdrant_api_key: str = os.getenv("QDRANT_API_KEY", "")
     qdrant_collections: list[str] = tuple(
         c.strip() for c in os.getenv("QDRANT_COLLECTIONS", "utilitr_v1").split(",") if c.strip()
     )
+    qdrant_timeout_s: float = float(os.getenv("QDRANT_TIMEOUT_S", "5"))
+    # dense search profile: "fast", "balanced" or "exact" (see retrieval.search_params);
+    # quantization of the collections created by canar-ingest: "scalar", "binary" or "none"
+    retrieval_profile: str = os.getenv("RETRIEVAL_PROFILE", "balanced")
+    qdrant_quantization: str = os.getenv("QDRANT_QUANTIZATION", "scalar")
+
+    # Retrieval: "dense" (vectors only) or "hybrid" (dense + BM25, reciprocal-rank fusion)
+    retrieval_mode: str = os.getenv("RETRIEVAL_MODE", "dense")
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    hybrid_top_k: int = int(os.getenv("HYBRID_TOP_K", "8"))
+    # e.g. "utilitr_v1:1.0,other_v1:0.5"
+    collection_weights: dict = field(default_factory=lambda: {
+        k.strip(): float(v) for k, v in (
+            kv.split(":", 1) for kv in os.getenv("COLLECTION_WEIGHTS", "").split(",") if ":" in kv
+        )
+    })
+
+    # Optional cross-encoder rerank (CPU, ONNX): directory with model.onnx + tokenizer.json
+    rerank_model_dir: str = os.getenv("RERANK_MODEL_DIR", "")
+    rerank_candidates: int = int(os.getenv("RERANK_CANDIDATES", "20"))
+    rerank_top_n: int = int(os.getenv("RERANK_TOP_N", "5"))
+    rerank_batch_size: int = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    rerank_budget_ms: float = float(os.getenv("RERANK_BUDGET_MS", "300"))
+
+    # r_helpdesk prompt: max tokens of documentation context (0 = unbounded)
+    context_token_budget: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+    # Conversation memory: recent turns verbatim under this budget (0 = disabled), older
+    # turns in a rolling summary refreshed in the background
+    history_token_budget: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+    history_max_messages: int = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+
+    # sas_to_r: uploads of at least this many lines go through the chunked pipeline
+    sas_chunk_threshold_lines: int = int(os.getenv("SAS_CHUNK_THRESHOLD_LINES", "300"))
+    sas_chunk_lines: int = int(os.getenv("SAS_CHUNK_LINES", "150"))
+    sas_parallelism: int = int(os.getenv("SAS_PARALLELISM", "4"))
+    # content-addressed SAS→R translation cache (per block and per uploaded file)
+    translation_cache_enabled: bool = os.getenv("TRANSLATION_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+    translation_cache_max: int = int(os.getenv("TRANSLATION_CACHE_MAX", "5000"))
+
+    # retrieval backend: "qdrant", "local" (snapshot from canar-snapshot) or "auto" (Qdrant,
+    # failing over to the snapshot / local embedder when latency or errors cross the thresholds)
+    retrieval_backend: str = os.getenv("RETRIEVAL_BACKEND", "qdrant")
+    local_index_dir: str = os.getenv("LOCAL_INDEX_DIR", "data/local_index")
+    local_index_dtype: str = os.getenv("LOCAL_INDEX_DTYPE", "float16")
+    local_embed_model_dir: str = os.getenv("LOCAL_EMBED_MODEL_DIR", "")
+    breaker_p95_s: float = float(os.getenv("BREAKER_P95_S", "2.0"))
+    breaker_error_rate: float = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+    breaker_open_s: float = float(os.getenv("BREAKER_OPEN_S", "30"))
+    # full payloads (chunk text) of recent Qdrant hits kept in memory, keyed by (collection, id)
+    payload_cache_size: int = int(os.getenv("PAYLOAD_CACHE_SIZE", "4096"))
+
+    # Semantic answer cache (r_helpdesk), opt-in
+    semcache_enabled: bool = os.getenv("SEMCACHE_ENABLED", "false").lower() in {"1", "true", "yes"}
+    semcache_threshold: float = float(os.getenv("SEMCACHE_THRESHOLD", "0.95"))
+    semcache_max_entries: int = int(os.getenv("SEMCACHE_MAX_ENTRIES", "1024"))
+    semcache_ttl_s: float = float(os.getenv("SEMCACHE_TTL_S", "86400"))
+
+    # conversations listed per sidebar page
+    sidebar_page_size: int = int(os.getenv("SIDEBAR_PAGE_SIZE", "20"))
+    # number of messages shown per page in the chat history
+    chat_window: int = int(os.getenv("CHAT_WINDOW", "30"))
+    # streaming: redraw cadence of the answer being generated
+    stream_flush_ms: float = float(os.getenv("STREAM_FLUSH_MS", "50"))
+    stream_flush_chars: int = int(os.getenv("STREAM_FLUSH_CHARS", "400"))
+    # admission control in front of the LLM / embedding endpoints: in-flight limit adapted
+    # from latency (AIMD) and 429/503 answers; ADMISSION_STATE = SQLite file shared by workers
+    llm_max_inflight: int = int(os.getenv("LLM_MAX_INFLIGHT", "32"))
+    llm_target_ttft_s: float = float(os.getenv("LLM_TARGET_TTFT_S", "2.0"))
+    embed_max_inflight: int = int(os.getenv("EMBED_MAX_INFLIGHT", "16"))
+    embed_target_s: float = float(os.getenv("EMBED_TARGET_S", "1.0"))
+    admission_queue_timeout_s: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "120"))
+    admission_state: str = os.getenv("ADMISSION_STATE", "")
+    upstream_retries: int = int(os.getenv("UPSTREAM_RETRIES", "3"))
+    # run LLM answers as background jobs (survive reruns, can be stopped), N at a time
+    generation_jobs: bool = os.getenv("GENERATION_JOBS", "false").lower() in {"1", "true", "yes"}
+    gen_max_concurrent: int = int(os.getenv("GEN_MAX_CONCURRENT", "8"))
+    # threads running the overlapped stages of turns (history / question write, embedding
+    # and retrieval, parsing of SAS uploads), shared by all sessions
+    turn_workers: int = int(os.getenv("TURN_WORKERS", "16"))
+    # headless API (canar-api): max simultaneous LLM streams per worker
+    api_max_streams: int = int(os.getenv("CANAR_API_MAX_STREAMS", "64"))
+    # per-turn tracing (debug panel + metrics); JSON lines appended to TRACE_JSONL if set
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "false").lower() in {"1", "true", "yes"}
+    trace_jsonl: str = os.getenv("TRACE_JSONL", "")
+
+    # signs login tokens (keep it stable so logins survive restarts); the token sits in the
+    # URL, so it is short-lived and renewed while the session is in use
+    session_secret: str = os.getenv("CANAR_SECRET", "")
+    session_ttl_min: float = float(os.getenv("SESSION_TTL_MIN", "30"))
 
     db_path: str = os.getenv("APP_DB", "data/app.db")
+    # queue message writes and flush them in batches from a background thread
+    db_write_behind: bool = os.getenv("DB_WRITE_BEHIND", "false").lower() in {"1", "true", "yes"}
 
     def validate(self):
         assert len(self.qdrant_collections) >= 1, "QDRANT_COLLECTIONS cannot be empty"
+        assert self.retrieval_mode in {"dense", "hybrid"}, "RETRIEVAL_MODE must be dense or hybrid"
+        assert self.retrieval_backend in {"qdrant", "local", "auto"}, \
+            "RETRIEVAL_BACKEND must be qdrant, local or auto"
+        assert self.retrieval_profile in {"fast", "balanced", "exact"}, \
+            "RETRIEVAL_PROFILE must be fast, balanced or exact"
+        assert self.qdrant_quantization in {"scalar", "binary", "none"}, \
+            "QDRANT_QUANTIZATION must be scalar, binary or none"
+
+    def admission_kwargs(self, backend: str) -> dict | None:
+        """Settings of the "llm" / "embed" admission controller, None when disabled (max 0)."""
+        max_limit, target = ((self.llm_max_inflight, self.llm_target_ttft_s) if backend == "llm"
+                             else (self.embed_max_inflight, self.embed_target_s))
+        if max_limit <= 0:
+            return None
+        return {"initial_limit": max(1, max_limit // 2), "max_limit": max_limit, "target_s": target,
+                "queue_timeout_s": self.admission_queue_timeout_s,
+                "state_path": self.admission_state}
+
+    def retriever_kwargs(self) -> dict:
+        """`get_retriever` arguments besides the embedding client."""
+        return {"qdrant_url": self.qdrant_url, "api_key": self.qdrant_api_key,
+                "mode": self.retrieval_backend, "local_dir": self.local_index_dir,
+                "local_embed_model_dir": self.local_embed_model_dir, "p95_s": self.breaker_p95_s,
+                "error_rate": self.breaker_error_rate, "open_s": self.breaker_open_s,
+                "payload_cache_size": self.payload_cache_size}
+
+    def search_kwargs(self, query: str) -> dict:
+        """`search_qdrant` sizing / mode arguments (over-fetching when a reranker is set)."""
+        per_col = self.rerank_candidates if self.rerank_model_dir else 5
+        kw = {"top_k_per_collection": per_col, "profile": self.retrieval_profile}
+        if self.retrieval_mode == "hybrid":
+            kw.update(query_text=query, rrf_k=self.rrf_k,
+                      top_k=self.rerank_candidates if self.rerank_model_dir else self.hybrid_top_k,
+                      collection_weights=self.collection_weights)
+        return kw
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+from .api.admission import CancelToken
+from .state import DB
+
+# Background generation jobs: LLM streams run in worker threads owned by the process,
+# not by the Streamlit script run, so a rerun neither aborts nor loses an answer. Partial
+# output is written to the assistant message as it grows; the UI re-attaches by job id.
+# A fixed number of workers bounds concurrent generations; queued jobs are served
+# round-robin across users. A cancelled job still records its turn and runs `on_done`.
+
+QUEUED, RUNNING, DONE, CANCELLED, ERROR = "queued", "running", "done", "cancelled", "error"
+
+
+@dataclass
+class GenerationJob:
+    user_id: int
+    conv_id: int
+    question: str
+    stream_factory: Callable[[CancelToken], Iterator[str]]  # gets the job's cancel token
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    parts: list[str] = field(default_factory=list)
+    error: str = ""
+    meta: dict = field(default_factory=dict)  # e.g. sources of an r_helpdesk answer
+    on_done: Optional[Callable[[GenerationJob], None]] = None  # runs in the worker, after persistence
+    # (question id, answer id) once persisted row by row; (question id,) when the question
+    # was stored before the job (turn pipeline), only the answer row is then written
+    msg_ids: tuple = ()
+    created_at: float = field(default_factory=time.time)
+    finished_at: float = 0.0
+    _cancel: CancelToken = field(default_factory=CancelToken, repr=False)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, CANCELLED, ERROR)
+
+    def cancel(self):
+        self._cancel.set()
+
+
+class JobManager:
+    def __init__(self, db: DB, max_concurrent: int = 8, persist_every_s: float = 1.0,
+                 keep_finished_s: float = 600.0):
+        self.db = db
+        self.persist_every_s = persist_every_s
+        self.keep_finished_s = keep_finished_s
+        self.jobs: dict[str, GenerationJob] = {}
+        self._queues: dict[int, deque[GenerationJob]] = {}
+        self._turns: deque[int] = deque()  # users with queued jobs, round-robin order
+        self._cv = threading.Condition()
+        for i in range(max_concurrent):
+            threading.Thread(target=self._worker, name=f"canar-gen-{i}", daemon=True).start()
+
+    def submit(self, job: GenerationJob) -> GenerationJob:
+        with self._cv:
+            self._purge()
+            self.jobs[job.id] = job
+            q = self._queues.setdefault(job.user_id, deque())
+            if not q:
+                self._turns.append(job.user_id)
+            q.append(job)
+            self._cv.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        return self.jobs.get(job_id)
+
+    def queued_ahead(self, job: GenerationJob) -> int:
+        with self._cv:
+            return sum(1 for q in self._queues.values() for j in q if j.created_at < job.created_at)
+
+    def _purge(self):
+        now = time.time()
+        for jid in [j.id for j in self.jobs.values()
+                    if j.finished and now - j.finished_at > self.keep_finished_s]:
+            del self.jobs[jid]
+
+    def _next(self) -> GenerationJob:
+        with self._cv:
+            while not self._turns:
+                self._cv.wait()
+            uid = self._turns.popleft()
+            q = self._queues[uid]
+            job = q.popleft()
+            if q:
+                self._turns.append(uid)
+            else:
+                del self._queues[uid]
+            return job
+
+    def _worker(self):
+        while True:
+            self._run(self._next())
+
+    def _run(self, job: GenerationJob):
+        status = DONE
+        try:
+            if job._cancel.is_set():
+                # cancelled while queued: nothing to stream, the turn is still recorded below
+                status = CANCELLED
+            else:
+                job.status = RUNNING
+                self._stream(job)
+                if job._cancel.is_set():
+                    status = CANCELLED
+        except Exception as e:
+            if job._cancel.is_set():  # e.g. the stream closed under a pending read
+                status = CANCELLED
+            else:
+                job.error = str(e)
+                status = ERROR
+        try:
+            if len(job.msg_ids) == 2:
+                self.db.update_message(job.msg_ids[1], job.text)
+            elif len(job.msg_ids) == 1:
+                job.msg_ids = (job.msg_ids[0], self.db.add_message(job.user_id, job.conv_id,
+                                                                   "assistant", job.text))
+            else:
+                job.msg_ids = self.db.append_turn(job.user_id, job.conv_id, job.question, job.text)
+            if job.on_done:
+                job.on_done(job)
+        except Exception as e:
+            job.error = job.error or str(e)
+        # status last: a finished job is persisted and post-processed
+        job.finished_at = time.time()
+        job.status = status
+
+    def _stream(self, job: GenerationJob):
+        msg_id = None
+        if not self.db.write_behind:
+            # question + empty answer right away, the answer row then grows in place
+            if job.msg_ids:
+                job.msg_ids = (job.msg_ids[0],
+                               self.db.add_message(job.user_id, job.conv_id, "assistant", ""))
+            else:
+                job.msg_ids = self.db.append_turn(job.user_id, job.conv_id, job.question, "")
+            msg_id = job.msg_ids[1]
+        gen = job.stream_factory(job._cancel)
+        last = time.monotonic()
+        try:
+            for token in gen:
+                job.parts.append(token)
+                if job._cancel.is_set():
+                    break
+                if msg_id is not None and time.monotonic() - last >= self.persist_every_s:
+                    self.db.update_message(msg_id, job.text)
+                    last = time.monotonic()
+        finally:
+            # closing the generator closes the upstream HTTP stream
+            if hasattr(gen, "close"):
+                gen.close()
@@ -1,23 +1,47 @@
 from __future__ import annotations
+import time
 import streamlit as st
-from canar.app.config import AppConfig
-from canar.app.state import DB
-from canar.app.api.llm_client import ChatClient
-from canar.app.api.embed_client import EmbedClient
-from canar.app.api.retrieval import search_qdrant
-from canar.app.agents import sas_to_r, r_helpdesk
+from canar.app.resources import (get_config, get_db, get_chat_client, get_translation_cache,
+                                 get_job_manager, get_retriever_resource, get_turn_pool)
+from canar.app.api.semantic_cache import get_semantic_cache
+from canar.app.api.rerank import get_reranker
+from canar.app.agents import sas_to_r, sas_pipeline, r_helpdesk, memory
+from canar.app.agents.sas_cache import context_hash
+from canar.app import sessions
 from canar.app.ui.sidebar import sidebar
-from canar.app.ui.chat import render_messages, stream_answer
+from canar.app.tracing import start_trace
+from canar.app.tokens import count_tokens
+from canar.app.ui.chat import (render_messages, stream_answer, last_message, attach_job, wait_notice,
+                               remember_message)
+from canar.app.api.admission import Overloaded
+from canar.app.jobs import DONE, GenerationJob
+from canar.app.pipeline import TurnPipeline
 
 st.set_page_config(page_title="CanaR", page_icon="🦆", layout="wide")
 
-cfg = AppConfig()
-cfg.validate()
-db = DB(cfg.db_path)
+cfg = get_config()
+db = get_db()
 
 # ---------- Auth (local) ----------
+def rotate_token():
+    st.query_params["s"] = sessions.renew(db, st.query_params.get("s"), st.session_state["user_id"],
+                                          cfg.session_secret, cfg.session_ttl_min)
+    st.session_state["token_at"] = time.time()
+
+
 if "user_id" not in st.session_state:
     st.session_state["user_id"] = None
+    # the login outlives the Streamlit session (rerun on another worker, restart) through
+    # a signed, short-lived token kept in the URL
+    if (token := st.query_params.get("s")):
+        st.session_state["user_id"] = sessions.resolve(db, token, cfg.session_secret)
+        if st.session_state["user_id"] is None:
+            del st.query_params["s"]
+        else:
+            rotate_token()  # the one in the URL may have been copied around
+elif st.session_state["user_id"] and \
+        time.time() - st.session_state.get("token_at", 0) > cfg.session_ttl_min * 30:
+    rotate_token()  # renewed at half its lifetime while the session is in use
 
 
 def show_auth():
@@ -33,8 +57,9 @@ def show_auth():
                 st.error("Identifiants invalides")
             else:
                 st.session_state["user_id"] = uid
+                rotate_token()
                 # Create a starter conversation if none
-                if not db.list_conversations(uid):
+                if not db.list_conversation_page(uid, limit=1):
                     cid = db.create_conversation(uid, "Nouvelle conversation", "r_helpdesk")
                     st.session_state["conv_id"] = cid
                     st.session_state["agent"] = "r_helpdesk"
@@ -59,7 +84,7 @@ USER_ID = st.session_state["user_id"]
 
 # Session defaults
 if "conv_id" not in st.session_state:
-    convs = db.list_conversations(USER_ID)
+    convs = db.list_conversation_page(USER_ID, limit=1)
     if convs:
         st.session_state["conv_id"] = convs[0].id
         st.session_state["agent"] = convs[0].agent
@@ -72,7 +97,7 @@ conv_id: int = st.session_state["conv_id"]
 agent: str = st.session_state.get("agent", "r_helpdesk")
 
 # Sidebar (conversations + create/rename/delete)
-sidebar(db, USER_ID, conv_id, ["r_helpdesk", "sas_to_r"], agent)
+sidebar(db, USER_ID, conv_id, ["r_helpdesk", "sas_to_r"], agent, page_size=cfg.sidebar_page_size)
 
 # ---------- Header with current conversation name + agent selector ----------
 AGENT_LABELS = {"r_helpdesk": "Assistant R", "sas_to_r": "Traduction SAS → R"}
@@ -105,7 +130,10 @@ with header_right:
         st.markdown(f"<div class='user-chip'>👤 {username}</div>", unsafe_allow_html=True)
     with lcol:
         if st.button("Déconnexion", use_container_width=True):
-            for k in ("user_id", "conv_id", "agent"):
+            if (token := st.query_params.get("s")):
+                sessions.revoke(db, token)
+                del st.query_params["s"]
+            for k in ("user_id", "conv_id", "agent", "token_at"):
                 st.session_state.pop(k, None)
             st.rerun()
 
@@ -132,6 +160,7 @@ with ctrl_right:
         min_value=0.0, max_value=1.0, value=0.2, step=0.05,
         help="Plus élevé = plus créatif."
     )
+    show_debug = cfg.tracing_enabled and st.toggle("Debug (temps par étape)", value=False)
 
 st.markdown(
     """
@@ -185,55 +214,265 @@ st.markdown(
 )
 
 # LLM and Embedding clients
-chat = ChatClient(cfg.mistral_base, cfg.mistral_key, cfg.mistral_model)
-embed = EmbedClient(cfg.embed_base, cfg.embed_model, cfg.embed_key)
-
-# Show messages
-render_messages(db, USER_ID, conv_id)
+chat = get_chat_client()
+retriever = get_retriever_resource()
+stream_opts = {"flush_ms": cfg.stream_flush_ms, "flush_chars": cfg.stream_flush_chars}
+
+
+
+def show_sources(src_list):
+    with st.expander("Sources"):
+        for src in src_list:
+            st.markdown(f"- **[{src['label']}]** {src['section']}  \n  {src['url']}  \n  _({src['collection']})_")
+
+
+def finish_turn(trace, tcache, pipe=None) -> dict | None:
+    if pipe:
+        pipe.finish()
+    if tcache:
+        trace.set(translation_cache_hit_rate=round(tcache.hit_rate, 3))
+    if cfg.history_token_budget:
+        memory.schedule_summary(db, chat, USER_ID, conv_id, cfg.history_token_budget,
+                                cfg.history_max_messages)
+    return trace.finish()
+
+
+# Show messages (and the answer of this conversation still being generated, if any)
+job_ref = st.session_state.get("job")
+if not cfg.generation_jobs or (job_ref and job_ref["conv_id"] != conv_id):
+    job_ref = None
+live = get_job_manager().get(job_ref["id"]) if job_ref else None
+render_messages(db, USER_ID, conv_id, window=cfg.chat_window, hide=live.msg_ids if live else ())
+if job_ref:
+    job = attach_job(get_job_manager(), job_ref["id"], flush_ms=cfg.stream_flush_ms,
+                     estimated_wait=chat.estimated_wait_s)
+    if job and job.meta.get("sources"):
+        show_sources(job.meta["sources"])
+    if job and job.meta.get("trace"):
+        st.session_state["last_trace"] = job.meta["trace"]
 
 # --- Input area + turn handling ---
-sas_code_uploaded = None
+sas_upload = None
 if st.session_state["agent"] == "sas_to_r":
     uploaded = st.file_uploader("Uploader un fichier .sas (optionnel)", type=["sas"])
     if uploaded is not None:
-        sas_code_uploaded = uploaded.read().decode("utf-8", errors="ignore")
+        # parsed and hashed in the background as soon as it is uploaded, not when asked about
+        sas_upload = st.session_state.get("sas_upload")
+        if not sas_upload or sas_upload["file_id"] != uploaded.file_id:
+            code = uploaded.getvalue().decode("utf-8", errors="ignore")
+            sas_upload = st.session_state["sas_upload"] = {
+                "file_id": uploaded.file_id,
+                "prepared": get_turn_pool().submit(sas_pipeline.prepare_sas, code),
+            }
 
 user_input = st.chat_input("Pose ta question (ou colle ton code)…")
 if user_input:
+    trace = start_trace(st.session_state["agent"], cfg.tracing_enabled, cfg.trace_jsonl)
+    pipe = TurnPipeline(get_turn_pool(), trace)
+
     # 1) show the user message immediately in the chat
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    # 2) persist it
-    db.add_message(USER_ID, conv_id, "user", user_input)
+    # 2) previous turns (recent ones verbatim + rolling summary), then the question row, off
+    # the critical path (write-behind writes are queued anyway: the question goes with the answer)
+    def load_history():
+        if not cfg.history_token_budget:
+            return []
+        return memory.history_messages(db, USER_ID, conv_id, cfg.history_token_budget,
+                                       cfg.history_max_messages)
+
+    def store_question(_history):
+        return None if db.write_behind else db.add_message(USER_ID, conv_id, "user", user_input)
+
+    pipe.start("history", load_history)
+    # after the history read, which must not see it; only the answer write waits for it
+    pipe.start("persist_question", store_question, after="history")
+    if st.session_state["agent"] != "sas_to_r":
+        cache = None
+        if cfg.semcache_enabled:
+            cache = get_semantic_cache(threshold=cfg.semcache_threshold,
+                                       max_entries=cfg.semcache_max_entries,
+                                       ttl_s=cfg.semcache_ttl_s)
+
+        def retrieve(qvec, history):
+            """(cached answer, None, version) on a semantic cache hit, else
+            (None, (hits, backend), version); `version` is None when the cache does not apply."""
+            version = None
+            # cached answers only stand for questions asked without prior context
+            if cache is not None and qvec is not None and not history:
+                version = retriever.version(list(cfg.qdrant_collections))
+                with trace.stage("semantic_cache"):
+                    cached = cache.get(qvec, version=version)
+                trace.set(cache_hit=bool(cached))
+                if cached:
+                    return cached, None, version
+            return None, retriever.search(
+                list(cfg.qdrant_collections), qvec, user_input, source_filter="utilitr",
+                timeout_s=cfg.qdrant_timeout_s, **cfg.search_kwargs(user_input)
+            ), version
+
+        # None when neither the embedding service nor a local embedder answers
+        pipe.start("embed", retriever.embed_query, user_input)
+        # the search starts as soon as the query is embedded (and the history known, for
+        # the cache), concurrently with the question write
+        pipe.start("search", retrieve, after=("embed", "history"))
+
+    def pending_question() -> str | None:
+        """The question to persist with the answer, None when it is already stored."""
+        qid = pipe.result("persist_question")
+        if qid is None:
+            return user_input
+        remember_message(conv_id, qid, "user", user_input)
+        return None
+
+    def generate(messages, on_answer=None, sources=None):
+        """Stream the answer in this run, or hand it to a background job (GENERATION_JOBS)."""
+        question = pending_question()
+        if cfg.generation_jobs:
+            def done(job):
+                if job.status == DONE and job.text and on_answer:
+                    on_answer(job.text)
+                job.meta["trace"] = finish_turn(trace, tcache, pipe)
+
+            job = get_job_manager().submit(GenerationJob(
+                USER_ID, conv_id, user_input,
+                lambda cancel: trace.wrap_stream(chat.stream_chat(
+                    messages, temperature=temperature, max_tokens=max_tokens, cancel=cancel)),
+                meta={"sources": sources or []}, on_done=done,
+                msg_ids=() if question else (pipe.result("persist_question"),),
+            ))
+            st.session_state["job"] = {"id": job.id, "conv_id": conv_id}
+            st.rerun()  # the job is drawn (and re-attached on later runs) above
+        wait = chat.estimated_wait_s()
+        notice = st.info(wait_notice(wait)) if wait >= 1 else None
+        gen = chat.stream_chat(messages, temperature=temperature, max_tokens=max_tokens)
+        try:
+            answer = stream_answer(db, USER_ID, conv_id, trace.wrap_stream(gen),
+                                   trace=trace, question=question, **stream_opts)
+        except Overloaded as e:
+            st.warning(str(e))
+            return
+        finally:
+            if notice:
+                notice.empty()
+        if on_answer and answer:
+            on_answer(answer)
 
     # 3) agent-specific logic
-    if st.session_state["agent"] == "sas_to_r":
-        messages = sas_to_r.build_messages(user_input, sas_code_uploaded)
-        gen = chat.stream_chat(messages, temperature=temperature, max_tokens=max_tokens)
-        _ = stream_answer(db, USER_ID, conv_id, gen)
+    tcache = None
+    if st.session_state["agent"] == "sas_to_r" and cfg.translation_cache_enabled:
+        tcache = get_translation_cache()
+    prepared = None
+    # whole answers are keyed by the program and the question; they only stand for turns
+    # without prior context (a follow-up on the same upload is answered, not replayed)
+    ctx = context_hash(user_input)
+    if st.session_state["agent"] == "sas_to_r" and sas_upload:
+        pipe.track("sas_prepare", sas_upload["prepared"])
+        prepared = pipe.result("sas_prepare")
+        trace.set(upload_prepare_ms=round(prepared.elapsed_s * 1000, 1))
+        if tcache and prepared.lines < cfg.sas_chunk_threshold_lines:
+            # whole-file cache lookup next to the history read / question write
+            pipe.start("translation_cache", tcache.get, prepared.code, "file", prepared.digest, ctx)
+    history = pipe.result("history")
+    file_cache = tcache if prepared and not history else None
+
+    if prepared and prepared.lines >= cfg.sas_chunk_threshold_lines:
+        # large program: chunked, parallel translation with per-chunk progress
+        progress = st.progress(0.0, text="Découpage du programme SAS…")
+        done, script = 0, None
+        events = sas_pipeline.translate_sas(chat, prepared.code, user_input,
+                                            parallelism=cfg.sas_parallelism,
+                                            max_lines=cfg.sas_chunk_lines,
+                                            temperature=temperature, max_tokens=max_tokens,
+                                            cache=tcache, prepared=prepared)
+        try:
+            with trace.stage("translate_chunks"):
+                for ev in events:
+                    if isinstance(ev, sas_pipeline.ChunkDone):
+                        done += 1
+                        progress.progress(done / ev.total, text=f"Bloc {ev.index} traduit ({done}/{ev.total})")
+                    else:
+                        script = ev
+        except Overloaded as e:
+            st.warning(str(e))
+        finally:
+            # stops the chunks still queued or in flight when the run ends early
+            events.close()
+            progress.empty()
+            if script is None:
+                # keep the question even if the translation failed (as stream_answer does)
+                question = pending_question()
+                if question is not None:
+                    qid = db.add_message(USER_ID, conv_id, "user", question)
+                    remember_message(conv_id, qid, "user", question)
+        if script is not None:
+            answer_md = f"```r\n{script}```\n\nNotes : programme traduit par blocs (DATA, PROC, macros), " \
+                        f"à relire aux jonctions entre blocs."
+            _ = stream_answer(db, USER_ID, conv_id, iter([answer_md]),
+                              trace=trace, question=pending_question(), **stream_opts)
+
+    elif st.session_state["agent"] == "sas_to_r":
+        cached_answer = pipe.result("translation_cache") if file_cache else None
+        if cached_answer:
+            # same program (modulo comments, spacing, case) already translated
+            _ = stream_answer(db, USER_ID, conv_id, iter([cached_answer]),
+                              trace=trace, question=pending_question(), **stream_opts)
+        else:
+            code = prepared.code if prepared else None
+            with trace.stage("build_messages"):
+                messages = sas_to_r.build_messages(user_input, code, history=history)
+            if trace.enabled:
+                trace.set(prompt_tokens=sum(count_tokens(m["content"]) for m in messages))
+            generate(messages, on_answer=(lambda a: file_cache.put(code, a, kind="file",
+                                                                   digest=prepared.digest,
+                                                                   context=ctx))
+                     if file_cache else None)
 
     else:  # r_helpdesk
-        qvec = embed.embed_query(user_input)
-        citations = search_qdrant(
-            cfg.qdrant_url, cfg.qdrant_api_key, list(cfg.qdrant_collections),
-            qvec, top_k_per_collection=5, source_filter="utilitr"
-        )
-        messages, src_list = r_helpdesk.build_messages(user_input, citations)
-        gen = chat.stream_chat(messages, temperature=temperature, max_tokens=max_tokens)
-        answer = stream_answer(db, USER_ID, conv_id, gen)
+        qvec = pipe.result("embed")
+        cached, found, version = pipe.result("search")
+        if cached:
+            # replay a previous answer to a near-identical question
+            src_list = cached["citations"]
+            _ = stream_answer(db, USER_ID, conv_id, iter([cached["answer"]]),
+                              trace=trace, question=pending_question(), **stream_opts)
+        else:
+            citations, backend = found
+            trace.set(hits=len(citations), retrieval_backend=backend, embedded=qvec is not None)
+            if cfg.rerank_model_dir:
+                reranker = get_reranker(cfg.rerank_model_dir, batch_size=cfg.rerank_batch_size,
+                                        budget_ms=cfg.rerank_budget_ms)
+                with trace.stage("rerank"):
+                    citations = reranker.rerank(user_input, citations, cfg.rerank_top_n)
+            with trace.stage("build_messages"):
+                messages, src_list = r_helpdesk.build_messages(
+                    user_input, citations, token_budget=cfg.context_token_budget or None,
+                    history=history
+                )
+            if trace.enabled:
+                trace.set(sources=len(src_list),
+                          prompt_tokens=sum(count_tokens(m["content"]) for m in messages))
+            generate(messages, sources=src_list,
+                     on_answer=(lambda a: cache.put(qvec, a, src_list, version=version))
+                     if version is not None else None)
 
         # Citations panel
-        with st.expander("Sources"):
-            for src in src_list:
-                st.markdown(f"- **[{src['label']}]** {src['section']}  \n  {src['url']}  \n  _({src['collection']})_")
+        show_sources(src_list)
+
+    st.session_state["last_trace"] = finish_turn(trace, tcache, pipe)
+
+# Debug panel: stage breakdown of the last turn
+if cfg.tracing_enabled and show_debug and st.session_state.get("last_trace"):
+    with st.expander("Debug — dernier tour", expanded=True):
+        st.json(st.session_state["last_trace"])
 
 # Footer / export for SAS→R
 if st.session_state["agent"] == "sas_to_r":
-    msgs = db.get_messages(USER_ID, conv_id)
-    if msgs and msgs[-1].role == "assistant":
+    last = last_message(db, USER_ID, conv_id, window=cfg.chat_window)
+    if last and last[0] == "assistant":
         if st.button("Exporter la dernière réponse en .R"):
-            content = msgs[-1].content
+            content = last[1]
             # crude extract code block
             code = content
             if "```r" in content:
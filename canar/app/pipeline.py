@@ -0,0 +1,60 @@
+from __future__ import annotations
+import time
+from concurrent.futures import Executor, Future
+from typing import Any, Callable
+from .tracing import NullTrace, Trace
+
+# The stages of a turn that do not depend on each other (DB reads / writes, query
+# embedding, retrieval, parsing of an upload) are started as soon as their inputs exist
+# and run concurrently on a process-wide pool; the script only blocks when it needs a
+# result. The trace gets each stage's duration under its name, the time the script
+# actually blocked on it as `wait_<name>`, and `overlap_saved_ms` (stage time that
+# overlapped something else instead of adding up on the path to the first token).
+
+
+class TurnPipeline:
+    def __init__(self, pool: Executor, trace: Trace | NullTrace):
+        self.pool = pool
+        self.trace = trace
+        self._futures: dict[str, Future] = {}
+        self._busy: dict[str, float] = {}
+        self._waited = 0.0
+
+    def start(self, name: str, fn: Callable[..., Any], *args,
+              after: str | tuple[str, ...] = ()) -> Future:
+        """Run `fn(*args)` in the background; with `after`, `fn` first gets the results of
+        those stages (in order)."""
+        deps = [self._futures[a] for a in ((after,) if isinstance(after, str) else after)]
+
+        def run():
+            # dependencies are always submitted first, so they are running or done
+            args_ = (*(d.result() for d in deps), *args)
+            t = time.perf_counter()
+            try:
+                with self.trace.stage(name):
+                    return fn(*args_)
+            finally:
+                self._busy[name] = time.perf_counter() - t
+
+        self._futures[name] = self.pool.submit(run)
+        return self._futures[name]
+
+    def track(self, name: str, future: Future) -> Future:
+        """Make work started outside the turn (e.g. at upload time) a stage of it."""
+        self._futures[name] = future
+        return future
+
+    def result(self, name: str) -> Any:
+        t = time.perf_counter()
+        try:
+            return self._futures[name].result()
+        finally:
+            waited = time.perf_counter() - t
+            self._waited += waited
+            if self.trace.enabled:
+                self.trace.stages[f"wait_{name}"] = waited
+
+    def finish(self):
+        if self.trace.enabled:
+            saved = max(0.0, sum(self._busy.values()) - self._waited)
+            self.trace.set(overlap_saved_ms=round(saved * 1000, 1))
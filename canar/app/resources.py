@@ -0,0 +1,79 @@
+from __future__ import annotations
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from canar.app.config import AppConfig
+from canar.app.state import DB
+from canar.app.api.llm_client import ChatClient
+from canar.app.api.embed_client import EmbedClient
+from canar.app.api.admission import AdmissionController, get_controller
+from canar.app.api.failover import FailoverRetriever, get_retriever
+from canar.app.agents.sas_cache import TranslationCache
+from canar.app.jobs import JobManager
+
+# Process-wide resources: Streamlit re-runs main.py on every interaction, these are
+# built once per server process and shared by all sessions.
+
+
+@st.cache_resource
+def get_config() -> AppConfig:
+    cfg = AppConfig()
+    cfg.validate()
+    return cfg
+
+
+@st.cache_resource(validate=lambda db: db.ping())
+def get_db() -> DB:
+    # a DB failing its health check is rebuilt on the next call
+    cfg = get_config()
+    db = DB(cfg.db_path, write_behind=cfg.db_write_behind)
+    db.init_schema()
+    atexit.register(db.close)
+    return db
+
+
+def admission(backend: str) -> AdmissionController | None:
+    kw = get_config().admission_kwargs(backend)
+    return get_controller(backend, **kw) if kw else None
+
+
+@st.cache_resource
+def get_chat_client() -> ChatClient:
+    cfg = get_config()
+    chat = ChatClient(cfg.mistral_base, cfg.mistral_key, cfg.mistral_model,
+                      admission=admission("llm"), retries=cfg.upstream_retries)
+    atexit.register(chat.close)
+    return chat
+
+
+@st.cache_resource
+def get_embed_client() -> EmbedClient:
+    cfg = get_config()
+    embed = EmbedClient(cfg.embed_base, cfg.embed_model, cfg.embed_key,
+                        window_ms=cfg.embed_batch_window_ms, max_batch=cfg.embed_max_batch,
+                        admission=admission("embed"), retries=cfg.upstream_retries)
+    atexit.register(embed.close)
+    return embed
+
+
+@st.cache_resource
+def get_retriever_resource() -> FailoverRetriever:
+    return get_retriever(get_embed_client(), **get_config().retriever_kwargs())
+
+
+@st.cache_resource
+def get_translation_cache() -> TranslationCache:
+    cfg = get_config()
+    return TranslationCache(get_db(), cfg.mistral_model, max_entries=cfg.translation_cache_max)
+
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    return JobManager(get_db(), max_concurrent=get_config().gen_max_concurrent)
+
+
+@st.cache_resource
+def get_turn_pool() -> ThreadPoolExecutor:
+    pool = ThreadPoolExecutor(max_workers=get_config().turn_workers, thread_name_prefix="canar-turn")
+    atexit.register(pool.shutdown, wait=False)
+    return pool
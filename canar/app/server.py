@@ -0,0 +1,330 @@
+"""
+Headless HTTP API exposing the r_helpdesk and sas_to_r agents (no Streamlit).
+
+    POST /v1/r_helpdesk   {"question": ..., "conversation_id": null, "temperature": 0.2, "max_tokens": 2048}
+    POST /v1/sas_to_r     {"question": ..., "sas_code": ..., "conversation_id": null, ...}
+    GET  /health
+    GET  /metrics         (Prometheus text, filled when TRACING_ENABLED)
+
+Requests are authenticated with HTTP Basic (CanaR accounts). Answers are streamed as
+server-sent events: `sources` (r_helpdesk only), then `token` events, then `done`.
+A turn that gets no stream slot (CANAR_API_MAX_STREAMS) or model slot within
+ADMISSION_QUEUE_TIMEOUT_S is refused before streaming with a 503 and Retry-After;
+saturation met once streaming (retries, chunks of a large SAS program) is an `error`
+event.
+When `conversation_id` is given, the turn is persisted like in the web UI.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pydantic import BaseModel
+from canar.app.config import AppConfig
+from canar.app.state import DB
+from canar.app.api.llm_client import ChatClient
+from canar.app.api.embed_client import EmbedClient
+from canar.app.api.admission import CancelToken, Overloaded, get_controller
+from canar.app.api.failover import FailoverRetriever, get_retriever
+from canar.app.api.rerank import get_reranker
+from canar.app.agents import sas_to_r, sas_pipeline, r_helpdesk, memory
+from canar.app.agents.sas_cache import TranslationCache
+from canar.app.tokens import count_tokens
+from canar.app.tracing import METRICS, NullTrace, Trace, start_trace
+
+
+class TurnRequest(BaseModel):
+    question: str = ""
+    conversation_id: Optional[int] = None
+    temperature: float = 0.2
+    max_tokens: int = 2048
+
+
+class SasTurnRequest(TurnRequest):
+    sas_code: Optional[str] = None
+
+
+class _Resources:
+    cfg: AppConfig
+    db: DB
+    chat: ChatClient
+    embed: EmbedClient
+    retriever: FailoverRetriever
+    tcache: Optional[TranslationCache]
+    slots: asyncio.Semaphore
+    # verified credentials, so bcrypt runs once per (user, password) and not per request:
+    # (user, sha256(password)) -> (user id, expiry), least recently used first
+    auth_cache: OrderedDict[tuple[str, str], tuple[int, float]]
+
+
+AUTH_CACHE_SIZE = 1024
+AUTH_CACHE_TTL_S = 300.0
+
+
+res = _Resources()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    res.cfg = AppConfig()
+    res.cfg.validate()
+    res.db = DB(res.cfg.db_path, write_behind=res.cfg.db_write_behind)
+    res.db.init_schema()
+    llm_kw, embed_kw = res.cfg.admission_kwargs("llm"), res.cfg.admission_kwargs("embed")
+    res.chat = ChatClient(res.cfg.mistral_base, res.cfg.mistral_key, res.cfg.mistral_model,
+                          admission=get_controller("llm", **llm_kw) if llm_kw else None,
+                          retries=res.cfg.upstream_retries)
+    res.embed = EmbedClient(res.cfg.embed_base, res.cfg.embed_model, res.cfg.embed_key,
+                            window_ms=res.cfg.embed_batch_window_ms,
+                            max_batch=res.cfg.embed_max_batch,
+                            admission=get_controller("embed", **embed_kw) if embed_kw else None,
+                            retries=res.cfg.upstream_retries)
+    res.retriever = get_retriever(res.embed, **res.cfg.retriever_kwargs())
+    res.tcache = (TranslationCache(res.db, res.cfg.mistral_model,
+                                   max_entries=res.cfg.translation_cache_max)
+                  if res.cfg.translation_cache_enabled else None)
+    res.slots = asyncio.Semaphore(res.cfg.api_max_streams)
+    res.auth_cache = OrderedDict()
+    yield
+    res.chat.close()
+    res.embed.close()
+    res.db.close()
+
+
+app = FastAPI(title="CanaR API", lifespan=lifespan)
+security = HTTPBasic()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request, exc: Overloaded):
+    # the model backend is saturated: tell clients when to come back
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(max(1, round(exc.retry_after_s)))})
+
+
+async def current_user(creds: HTTPBasicCredentials = Depends(security)) -> int:
+    key = (creds.username, hashlib.sha256(creds.password.encode("utf-8")).hexdigest())
+    hit = res.auth_cache.get(key)
+    if hit and hit[1] > time.monotonic():
+        res.auth_cache.move_to_end(key)
+        return hit[0]
+    # expired entries are re-verified: a changed password or a removed account stops working
+    res.auth_cache.pop(key, None)
+    uid = await asyncio.to_thread(res.db.verify_user, creds.username, creds.password)
+    if uid is None:
+        raise HTTPException(status_code=401, detail="Identifiants invalides",
+                            headers={"WWW-Authenticate": "Basic"})
+    res.auth_cache[key] = (uid, time.monotonic() + AUTH_CACHE_TTL_S)
+    while len(res.auth_cache) > AUTH_CACHE_SIZE:
+        res.auth_cache.popitem(last=False)
+    return uid
+
+
+class _Slots:
+    """Slots taken by `_reserve`, given back once: by the stream when the model is done,
+    or by `_SlotResponse` however the response ends (also when its body never started)."""
+
+    def __init__(self, lease: Optional[tuple]):
+        self.lease = lease
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            if self.lease:
+                res.chat.admission.release(self.lease)
+            res.slots.release()
+
+
+class _SlotResponse(StreamingResponse):
+    def __init__(self, content: AsyncIterator[str], slots: _Slots):
+        super().__init__(content, media_type="text/event-stream")
+        self.slots = slots
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slots.release()
+
+
+async def _reserve(llm: bool = True) -> _Slots:
+    """A stream slot of this server and (with `llm`) a model admission slot, taken before
+    the response starts so that saturation is still a 503 with Retry-After."""
+    try:
+        await asyncio.wait_for(res.slots.acquire(), res.cfg.admission_queue_timeout_s)
+    except asyncio.TimeoutError:
+        raise Overloaded("api", max(1.0, res.chat.estimated_wait_s()))
+    try:
+        return _Slots(await res.chat.admission.aacquire() if llm and res.chat.admission else None)
+    except BaseException:
+        res.slots.release()
+        raise
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_turn(user_id: int, req: TurnRequest, messages: list[dict],
+                       sources: list[dict] | None, trace: Trace | NullTrace,
+                       slots: _Slots) -> AsyncIterator[str]:
+    parts: list[str] = []
+    try:
+        if sources is not None:
+            yield _sse("sources", sources)
+        gen = res.chat.astream_chat(messages, temperature=req.temperature,
+                                    max_tokens=req.max_tokens, admitted=True)
+        try:
+            async for token in trace.awrap_stream(gen):
+                parts.append(token)
+                yield _sse("token", token)
+        except Overloaded as e:
+            # headers are gone already: report it in-band
+            yield _sse("error", {"detail": str(e), "retry_after": round(e.retry_after_s)})
+            return
+    finally:
+        slots.release()
+    answer = "".join(parts)
+    if req.conversation_id is not None:
+        with trace.stage("persist_turn"):
+            await asyncio.to_thread(res.db.append_turn, user_id, req.conversation_id,
+                                    req.question, answer)
+        if res.cfg.history_token_budget:
+            memory.schedule_summary(res.db, res.chat, user_id, req.conversation_id,
+                                    res.cfg.history_token_budget, res.cfg.history_max_messages)
+    trace.finish()
+    yield _sse("done", {"chars": len(answer)})
+
+
+async def _check_conversation(user_id: int, req: TurnRequest, trace: Trace | NullTrace):
+    # the turn itself is written once the answer is complete (DB.append_turn)
+    if req.conversation_id is None:
+        return
+    with trace.stage("check_conversation"):
+        conv = await asyncio.to_thread(res.db.get_conversation, req.conversation_id)
+    if not conv or conv.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Conversation introuvable ou non propriétaire.")
+
+
+async def _history(user_id: int, req: TurnRequest, trace: Trace | NullTrace) -> list[dict]:
+    cfg = res.cfg
+    if req.conversation_id is None or not cfg.history_token_budget:
+        return []
+    with trace.stage("history"):
+        return await asyncio.to_thread(memory.history_messages, res.db, user_id,
+                                       req.conversation_id, cfg.history_token_budget,
+                                       cfg.history_max_messages)
+
+
+@app.get("/health")
+async def health():
+    ok = await asyncio.to_thread(res.db.ping)
+    admission = {name: c.admission.stats() for name, c in (("llm", res.chat), ("embed", res.embed))
+                 if c.admission}
+    return {"status": "ok" if ok else "degraded", "db": ok, "admission": admission,
+            "retrieval": res.retriever.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return METRICS.prometheus_text()
+
+
+@app.post("/v1/r_helpdesk")
+async def r_helpdesk_turn(req: TurnRequest, user_id: int = Depends(current_user)):
+    cfg = res.cfg
+    trace = start_trace("r_helpdesk", cfg.tracing_enabled, cfg.trace_jsonl)
+    await _check_conversation(user_id, req, trace)
+    with trace.stage("embed"):
+        qvec = await asyncio.to_thread(res.retriever.embed_query, req.question)
+    with trace.stage("search"):
+        citations, backend = await asyncio.to_thread(
+            res.retriever.search, list(cfg.qdrant_collections), qvec, req.question,
+            source_filter="utilitr", timeout_s=cfg.qdrant_timeout_s,
+            **cfg.search_kwargs(req.question)
+        )
+    trace.set(hits=len(citations), retrieval_backend=backend, embedded=qvec is not None)
+    if cfg.rerank_model_dir:
+        reranker = get_reranker(cfg.rerank_model_dir, batch_size=cfg.rerank_batch_size,
+                                budget_ms=cfg.rerank_budget_ms)
+        with trace.stage("rerank"):
+            citations = await asyncio.to_thread(reranker.rerank, req.question, citations,
+                                                cfg.rerank_top_n)
+    history = await _history(user_id, req, trace)
+    with trace.stage("build_messages"):
+        messages, src_list = r_helpdesk.build_messages(
+            req.question, citations, token_budget=cfg.context_token_budget or None,
+            history=history
+        )
+    if trace.enabled:
+        trace.set(sources=len(src_list),
+                  prompt_tokens=sum(count_tokens(m["content"]) for m in messages))
+    slots = await _reserve()
+    return _SlotResponse(_stream_turn(user_id, req, messages, src_list, trace, slots), slots)
+
+
+async def _stream_chunked(user_id: int, req: SasTurnRequest, trace: Trace | NullTrace,
+                          slots: _Slots) -> AsyncIterator[str]:
+    cfg = res.cfg
+    cancel = CancelToken()
+    events = sas_pipeline.translate_sas(res.chat, req.sas_code, req.question,
+                                        parallelism=cfg.sas_parallelism,
+                                        max_lines=cfg.sas_chunk_lines,
+                                        temperature=req.temperature, max_tokens=req.max_tokens,
+                                        cache=res.tcache, cancel=cancel)
+    script = ""
+    try:
+        with trace.stage("translate_chunks"):
+            while (ev := await asyncio.to_thread(next, events, None)) is not None:
+                if isinstance(ev, sas_pipeline.ChunkDone):
+                    yield _sse("progress", {"chunk": ev.index, "total": ev.total})
+                else:
+                    script = ev
+    except Overloaded as e:
+        # headers are gone already: report it in-band
+        yield _sse("error", {"detail": str(e), "retry_after": round(e.retry_after_s)})
+        return
+    except Exception as e:
+        yield _sse("error", {"detail": str(e)})
+        return
+    finally:
+        # e.g. the client went away: stop the chunks still queued or in flight
+        cancel.set()
+        try:
+            events.close()
+        except ValueError:
+            pass  # still running in its thread, it stops on the cancel
+        slots.release()
+    answer = f"```r\n{script}```"
+    yield _sse("token", answer)
+    if req.conversation_id is not None:
+        await asyncio.to_thread(res.db.append_turn, user_id, req.conversation_id,
+                                req.question, answer)
+    trace.finish()
+    yield _sse("done", {"chars": len(answer)})
+
+
+@app.post("/v1/sas_to_r")
+async def sas_to_r_turn(req: SasTurnRequest, user_id: int = Depends(current_user)):
+    cfg = res.cfg
+    trace = start_trace("sas_to_r", cfg.tracing_enabled, cfg.trace_jsonl)
+    await _check_conversation(user_id, req, trace)
+    if req.sas_code and req.sas_code.count("\n") >= cfg.sas_chunk_threshold_lines:
+        # large program: chunked translation, `progress` events then the stitched script
+        # (its chunks take their model slots one by one, the stream slot is taken here)
+        slots = await _reserve(llm=False)
+        return _SlotResponse(_stream_chunked(user_id, req, trace, slots), slots)
+    history = await _history(user_id, req, trace)
+    with trace.stage("build_messages"):
+        messages = sas_to_r.build_messages(req.question, req.sas_code, history=history)
+    if trace.enabled:
+        trace.set(prompt_tokens=sum(count_tokens(m["content"]) for m in messages))
+    slots = await _reserve()
+    return _SlotResponse(_stream_turn(user_id, req, messages, None, trace, slots), slots)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+import datetime as dt
+import hashlib
+import hmac
+import secrets
+from typing import Optional
+from .state import DB
+
+# Login tokens: "<random>.<HMAC(random)>". The signature rejects forged tokens without a
+# DB round-trip; the DB row (hash of the token) makes them revocable and lets a login
+# survive worker restarts and moves between workers. Without CANAR_SECRET, tokens only
+# stay valid for the lifetime of the process. Tokens travel in the URL: they are
+# short-lived and rotated (`renew`) while the session is in use.
+
+_FALLBACK_SECRET = secrets.token_hex(32)
+
+
+def _sign(raw: str, secret: str) -> str:
+    key = (secret or _FALLBACK_SECRET).encode("utf-8")
+    return hmac.new(key, raw.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue(db: DB, user_id: int, secret: str = "", ttl_min: float = 30) -> str:
+    raw = secrets.token_urlsafe(24)
+    token = f"{raw}.{_sign(raw, secret)}"
+    db.create_session(user_id, _hash(token), dt.datetime.utcnow() + dt.timedelta(minutes=ttl_min))
+    return token
+
+
+def resolve(db: DB, token: str, secret: str = "") -> Optional[int]:
+    """User id of a valid, unexpired token, else None."""
+    raw, _, sig = token.partition(".")
+    if not raw or not hmac.compare_digest(sig, _sign(raw, secret)):
+        return None
+    return db.session_user(_hash(token))
+
+
+def revoke(db: DB, token: str):
+    db.delete_session(_hash(token))
+
+
+def renew(db: DB, token: str | None, user_id: int, secret: str = "", ttl_min: float = 30) -> str:
+    """Replace `token` (revoked) by a fresh one."""
+    if token:
+        revoke(db, token)
+    return issue(db, user_id, secret, ttl_min)
@@ -1,8 +1,12 @@
 from __future__ import annotations
 import os
+import queue
+import threading
+import time
 import datetime as dt
 from typing import Optional, List
-from sqlmodel import SQLModel, Field, Session, create_engine, select, delete
+from sqlalchemy import Index, event, func, insert, inspect, or_, update
+from sqlmodel import SQLModel, Field, Session, create_engine, select, delete, text
 import bcrypt
 
 
@@ -15,12 +19,18 @@ class User(SQLModel, table=True):
 
 
 class Conversation(SQLModel, table=True):
+    # sidebar listing: WHERE user_id = ? ORDER BY updated_at DESC
+    __table_args__ = (Index("ix_conversation_user_updated", "user_id", "updated_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True, foreign_key="user.id")
     title: str
     agent: str  # "sas_to_r" | "r_helpdesk"
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow())
     updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow())
+    # rolling summary of the messages up to `summary_upto` (see agents.memory)
+    summary: str = ""
+    summary_upto: int = 0
 
 
 class Message(SQLModel, table=True):
@@ -31,18 +41,181 @@ class Message(SQLModel, table=True):
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow())
 
 
+class TranslationCacheEntry(SQLModel, table=True):
+    # SAS→R translations keyed by "<normalized code hash>:<model>:<prompt version>"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(index=True, unique=True)
+    r_code: str
+    hits: int = 0
+    created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow())
+    last_used_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow(), index=True)
+
+
+class LoginSession(SQLModel, table=True):
+    # login tokens (see app.sessions); only a hash of the signed token is stored
+    id: Optional[int] = Field(default=None, primary_key=True)
+    token_hash: str = Field(index=True, unique=True)
+    user_id: int = Field(index=True, foreign_key="user.id")
+    created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.utcnow())
+    expires_at: dt.datetime = Field(index=True)
+
+
 # ---------- DB ----------
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL: readers don't block the writer; NORMAL sync is durable enough in WAL mode
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-20000")
+    cur.close()
+
+
+class _WriteBehind:
+    """
+    Bounded queue of pending message rows flushed by a background thread in batches
+    (one transaction per batch). `put` blocks when the queue is full.
+    A failed batch is retried row by row: rows that fail alone are dropped (and reported
+    by `flush`), a batch whose every row fails (database down) is retried with backoff
+    until it goes through, so callers block on the full queue instead of losing messages.
+    """
+
+    def __init__(self, db: DB, max_queue: int = 10000, batch_size: int = 200,
+                 interval_s: float = 0.2):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.q: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self.lost = 0
+        self.error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name="canar-db-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, row: dict):
+        self.q.put(row)
+
+    def _drain(self) -> list[dict]:
+        rows = []
+        try:
+            rows.append(self.q.get(timeout=self.interval_s))
+            while len(rows) < self.batch_size:
+                rows.append(self.q.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _run(self):
+        while not (self._stop.is_set() and self.q.empty()):
+            rows = self._drain()
+            if not rows:
+                continue
+            try:
+                self._write(rows)
+            finally:
+                for _ in rows:
+                    self.q.task_done()
+
+    def _write(self, rows: list[dict]):
+        delay = 0.5
+        while True:
+            try:
+                self.db._write_messages(rows)
+                return
+            except Exception as e:
+                err = e
+            failed = []
+            for r in rows:
+                try:
+                    self.db._write_messages([r])
+                except Exception as e:
+                    failed.append(r)
+                    err = e
+            if len(failed) < len(rows) or self._stop.is_set():
+                if failed:
+                    self.lost += len(failed)
+                    self.error = err
+                    print(f"[canar] write-behind: {len(failed)} messages dropped: {err}")
+                return
+            print(f"[canar] write-behind: {len(rows)} messages not written ({err}), "
+                  f"retrying in {delay:.1f} s")
+            time.sleep(delay)
+            delay = min(2 * delay, 30.0)
+
+    def flush(self):
+        self.q.join()
+        if self.error is not None:
+            lost, err = self.lost, self.error
+            self.lost, self.error = 0, None
+            raise RuntimeError(f"write-behind: {lost} messages could not be written") from err
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
 class DB:
-    def __init__(self, sqlite_path: str):
+    def __init__(self, sqlite_path: str, write_behind: bool = False):
         db_url = os.getenv("DB_POSTGRES_URL", "").strip()
         if db_url:
-            # Postgres with a small pool for concurrent users
+            # Postgres with a small pool for concurrent users; psycopg switches repeated
+            # statements to server-side prepared ones after `prepare_threshold` executions
+            connect_args = {}
+            if (threshold := os.getenv("DB_PREPARE_THRESHOLD")):
+                connect_args["prepare_threshold"] = int(threshold)
             self.engine = create_engine(db_url, echo=False, pool_size=5,
-                                        max_overflow=10, pool_pre_ping=True)
+                                        max_overflow=10, pool_pre_ping=True,
+                                        connect_args=connect_args)
         else:
             os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
             self.engine = create_engine(f"sqlite:///{sqlite_path}", echo=False)
+            event.listen(self.engine, "connect", _sqlite_pragmas)
+        # message rows and transactions committed by this process (canar-bench)
+        self.written = {"messages": 0, "commits": 0}
+        self._written_lock = threading.Lock()
+        self._writer: Optional[_WriteBehind] = None
+        if write_behind:
+            self._writer = _WriteBehind(self)
+
+    def init_schema(self):
+        """Create missing tables and indexes. Run once at startup, not on every request."""
         SQLModel.metadata.create_all(self.engine)
+        # columns added after a table was first created
+        cols = {c["name"] for c in inspect(self.engine).get_columns("conversation")}
+        with self.engine.begin() as conn:
+            if "summary" not in cols:
+                conn.execute(text("ALTER TABLE conversation ADD COLUMN summary TEXT NOT NULL DEFAULT ''"))
+            if "summary_upto" not in cols:
+                conn.execute(text("ALTER TABLE conversation ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0"))
+        # create_all skips indexes of tables that already exist
+        for table in SQLModel.metadata.sorted_tables:
+            for idx in table.indexes:
+                idx.create(self.engine, checkfirst=True)
+
+    def ping(self) -> bool:
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            return False
+
+    @property
+    def write_behind(self) -> bool:
+        return self._writer is not None
+
+    def flush(self):
+        """Wait until every queued write-behind message is in the database (RuntimeError if
+        some could not be written since the last flush)."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.engine.dispose()
 
     # ----- Users -----
     def create_user(self, username: str, password: str) -> int:
@@ -70,6 +243,24 @@ class DB:
         with Session(self.engine) as s:
             return s.get(User, user_id)
 
+    # ----- Login sessions -----
+    def create_session(self, user_id: int, token_hash: str, expires_at: dt.datetime):
+        with Session(self.engine) as s:
+            s.exec(delete(LoginSession).where(LoginSession.expires_at < dt.datetime.utcnow()))
+            s.add(LoginSession(token_hash=token_hash, user_id=user_id, expires_at=expires_at))
+            s.commit()
+
+    def session_user(self, token_hash: str) -> Optional[int]:
+        with Session(self.engine) as s:
+            return s.exec(select(LoginSession.user_id)
+                          .where(LoginSession.token_hash == token_hash,
+                                 LoginSession.expires_at > dt.datetime.utcnow())).first()
+
+    def delete_session(self, token_hash: str):
+        with Session(self.engine) as s:
+            s.exec(delete(LoginSession).where(LoginSession.token_hash == token_hash))
+            s.commit()
+
     # ----- Conversations -----
     def create_conversation(self, user_id: int, title: str, agent: str) -> int:
         with Session(self.engine) as s:
@@ -90,6 +281,26 @@ class DB:
                     .order_by(Conversation.updated_at.desc()))
             return list(s.exec(stmt))
 
+    def list_conversation_page(self, user_id: int, limit: int = 20,
+                               after: Optional[tuple[dt.datetime, int]] = None,
+                               search: str = "") -> list:
+        """
+        Keyset-paginated (id, title, agent, updated_at) rows, most recent first.
+        `after` is the (updated_at, id) of the last row of the previous page.
+        """
+        with Session(self.engine) as s:
+            stmt = (select(Conversation.id, Conversation.title, Conversation.agent,
+                           Conversation.updated_at)
+                    .where(Conversation.user_id == user_id))
+            if search:
+                stmt = stmt.where(Conversation.title.ilike(f"%{search}%"))
+            if after is not None:
+                ts, cid = after
+                stmt = stmt.where(or_(Conversation.updated_at < ts,
+                                      (Conversation.updated_at == ts) & (Conversation.id < cid)))
+            stmt = stmt.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit)
+            return list(s.exec(stmt))
+
     def rename_conversation(self, user_id: int, conv_id: int, new_title: str):
         with Session(self.engine) as s:
             c = s.get(Conversation, conv_id)
@@ -110,23 +321,146 @@ class DB:
             s.commit()
 
     # ----- Messages -----
-    def add_message(self, user_id: int, conv_id: int, role: str, content: str) -> int:
+    @staticmethod
+    def _touch(s: Session, user_id: int, conv_id: int, when: dt.datetime):
+        # ownership check and updated_at bump in a single statement
+        res = s.execute(update(Conversation)
+                        .where(Conversation.id == conv_id, Conversation.user_id == user_id)
+                        .values(updated_at=when))
+        if res.rowcount == 0:
+            raise PermissionError("Conversation introuvable ou non propriétaire.")
+
+    def add_message(self, user_id: int, conv_id: int, role: str, content: str) -> Optional[int]:
+        """Returns the message id, or None when the write is queued (write-behind mode)."""
+        return self.append_messages(user_id, conv_id, [(role, content)])[0]
+
+    def append_turn(self, user_id: int, conv_id: int, question: str,
+                    answer: str) -> tuple[Optional[int], Optional[int]]:
+        """Persist a user question and its answer in one transaction."""
+        ids = self.append_messages(user_id, conv_id, [("user", question), ("assistant", answer)])
+        return ids[0], ids[1]
+
+    def append_messages(self, user_id: int, conv_id: int,
+                        items: list[tuple[str, str]]) -> list[Optional[int]]:
+        now = dt.datetime.utcnow()
+        if self._writer is not None:
+            for role, content in items:
+                self._writer.put({"user_id": user_id, "conversation_id": conv_id, "role": role,
+                                  "content": content, "created_at": now})
+            return [None] * len(items)
         with Session(self.engine) as s:
-            c = s.get(Conversation, conv_id)
-            if not c or c.user_id != user_id:
-                raise PermissionError("Conversation introuvable ou non propriétaire.")
-            m = Message(conversation_id=conv_id, role=role, content=content)
-            s.add(m)
-            c.updated_at = dt.datetime.utcnow()
-            s.add(c)
+            self._touch(s, user_id, conv_id, now)
+            msgs = [Message(conversation_id=conv_id, role=role, content=content, created_at=now)
+                    for role, content in items]
+            s.add_all(msgs)
+            s.flush()
+            ids = [m.id for m in msgs]
+            s.commit()
+        self._count_write(len(msgs))
+        return ids
+
+    def update_message(self, msg_id: int, content: str):
+        """Rewrite a message in place (answers persisted while they are generated)."""
+        with Session(self.engine) as s:
+            s.execute(update(Message).where(Message.id == msg_id).values(content=content))
             s.commit()
-            s.refresh(m)
-            return m.id
 
-    def get_messages(self, user_id: int, conv_id: int) -> List[Message]:
+    def _write_messages(self, rows: list[dict]):
+        """Bulk insert of queued rows; rows of conversations the user doesn't own are dropped."""
+        pairs = {(r["user_id"], r["conversation_id"]) for r in rows}
+        with Session(self.engine) as s:
+            owned = {(u, c) for u, c in s.exec(select(Conversation.user_id, Conversation.id)
+                                               .where(Conversation.id.in_([c for _, c in pairs])))}
+            rows = [r for r in rows if (r["user_id"], r["conversation_id"]) in owned]
+            if not rows:
+                return
+            s.execute(insert(Message), [
+                {k: r[k] for k in ("conversation_id", "role", "content", "created_at")} for r in rows
+            ])
+            last: dict[int, dt.datetime] = {}
+            for r in rows:
+                last[r["conversation_id"]] = max(last.get(r["conversation_id"], r["created_at"]),
+                                                 r["created_at"])
+            for cid, when in last.items():
+                s.execute(update(Conversation).where(Conversation.id == cid).values(updated_at=when))
+            s.commit()
+        self._count_write(len(rows))
+
+    def _count_write(self, messages: int):
+        with self._written_lock:
+            self.written["messages"] += messages
+            self.written["commits"] += 1
+
+    def get_messages(self, user_id: int, conv_id: int, limit: Optional[int] = None,
+                     before_id: Optional[int] = None,
+                     after_id: Optional[int] = None) -> List[Message]:
+        """
+        Messages of a conversation in chronological order. With `limit`, only the
+        `limit` most recent ones (older than `before_id` / newer than `after_id`
+        if given) are returned.
+        """
         with Session(self.engine) as s:
             c = s.get(Conversation, conv_id)
             if not c or c.user_id != user_id:
                 return []
-            stmt = select(Message).where(Message.conversation_id == conv_id).order_by(Message.id)
-            return list(s.exec(stmt))
+            stmt = select(Message).where(Message.conversation_id == conv_id)
+            if before_id is not None:
+                stmt = stmt.where(Message.id < before_id)
+            if after_id is not None:
+                stmt = stmt.where(Message.id > after_id)
+            if limit is None:
+                return list(s.exec(stmt.order_by(Message.id)))
+            rows = list(s.exec(stmt.order_by(Message.id.desc()).limit(limit)))
+            return rows[::-1]
+
+    def last_message_id(self, user_id: int, conv_id: int) -> Optional[int]:
+        """Id of the newest stored message of a conversation (one index lookup), None if empty."""
+        with Session(self.engine) as s:
+            return s.exec(select(func.max(Message.id)).select_from(Message)
+                          .join(Conversation, Conversation.id == Message.conversation_id)
+                          .where(Message.conversation_id == conv_id,
+                                 Conversation.user_id == user_id)).one()
+
+    def update_summary(self, user_id: int, conv_id: int, summary: str, upto_id: int):
+        with Session(self.engine) as s:
+            s.execute(update(Conversation)
+                      .where(Conversation.id == conv_id, Conversation.user_id == user_id)
+                      .values(summary=summary, summary_upto=upto_id))
+            s.commit()
+
+    # ----- Translation cache -----
+    def get_translations(self, keys: list[str]) -> dict[str, str]:
+        if not keys:
+            return {}
+        with Session(self.engine) as s:
+            rows = list(s.exec(select(TranslationCacheEntry)
+                               .where(TranslationCacheEntry.key.in_(keys))))
+            if rows:
+                s.execute(update(TranslationCacheEntry)
+                          .where(TranslationCacheEntry.id.in_([r.id for r in rows]))
+                          .values(hits=TranslationCacheEntry.hits + 1,
+                                  last_used_at=dt.datetime.utcnow()))
+                s.commit()
+            return {r.key: r.r_code for r in rows}
+
+    def put_translation(self, key: str, r_code: str):
+        with Session(self.engine) as s:
+            e = s.exec(select(TranslationCacheEntry).where(TranslationCacheEntry.key == key)).first()
+            if e is None:
+                e = TranslationCacheEntry(key=key, r_code=r_code)
+            else:
+                e.r_code = r_code
+                e.last_used_at = dt.datetime.utcnow()
+            s.add(e)
+            s.commit()
+
+    def prune_translations(self, max_entries: int):
+        """Keep the `max_entries` most recently used translations."""
+        with Session(self.engine) as s:
+            cutoff = s.exec(select(TranslationCacheEntry.last_used_at)
+                            .order_by(TranslationCacheEntry.last_used_at.desc())
+                            .offset(max_entries).limit(1)).first()
+            if cutoff is not None:
+                s.exec(delete(TranslationCacheEntry)
+                       .where(TranslationCacheEntry.last_used_at <= cutoff))
+                s.commit()
@@ -0,0 +1,31 @@
+from __future__ import annotations
+import os
+import re
+from functools import lru_cache
+
+# Token counting for prompt budgeting. With TOKENIZER_PATH pointing at the model's
+# `tokenizer.json` (and the `tokenizers` package installed) counts are exact; otherwise
+# a word/punctuation heuristic is used, close enough to budget a prompt.
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    path = os.getenv("TOKENIZER_PATH", "").strip()
+    if not path:
+        return None
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        return None
+    return Tokenizer.from_file(path)
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tok = _tokenizer()
+    if tok is not None:
+        return len(tok.encode(text, add_special_tokens=False).ids)
+    # long words are split into several sub-word tokens
+    return sum(1 + len(p) // 6 for p in _PIECE_RE.findall(text))
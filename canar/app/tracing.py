@@ -0,0 +1,140 @@
+from __future__ import annotations
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+# Per-turn tracing: stage durations + a few counters, exported as JSON lines and as
+# Prometheus text. When tracing is off, `start_trace` hands out a NullTrace whose
+# methods do nothing, so instrumented code pays a method call per stage at most.
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hist: dict[tuple[str, str], list] = {}  # (kind, stage) -> [bucket counts, sum, count]
+        self.counters: dict[tuple[str, str], float] = {}
+
+    def observe(self, kind: str, stage: str, seconds: float):
+        with self.lock:
+            h = self.hist.setdefault((kind, stage), [[0] * len(_BUCKETS), 0.0, 0])
+            for i, le in enumerate(_BUCKETS):
+                if seconds <= le:
+                    h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+
+    def inc(self, kind: str, name: str, value: float):
+        with self.lock:
+            self.counters[(kind, name)] = self.counters.get((kind, name), 0.0) + value
+
+    def prometheus_text(self) -> str:
+        lines = ["# TYPE canar_stage_seconds histogram"]
+        with self.lock:
+            for (kind, stage), (buckets, total, count) in sorted(self.hist.items()):
+                lbl = f'agent="{kind}",stage="{stage}"'
+                for le, n in zip(_BUCKETS, buckets):
+                    lines.append(f'canar_stage_seconds_bucket{{{lbl},le="{le}"}} {n}')
+                lines.append(f'canar_stage_seconds_bucket{{{lbl},le="+Inf"}} {count}')
+                lines.append(f"canar_stage_seconds_sum{{{lbl}}} {total}")
+                lines.append(f"canar_stage_seconds_count{{{lbl}}} {count}")
+            for name in sorted({n for _, n in self.counters}):
+                lines.append(f"# TYPE canar_{name}_total counter")
+                for (kind, n), v in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f'canar_{name}_total{{agent="{kind}"}} {v}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = _Metrics()
+_JSONL_LOCK = threading.Lock()
+
+
+class Trace:
+    enabled = True
+
+    def __init__(self, kind: str, jsonl_path: str = ""):
+        self.kind = kind
+        self.jsonl_path = jsonl_path
+        self.t0 = time.perf_counter()
+        self.started_at = time.time()
+        self.stages: dict[str, float] = {}
+        self.attrs: dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def wrap_stream(self, gen: Iterable[str]) -> Iterator[str]:
+        """Pass tokens through, recording time-to-first-token, generation time and deltas."""
+        t = time.perf_counter()
+        n = 0
+        for token in gen:
+            if n == 0:
+                self.stages["ttft"] = time.perf_counter() - t
+            n += 1
+            yield token
+        self.stages["generate"] = time.perf_counter() - t
+        self.attrs["output_deltas"] = n
+
+    async def awrap_stream(self, gen: AsyncIterable[str]) -> AsyncIterator[str]:
+        t = time.perf_counter()
+        n = 0
+        async for token in gen:
+            if n == 0:
+                self.stages["ttft"] = time.perf_counter() - t
+            n += 1
+            yield token
+        self.stages["generate"] = time.perf_counter() - t
+        self.attrs["output_deltas"] = n
+
+    def finish(self) -> dict:
+        self.stages["total"] = time.perf_counter() - self.t0
+        record = {"ts": self.started_at, "agent": self.kind,
+                  "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()},
+                  **self.attrs}
+        for name, seconds in self.stages.items():
+            METRICS.observe(self.kind, name, seconds)
+        METRICS.inc(self.kind, "turns", 1)
+        METRICS.inc(self.kind, "output_deltas", self.attrs.get("output_deltas", 0))
+        if self.jsonl_path:
+            with _JSONL_LOCK, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+
+class NullTrace:
+    kind = ""
+    enabled = False
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def set(self, **attrs):
+        pass
+
+    def wrap_stream(self, gen: Iterable[str]) -> Iterable[str]:
+        return gen
+
+    def awrap_stream(self, gen: AsyncIterable[str]) -> AsyncIterable[str]:
+        return gen
+
+    def finish(self) -> dict | None:
+        return None
+
+
+_NULL = NullTrace()
+
+
+def start_trace(kind: str, enabled: bool, jsonl_path: str = "") -> Trace | NullTrace:
+    return Trace(kind, jsonl_path) if enabled else _NULL
@@ -1,22 +1,152 @@
 from __future__ import annotations
+import time
 import streamlit as st
 from ..state import DB
+from ..tracing import NullTrace, Trace
+from ..jobs import CANCELLED, ERROR, QUEUED, GenerationJob, JobManager
 
+# Per-session message cache:
+#   {conv_id: {"msgs": [(id, role, content), ...], "has_more": bool, "last_id": int | None}}
+# kept up to date by the writers below and valid while the newest message id in the DB is
+# `last_id`: a rerun costs one max(id) lookup, and messages written elsewhere (another tab,
+# the API, a background job) reload the window.
+_CACHE_KEY = "_msg_cache"
 
-def render_messages(db: DB, user_id: int, conv_id: int):
-    msgs = db.get_messages(user_id, conv_id)
-    for m in msgs:
-        with st.chat_message(m.role):
-            st.markdown(m.content)
 
+def _conv_cache(db: DB, user_id: int, conv_id: int, window: int) -> dict:
+    caches = st.session_state.setdefault(_CACHE_KEY, {})
+    entry = caches.get(conv_id)
+    last_id = db.last_message_id(user_id, conv_id)
+    if entry is None or entry["last_id"] != last_id:
+        msgs = db.get_messages(user_id, conv_id, limit=window + 1)
+        entry = caches[conv_id] = {
+            "msgs": [(m.id, m.role, m.content) for m in msgs[-window:]],
+            "has_more": len(msgs) > window,
+            "last_id": msgs[-1].id if msgs else None,
+        }
+    return entry
 
-def stream_answer(db: DB, user_id: int, conv_id: int, generator):
+
+def _load_older(db: DB, user_id: int, conv_id: int, window: int):
+    entry = st.session_state[_CACHE_KEY][conv_id]
+    # messages queued by the write-behind writer have no id yet
+    first_id = next((mid for mid, _, _ in entry["msgs"] if mid is not None), None)
+    older = db.get_messages(user_id, conv_id, limit=window + 1, before_id=first_id)
+    entry["has_more"] = len(older) > window
+    entry["msgs"] = [(m.id, m.role, m.content) for m in older[-window:]] + entry["msgs"]
+
+
+def remember_message(conv_id: int, msg_id: int, role: str, content: str):
+    """Append a freshly persisted message to the session cache (no-op if not loaded yet)."""
+    entry = st.session_state.get(_CACHE_KEY, {}).get(conv_id)
+    if entry is not None:
+        entry["msgs"].append((msg_id, role, content))
+        if msg_id is not None:
+            entry["last_id"] = max(msg_id, entry["last_id"] or 0)
+
+
+def forget_conversation(conv_id: int):
+    st.session_state.get(_CACHE_KEY, {}).pop(conv_id, None)
+
+
+def last_message(db: DB, user_id: int, conv_id: int, window: int = 30) -> tuple[str, str] | None:
+    """(role, content) of the latest message, served from the cache."""
+    msgs = _conv_cache(db, user_id, conv_id, window)["msgs"]
+    return msgs[-1][1:] if msgs else None
+
+
+def render_messages(db: DB, user_id: int, conv_id: int, window: int = 30, hide: tuple = ()):
+    """`hide`: ids of messages drawn elsewhere (a generation job in flight)."""
+    entry = _conv_cache(db, user_id, conv_id, window)
+    if entry["has_more"]:
+        if st.button("Afficher les messages précédents", key=f"older_{conv_id}"):
+            _load_older(db, user_id, conv_id, window)
+            st.rerun()
+    for mid, role, content in entry["msgs"]:
+        if mid in hide:
+            continue
+        with st.chat_message(role):
+            st.markdown(content)
+
+
+def stream_answer(db: DB, user_id: int, conv_id: int, generator, flush_ms: float = 50.0,
+                  flush_chars: int = 400, trace: Trace | NullTrace | None = None,
+                  question: str | None = None):
+    """
+    Render a token stream, redrawing at most every `flush_ms` (or every `flush_chars`
+    new characters, or at a paragraph / code fence boundary) instead of per token.
+    With `question`, the question and the answer are persisted together as one turn.
+    """
+    trace = trace or NullTrace()
     with st.chat_message("assistant"):
         ph = st.empty()
-        acc = ""
-        for token in generator:
-            acc += token
-            ph.markdown(acc)
-        full_text = acc
-    db.add_message(user_id, conv_id, "assistant", full_text)
+        parts: list[str] = []
+        pending = 0
+        last_flush = time.monotonic()
+        try:
+            for token in generator:
+                parts.append(token)
+                pending += len(token)
+                now = time.monotonic()
+                if (now - last_flush) * 1000 >= flush_ms or pending >= flush_chars \
+                        or "\n\n" in token or "```" in token:
+                    ph.markdown("".join(parts))
+                    pending = 0
+                    last_flush = now
+        except BaseException:
+            # keep the question even if generation failed
+            if question is not None:
+                qid = db.add_message(user_id, conv_id, "user", question)
+                remember_message(conv_id, qid, "user", question)
+            raise
+        full_text = "".join(parts)
+        ph.markdown(full_text)
+    with trace.stage("persist_turn"):
+        if question is not None:
+            qid, mid = db.append_turn(user_id, conv_id, question, full_text)
+            remember_message(conv_id, qid, "user", question)
+        else:
+            mid = db.add_message(user_id, conv_id, "assistant", full_text)
+    remember_message(conv_id, mid, "assistant", full_text)
     return full_text
+
+
+def wait_notice(wait_s: float) -> str:
+    return f"_Forte affluence : réponse dans ~{wait_s:.0f} s…_"
+
+
+def attach_job(manager: JobManager, job_id: str, flush_ms: float = 50.0,
+               estimated_wait=None) -> GenerationJob | None:
+    """
+    Draw a background generation job (question + answer so far) and follow it until it
+    ends. Called again on every rerun while the job is in flight; the stop button
+    cancels it. `estimated_wait()` (s) is shown while the model backend has not answered.
+    Returns the finished job, or None if it is unknown (expired/restarted).
+    """
+    job = manager.get(job_id)
+    if job is None:
+        st.session_state.pop("job", None)
+        return None
+    if not job.finished and st.button("⏹ Arrêter", key=f"stop_{job.id}"):
+        job.cancel()
+    with st.chat_message("user"):
+        st.markdown(job.question)
+    with st.chat_message("assistant"):
+        ph = st.empty()
+        while not job.finished:
+            if job.status == QUEUED:
+                ph.markdown(f"_En attente… {manager.queued_ahead(job)} demande(s) avant la vôtre_")
+            elif not job.parts and estimated_wait and estimated_wait() >= 1:
+                ph.markdown(wait_notice(estimated_wait()))
+            else:
+                ph.markdown(job.text + " ▌")
+            time.sleep(flush_ms / 1000)
+        ph.markdown(job.text)
+        if job.status == CANCELLED:
+            st.caption("Génération interrompue.")
+        elif job.status == ERROR:
+            st.error(job.error)
+    # the turn is in the DB now: reload the history from there on the next run
+    st.session_state.pop("job", None)
+    forget_conversation(job.conv_id)
+    return job
@@ -2,6 +2,7 @@ from __future__ import annotations
 import streamlit as st
 from typing import Optional
 from ..state import DB
+from .chat import forget_conversation
 
 AGENT_LABELS = {
     "r_helpdesk": "Assistant R",
@@ -9,8 +10,23 @@ AGENT_LABELS = {
 }
 
 
+def _visible_conversations(db: DB, user_id: int, page_size: int, search: str) -> tuple[list, bool]:
+    # one keyset query per loaded page: cost depends on what is shown, not on history size
+    pages = st.session_state.get("sidebar_pages", 1)
+    rows: list = []
+    after = None
+    for _ in range(pages):
+        page = db.list_conversation_page(user_id, limit=page_size + 1, after=after, search=search)
+        has_more = len(page) > page_size
+        rows.extend(page[:page_size])
+        if not has_more:
+            return rows, False
+        after = (rows[-1].updated_at, rows[-1].id)
+    return rows, True
+
+
 def sidebar(db: DB, user_id: int, current_conv_id: Optional[int],
-            agent_options: list[str], current_agent: str):
+            agent_options: list[str], current_agent: str, page_size: int = 20):
     st.sidebar.header("Conversations")
 
     # Create new (compact)
@@ -28,8 +44,13 @@ def sidebar(db: DB, user_id: int, current_conv_id: Optional[int],
 
     st.sidebar.markdown("---")
 
-    # Conversation list
-    convs = db.list_conversations(user_id)
+    # Conversation list (searchable, paginated)
+    search = st.sidebar.text_input("Rechercher", key="conv_search",
+                                   placeholder="Titre…", label_visibility="collapsed").strip()
+    if search != st.session_state.get("sidebar_last_search", ""):
+        st.session_state["sidebar_last_search"] = search
+        st.session_state["sidebar_pages"] = 1
+    convs, has_more = _visible_conversations(db, user_id, page_size, search)
     for c in convs:
         block = st.sidebar.container()
 
@@ -51,6 +72,7 @@ def sidebar(db: DB, user_id: int, current_conv_id: Optional[int],
                 st.rerun()
             if b.button("🗑️ Supprimer", key=f"do_del_{c.id}"):
                 db.delete_conversation(user_id, c.id)
+                forget_conversation(c.id)
                 if current_conv_id == c.id:
                     st.session_state.pop("conv_id", None)
                 st.rerun()
@@ -61,6 +83,10 @@ def sidebar(db: DB, user_id: int, current_conv_id: Optional[int],
         row2_left.markdown(f"<div class='agent-label'>{label}</div>", unsafe_allow_html=True)
         row2_right.empty()  # keep grid alignment so the ⋯ stays aligned above
 
+    if has_more and st.sidebar.button("Charger plus", use_container_width=True, key="conv_more"):
+        st.session_state["sidebar_pages"] = st.session_state.get("sidebar_pages", 1) + 1
+        st.rerun()
+
     # CSS: compact title buttons; ensure ⋯ fits; glue label to its title
     st.sidebar.markdown(
         """
@@ -0,0 +1 @@
+"""Offline load-testing harness: fake LLM / embedding servers and an in-memory Qdrant."""
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+# Local stand-ins for the OpenAI-compatible LLM and embedding endpoints. Embeddings are
+# hashed bags of words, so texts sharing words get close vectors and retrieval behaves
+# plausibly on the synthetic corpus below.
+
+DIM = 256
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+R_FUNCS = ["pivot_longer", "pivot_wider", "mutate", "summarise", "group_by", "left_join",
+           "fread", "fwrite", "read_csv", "filter", "arrange", "across", "case_when",
+           "map_dfr", "str_detect", "ggplot", "lubridate::ymd", "data.table", "arrow::read_parquet"]
+TOPICS = ["Manipuler des données", "Joindre des tables", "Lire des fichiers", "Agréger",
+          "Restructurer des données", "Dates", "Chaînes de caractères", "Graphiques"]
+
+
+def fake_embedding(text: str, dim: int = DIM) -> list[float]:
+    v = np.zeros(dim, dtype="float32")
+    for w in _WORD_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 63) else -1.0
+    v /= (np.linalg.norm(v) + 1e-12)
+    return v.tolist()
+
+
+def synthetic_chunks(n: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        funcs = rnd.sample(R_FUNCS, 3)
+        topic = rnd.choice(TOPICS)
+        text = (f"{topic}. Pour ce besoin on utilise {funcs[0]}, souvent combiné avec "
+                f"{funcs[1]} et {funcs[2]}. ```r\ndf |> {funcs[0]}()\n``` " * rnd.randint(2, 6))
+        out.append({"source": "utilitr", "url": f"https://book.utilitr.org/fake/{i // 4}.html",
+                    "section": f"{topic} ({i})", "text": text, "position": i % 4})
+    return out
+
+
+def seed_qdrant(client: QdrantClient, collection: str, n_chunks: int = 2000, seed: int = 0):
+    client.recreate_collection(collection, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    chunks = synthetic_chunks(n_chunks, seed)
+    points = [PointStruct(id=i, vector=fake_embedding(c["text"]), payload=c) for i, c in enumerate(chunks)]
+    for i in range(0, len(points), 256):
+        client.upsert(collection, points[i:i + 256])
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # configured on the server instance (see start_fake_server)
+    server: "FakeOpenAIServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/embeddings"):
+            time.sleep(self.server.embed_latency_s)
+            texts = body.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            self._json(200, {"object": "list", "model": body.get("model"),
+                             "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                                      for i, t in enumerate(texts)]})
+        elif self.path.endswith("/chat/completions"):
+            self._stream_chat(body)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def _stream_chat(self, body: dict):
+        n = min(int(body.get("max_tokens") or 2048), self.server.answer_tokens)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        time.sleep(self.server.ttft_s)
+        delay = 1.0 / self.server.tokens_per_s if self.server.tokens_per_s else 0.0
+        for i in range(n):
+            chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0,
+                     "model": body.get("model", "fake"),
+                     "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if delay:
+                time.sleep(delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ttft_ms: float, tokens_per_s: float, answer_tokens: int, embed_latency_ms: float):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.ttft_s = ttft_ms / 1000.0
+        self.tokens_per_s = tokens_per_s
+        self.answer_tokens = answer_tokens
+        self.embed_latency_s = embed_latency_ms / 1000.0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+def start_fake_server(ttft_ms: float = 300.0, tokens_per_s: float = 50.0, answer_tokens: int = 200,
+                      embed_latency_ms: float = 20.0) -> FakeOpenAIServer:
+    """Serve /v1/chat/completions (streaming) and /v1/embeddings on a free local port."""
+    srv = FakeOpenAIServer(ttft_ms, tokens_per_s, answer_tokens, embed_latency_ms)
+    threading.Thread(target=srv.serve_forever, name="canar-fake-openai", daemon=True).start()
+    return srv
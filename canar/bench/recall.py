@@ -0,0 +1,89 @@
+"""
+Recall@k of the retrieval profiles (RETRIEVAL_PROFILE) against exact search, next to
+their latency, on a real collection:
+
+    canar-bench --recall --qdrant-url http://localhost:6333 --collection utilitr_v1
+
+Queries are the stored vectors of randomly picked points (no embedding service needed);
+the picked point itself is left out of both result lists. With `--qdrant-url :memory:`
+a synthetic collection is used instead, but the in-process Qdrant always searches
+exactly, so only the latency column is meaningful there.
+"""
+from __future__ import annotations
+import random
+import time
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+from canar.app.api.retrieval import PROFILES, dense_search, get_engine, search_params
+from canar.bench.fakes import seed_qdrant
+
+
+def sample_queries(client, collection: str, n: int, seed: int = 0) -> list[tuple]:
+    ids, offset = [], None
+    while True:
+        points, offset = client.scroll(collection_name=collection, limit=1024, offset=offset,
+                                       with_payload=False, with_vectors=False)
+        ids += [p.id for p in points]
+        if offset is None:
+            break
+    picked = random.Random(seed).sample(ids, min(n, len(ids)))
+    recs = client.retrieve(collection_name=collection, ids=picked, with_vectors=True)
+    out = []
+    for r in recs:
+        v = r.vector
+        if isinstance(v, dict):  # named vectors: the first one
+            v = next(iter(v.values()))
+        out.append((r.id, v))
+    return out
+
+
+def run(args) -> dict:
+    from canar.bench.run import percentile
+
+    if args.qdrant_url == ":memory:":
+        seed_qdrant(get_engine(":memory:").client, args.collection, n_chunks=args.chunks)
+    client = get_engine(args.qdrant_url, args.qdrant_api_key or None).client
+    flt = (Filter(must=[FieldCondition(key="source", match=MatchValue(value=args.source))])
+           if args.source else None)
+    queries = sample_queries(client, args.collection, args.queries)
+
+    def top(qid, vec, profile) -> tuple[list, float]:
+        t0 = time.perf_counter()
+        hits = dense_search(client, args.collection, vec, args.k + 1, flt, search_params(profile),
+                            with_payload=False)
+        return [h.id for h in hits if h.id != qid][:args.k], time.perf_counter() - t0
+
+    exact = {qid: top(qid, vec, "exact")[0] for qid, vec in queries}
+    report = {"collection": args.collection, "queries": len(queries), "k": args.k, "profiles": {}}
+    for profile in args.profiles:
+        recalls, lat = [], []
+        for qid, vec in queries:
+            ids, dt = top(qid, vec, profile)
+            lat.append(dt * 1000)
+            if exact[qid]:
+                recalls.append(len(set(ids) & set(exact[qid])) / len(exact[qid]))
+        report["profiles"][profile] = {
+            f"recall@{args.k}": round(sum(recalls) / len(recalls), 4) if recalls else None,
+            "latency_ms": {f"p{p}": round(percentile(lat, p), 2) for p in (50, 95, 99)},
+        }
+    return report
+
+
+def add_arguments(ap):
+    ap.add_argument("--recall", action="store_true",
+                    help="measure recall@k / latency of the retrieval profiles instead (see canar.bench.recall)")
+    ap.add_argument("--qdrant-url", default=":memory:", help="--recall: Qdrant to measure")
+    ap.add_argument("--qdrant-api-key", default="")
+    ap.add_argument("--collection", default="utilitr_bench", help="--recall: collection (or alias)")
+    ap.add_argument("--source", default="utilitr", help="--recall: `source` filter ('' = none)")
+    ap.add_argument("--queries", type=int, default=200, help="--recall: sampled query points")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+
+
+def print_report(report: dict):
+    key = f"recall@{report['k']}"
+    print(f"[canar-bench] recall on {report['collection']}: {report['queries']} queries, k={report['k']}")
+    for profile, r in report["profiles"].items():
+        q = r["latency_ms"]
+        print(f"  {profile:<9} {key}={r[key]}  "
+              f"p50={q['p50']:>7} ms  p95={q['p95']:>7} ms  p99={q['p99']:>7} ms")
@@ -0,0 +1,167 @@
+"""
+Drive the r_helpdesk / sas_to_r pipelines with N concurrent simulated users against
+local fakes (no network needed) and report latency percentiles.
+
+    canar-bench --users 16 --turns 5 --agent r_helpdesk
+
+`--recall` measures the retrieval profiles instead (recall@k against exact search and
+latency, see canar.bench.recall).
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+from canar.app.state import DB
+from canar.app.api.llm_client import ChatClient
+from canar.app.api.embed_client import EmbedClient
+from canar.app.api.retrieval import get_engine, search_qdrant
+from canar.app.agents import sas_to_r, r_helpdesk
+from canar.bench import recall
+from canar.bench.fakes import R_FUNCS, TOPICS, seed_qdrant, start_fake_server
+
+COLLECTION = "utilitr_bench"
+SAS_SAMPLE = """data work.out;
+  set work.in;
+  where annee >= 2020;
+  total = sum(of x1-x5);
+run;
+proc means data=work.out n mean;
+  class region;
+  var total;
+run;
+"""
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def _question(rnd: random.Random) -> str:
+    return f"{rnd.choice(TOPICS)} : comment utiliser {rnd.choice(R_FUNCS)} avec {rnd.choice(R_FUNCS)} ?"
+
+
+def simulate_user(idx: int, args, db: DB, chat: ChatClient, embed: EmbedClient,
+                  results: list[dict], lock: threading.Lock):
+    rnd = random.Random(idx)
+    uid = db.create_user(f"bench{idx}_{time.time_ns()}", "bench")
+    conv_id = db.create_conversation(uid, "bench", args.agent)
+    for _ in range(args.turns):
+        question = _question(rnd)
+        t0 = time.perf_counter()
+        hits = None
+        if args.agent == "sas_to_r":
+            messages = sas_to_r.build_messages(question, SAS_SAMPLE)
+        else:
+            qvec = embed.embed_query(question)
+            citations = search_qdrant(":memory:", None, [COLLECTION], qvec,
+                                      top_k_per_collection=5, source_filter="utilitr")
+            messages, _ = r_helpdesk.build_messages(question, citations, token_budget=3000)
+            hits = len(citations)
+        t_prompt = time.perf_counter()
+        ttft = None
+        parts = []
+        for token in chat.stream_chat(messages, max_tokens=args.answer_tokens):
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            parts.append(token)
+        db.append_turn(uid, conv_id, question, "".join(parts))
+        e2e = time.perf_counter() - t0
+        with lock:
+            results.append({"ttft": ttft or e2e, "e2e": e2e, "prep": t_prompt - t0, "hits": hits})
+        if args.think_ms:
+            time.sleep(rnd.uniform(0, args.think_ms) / 1000.0)
+
+
+def run(args) -> dict:
+    srv = start_fake_server(ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s,
+                            answer_tokens=args.answer_tokens, embed_latency_ms=args.embed_latency_ms)
+    seed_qdrant(get_engine(":memory:").client, COLLECTION, n_chunks=args.chunks)
+    tmp = tempfile.mkdtemp(prefix="canar-bench-")
+    os.environ.pop("DB_POSTGRES_URL", None)  # always a throwaway SQLite file
+    db = DB(os.path.join(tmp, "bench.db"), write_behind=args.write_behind)
+    db.init_schema()
+    chat = ChatClient(srv.base_url, "", "fake-mistral")
+    embed = EmbedClient(srv.base_url, "fake-embed")
+
+    results: list[dict] = []
+    lock = threading.Lock()
+    threads = [threading.Thread(target=simulate_user, args=(i, args, db, chat, embed, results, lock))
+               for i in range(args.users)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db.flush()
+    wall = time.perf_counter() - t0
+    srv.shutdown()
+    db.close()
+
+    # measured: rows / transactions actually committed (write-behind batches included)
+    report = {"agent": args.agent, "users": args.users, "turns": len(results), "wall_s": round(wall, 3),
+              "db_writes_per_s": round(db.written["messages"] / wall, 1),
+              "db_commits_per_s": round(db.written["commits"] / wall, 1),
+              "turns_without_hits": sum(1 for r in results if r["hits"] == 0)}
+    for key in ("ttft", "e2e", "prep"):
+        vals = [r[key] * 1000 for r in results]
+        report[f"{key}_ms"] = {f"p{p}": round(percentile(vals, p), 1) for p in (50, 95, 99)}
+    return report
+
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(prog="canar-bench", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--agent", choices=["r_helpdesk", "sas_to_r"], default="r_helpdesk")
+    ap.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    ap.add_argument("--turns", type=int, default=5, help="questions per user")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="max random pause between turns")
+    ap.add_argument("--ttft-ms", type=float, default=300.0, help="fake LLM time to first token")
+    ap.add_argument("--tokens-per-s", type=float, default=50.0, help="fake LLM token rate (0 = unthrottled)")
+    ap.add_argument("--answer-tokens", type=int, default=200)
+    ap.add_argument("--embed-latency-ms", type=float, default=20.0)
+    ap.add_argument("--chunks", type=int, default=2000, help="synthetic utilitr chunks in Qdrant")
+    ap.add_argument("--write-behind", action="store_true", help="queue DB writes (DB_WRITE_BEHIND)")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    recall.add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    report = recall.run(args) if args.recall else run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        if not args.recall:
+            check(report)
+        return
+    if args.recall:
+        recall.print_report(report)
+        return
+    print(f"[canar-bench] {report['agent']}: {report['users']} users, {report['turns']} turns "
+          f"in {report['wall_s']} s, {report['db_writes_per_s']} DB writes/s "
+          f"({report['db_commits_per_s']} commits/s)")
+    for key in ("ttft_ms", "e2e_ms", "prep_ms"):
+        q = report[key]
+        print(f"  {key:<8} p50={q['p50']:>8}  p95={q['p95']:>8}  p99={q['p99']:>8}")
+    check(report)
+
+
+def check(report: dict):
+    """Warn when retrieval came back empty; exit 1 when it always did (broken pipeline)."""
+    empty = report.get("turns_without_hits", 0)
+    if empty:
+        print(f"[canar-bench] warning: {empty}/{report['turns']} turns retrieved no hits",
+              file=sys.stderr)
+    if empty and empty == report["turns"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
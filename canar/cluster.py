@@ -0,0 +1,181 @@
+"""
+Multi-worker mode of `canar` (CANAR_WORKERS > 1): N Streamlit processes on local ports
+behind a small asyncio reverse proxy listening on CANAR_PORT.
+
+- Routing is sticky: the first response carries a `canar_worker` cookie and later
+  HTTP requests and the Streamlit websocket go to that worker while it is ready. New
+  browsers go to the ready worker with the fewest open connections.
+- A supervisor polls each worker's `/_stcore/health` and restarts dead processes.
+  Logins survive the move to another worker (signed tokens in the DB, see app.sessions).
+- `/healthz`: the proxy is up. `/readyz`: 200 when at least one worker is ready, with
+  the state of each worker as JSON.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import re
+import signal
+import subprocess
+import time
+
+COOKIE = "canar_worker"
+_COOKIE_RE = re.compile(rb"(?im)^cookie:.*?\b" + COOKIE.encode() + rb"=(\d+)")
+
+
+class Worker:
+    def __init__(self, index: int, port: int, argv: list[str]):
+        self.index = index
+        self.port = port
+        self.argv = argv + ["--server.port", str(port), "--server.address", "127.0.0.1"]
+        self.proc: subprocess.Popen | None = None
+        self.ready = False
+        self.conns = 0
+        self.restarts = 0
+
+    def start(self):
+        self.proc = subprocess.Popen(self.argv)
+        self.ready = False
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def state(self) -> dict:
+        return {"port": self.port, "pid": self.proc.pid if self.proc else None,
+                "alive": self.alive(), "ready": self.ready, "connections": self.conns,
+                "restarts": self.restarts}
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while (data := await reader.read(65536)):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _respond(writer: asyncio.StreamWriter, status: str, body: dict | str):
+    data = (json.dumps(body) if isinstance(body, dict) else body).encode("utf-8")
+    ctype = "application/json" if isinstance(body, dict) else "text/plain"
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n\r\n".encode() + data)
+
+
+class Balancer:
+    def __init__(self, workers: list[Worker], host: str, port: int, health_interval_s: float = 2.0):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.health_interval_s = health_interval_s
+
+    def _pick(self, head: bytes) -> tuple[Worker | None, bool]:
+        """(worker, whether the sticky cookie must be (re)set)."""
+        m = _COOKIE_RE.search(head.split(b"\r\n\r\n", 1)[0])
+        if m and int(m.group(1)) < len(self.workers) and self.workers[int(m.group(1))].ready:
+            return self.workers[int(m.group(1))], False
+        ready = [w for w in self.workers if w.ready]
+        return (min(ready, key=lambda w: w.conns), True) if ready else (None, False)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        path = head.split(b" ", 2)[1] if head.count(b" ") >= 2 else b"/"
+        if path == b"/healthz":
+            _respond(writer, "200 OK", "ok")
+            writer.close()
+            return
+        if path == b"/readyz":
+            ready = any(w.ready for w in self.workers)
+            _respond(writer, "200 OK" if ready else "503 Service Unavailable",
+                     {"ready": ready, "workers": [w.state() for w in self.workers]})
+            writer.close()
+            return
+        worker, set_cookie = self._pick(head)
+        if worker is None:
+            _respond(writer, "503 Service Unavailable", "no worker ready")
+            writer.close()
+            return
+        try:
+            up_reader, up_writer = await asyncio.open_connection("127.0.0.1", worker.port)
+        except OSError:
+            worker.ready = False
+            _respond(writer, "502 Bad Gateway", "worker unavailable")
+            writer.close()
+            return
+        worker.conns += 1
+        try:
+            up_writer.write(head)
+            if set_cookie:
+                # pin the browser to this worker: add the cookie to the first response
+                resp_head = await up_reader.readuntil(b"\r\n\r\n")
+                cookie = f"Set-Cookie: {COOKIE}={worker.index}; Path=/; HttpOnly; SameSite=Lax\r\n"
+                writer.write(resp_head[:-2] + cookie.encode() + b"\r\n")
+            await asyncio.gather(_pipe(reader, up_writer), _pipe(up_reader, writer))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            up_writer.close()
+        finally:
+            worker.conns -= 1
+
+    async def _probe(self, worker: Worker) -> bool:
+        try:
+            r, w = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", worker.port), 2.0)
+            w.write(b"GET /_stcore/health HTTP/1.0\r\nHost: localhost\r\n\r\n")
+            status = await asyncio.wait_for(r.readline(), 2.0)
+            w.close()
+            return b" 200 " in status
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def _supervise(self):
+        while True:
+            for w in self.workers:
+                if not w.alive():
+                    w.restarts += 1
+                    w.start()
+                    continue
+                w.ready = await self._probe(w)
+            await asyncio.sleep(self.health_interval_s)
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=1 << 16)
+        supervisor = asyncio.create_task(self._supervise())
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                supervisor.cancel()
+
+
+def run_cluster(argv: list[str], workers: int, host: str = "0.0.0.0", port: int = 8501) -> int:
+    """Start `workers` Streamlit processes (`argv` + port options) and proxy to them."""
+    pool = [Worker(i, port + 1 + i, argv) for i in range(workers)]
+    for w in pool:
+        w.start()
+    print(f"[canar] {workers} workers on ports {port + 1}-{port + workers}, proxy on {host}:{port}")
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        asyncio.run(Balancer(pool, host, port).serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in pool:
+            if w.alive():
+                w.proc.terminate()
+        deadline = time.monotonic() + 10
+        for w in pool:
+            if w.proc:
+                try:
+                    w.proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    w.proc.kill()
+    return 0
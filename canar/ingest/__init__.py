@@ -0,0 +1 @@
+"""Offline ingestion of the documentation corpus into the Qdrant collections (`canar-ingest`)."""
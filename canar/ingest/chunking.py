@@ -0,0 +1,166 @@
+from __future__ import annotations
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Iterator
+
+# Documents -> section chunks. Markdown / Quarto files are split at headings (levels
+# 1-3); HTML pages are first flattened to the same shape. A section longer than
+# `max_chars` is cut at paragraph boundaries, never inside a fenced code block.
+
+DOC_EXTENSIONS = {".md", ".markdown", ".qmd", ".rmd", ".html", ".htm"}
+_HEADING_RE = re.compile(r"^(#{1,3})\s+(.+?)\s*#*\s*$")
+_FRONT_MATTER_RE = re.compile(r"\A---\n.*?\n---\n", re.S)
+
+
+@dataclass
+class Chunk:
+    path: str  # document path relative to the corpus root
+    key: str  # stable id within the document: "<section slug>#<part>"
+    url: str
+    section: str
+    text: str
+    position: int  # order of the chunk in its document (context assembly merges neighbours)
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(f"{self.url}\n{self.section}\n{self.text}".encode("utf-8")).hexdigest()
+
+
+class _HtmlToMarkdown(HTMLParser):
+    _SKIP = {"script", "style", "nav", "header", "footer", "aside"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self._skip = 0
+        self._pre = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip += 1
+        elif tag in ("h1", "h2", "h3"):
+            self.out.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag == "pre":
+            self._pre = True
+            self.out.append("\n\n```\n")
+        elif tag in ("p", "div", "li", "tr", "br", "h4", "h5", "h6"):
+            self.out.append("\n\n" if tag in ("p", "div") else "\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag == "pre":
+            self._pre = False
+            self.out.append("\n```\n\n")
+        elif tag in ("h1", "h2", "h3"):
+            self.out.append("\n\n")
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self.out.append(data if self._pre else re.sub(r"\s+", " ", data))
+
+
+def html_to_markdown(html: str) -> str:
+    p = _HtmlToMarkdown()
+    p.feed(html)
+    return re.sub(r"\n{3,}", "\n\n", "".join(p.out)).strip()
+
+
+def _slug(title: str) -> str:
+    return re.sub(r"[^\w]+", "-", title.lower()).strip("-") or "intro"
+
+
+def _paragraphs(text: str) -> list[str]:
+    """Blank-line separated blocks; a fenced code block stays in one piece."""
+    out: list[str] = []
+    cur: list[str] = []
+    fence = False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            fence = not fence
+        if not line.strip() and not fence:
+            if cur:
+                out.append("\n".join(cur))
+                cur = []
+        else:
+            cur.append(line)
+    if cur:
+        out.append("\n".join(cur))
+    return out
+
+
+def _split_long(text: str, max_chars: int) -> list[str]:
+    parts: list[str] = []
+    cur = ""
+    for para in _paragraphs(text):
+        if cur and len(cur) + len(para) + 2 > max_chars:
+            parts.append(cur)
+            cur = ""
+        cur = f"{cur}\n\n{para}" if cur else para
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def chunk_markdown(text: str, path: str, url: str, max_chars: int = 1500) -> list[Chunk]:
+    text = _FRONT_MATTER_RE.sub("", text.replace("\r\n", "\n"))
+    chunks: list[Chunk] = []
+    titles: list[str] = []
+    body: list[str] = []
+    seen: dict[str, int] = {}
+
+    def flush():
+        section = " > ".join(titles)
+        content = "\n".join(body).strip()
+        if not content:
+            return
+        slug = _slug(titles[-1]) if titles else "intro"
+        seen[slug] = seen.get(slug, 0) + 1
+        if seen[slug] > 1:
+            slug = f"{slug}-{seen[slug]}"
+        for i, part in enumerate(_split_long(content, max_chars)):
+            chunks.append(Chunk(path, f"{slug}#{i}", url, section, part, len(chunks)))
+
+    fence = False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            fence = not fence
+        m = None if fence else _HEADING_RE.match(line)
+        if m:
+            flush()
+            body = []
+            level = len(m.group(1))
+            titles = titles[:level - 1] + [m.group(2).strip()]
+        else:
+            body.append(line)
+    flush()
+    return chunks
+
+
+def iter_documents(roots: list[str]) -> Iterator[tuple[str, str]]:
+    """(path relative to its root, absolute path) of every supported file, in a stable order."""
+    for root in roots:
+        if os.path.isfile(root):
+            yield os.path.basename(root), root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith((".", "_")))
+            for name in sorted(filenames):
+                if os.path.splitext(name)[1].lower() in DOC_EXTENSIONS:
+                    full = os.path.join(dirpath, name)
+                    yield os.path.relpath(full, root).replace(os.sep, "/"), full
+
+
+def iter_chunks(roots: list[str], base_url: str = "", max_chars: int = 1500) -> Iterator[Chunk]:
+    """Stream the chunks of every document under `roots` (one file in memory at a time)."""
+    for rel, full in iter_documents(roots):
+        with open(full, encoding="utf-8", errors="ignore") as f:
+            raw = f.read()
+        ext = os.path.splitext(rel)[1].lower()
+        text = html_to_markdown(raw) if ext in (".html", ".htm") else raw
+        url = f"{base_url.rstrip('/')}/{os.path.splitext(rel)[0]}.html" if base_url else rel
+        yield from chunk_markdown(text, rel, url, max_chars)
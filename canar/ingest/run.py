@@ -0,0 +1,271 @@
+"""
+Build or refresh a documentation collection from markdown / Quarto / HTML sources.
+
+    canar-ingest path/to/utilitr --collection utilitr --base-url https://book.utilitr.org
+
+Chunks are identified by (document, section, part) and carry a content hash: only new or
+changed chunks are embedded, unchanged ones reuse the vectors already stored.
+
+Blue/green (default): a new physical collection `<name>__<timestamp>` is filled and
+indexed, then the alias `<name>` is moved to it in a single call. Searches go through
+the alias, so they switch over atomically and never see a half-built collection; the
+previous version is kept for rollback (`--keep`). `--in-place` updates the live
+collection instead (faster, but readers see the refresh as it happens).
+
+When `<name>` is still a plain collection, the alias cannot take its name atomically:
+either ingest under a new name (then point QDRANT_COLLECTIONS at it), or pass
+`--migrate` to delete the plain collection right before the alias is created (searches
+on `<name>` fail in between).
+
+New collections are created with the quantization of QDRANT_QUANTIZATION (`--quantization`)
+and a keyword index on `source`; `--setup` applies both to the live collection without
+ingesting anything.
+"""
+from __future__ import annotations
+import argparse
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (BinaryQuantization, BinaryQuantizationConfig, CreateAlias,
+                                       CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+                                       Disabled, Distance, PayloadSchemaType, PointIdsList,
+                                       PointStruct, ScalarQuantization, ScalarQuantizationConfig,
+                                       ScalarType, VectorParams)
+from canar.app.config import AppConfig
+from canar.app.api.embed_client import EmbedClient
+from canar.ingest.chunking import Chunk, iter_chunks
+
+_NAMESPACE = uuid.UUID("5b0d3c3e-7f6a-4a51-9d0e-2f7c1a9e4b61")
+
+
+def point_id(chunk: Chunk) -> str:
+    return str(uuid.uuid5(_NAMESPACE, f"{chunk.path}#{chunk.key}"))
+
+
+def resolve_alias(client: QdrantClient, name: str) -> str | None:
+    """Physical collection behind `name` (alias or plain collection), None if absent."""
+    for a in client.get_aliases().aliases:
+        if a.alias_name == name:
+            return a.collection_name
+    return name if client.collection_exists(name) else None
+
+
+def quantization_config(kind: str) -> ScalarQuantization | BinaryQuantization | None:
+    """int8 ("scalar", 4x smaller) or 1-bit ("binary", 32x) copies of the vectors, kept in RAM;
+    the originals stay on disk for rescoring (see retrieval.search_params)."""
+    if kind == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99,
+                                                                  always_ram=True))
+    if kind == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def setup_collection(client: QdrantClient, name: str, quantization: str) -> str:
+    """Apply the quantization and the `source` index to the live collection behind `name`."""
+    live = resolve_alias(client, name)
+    if live is None:
+        raise SystemExit(f"[canar] no collection {name}")
+    client.update_collection(live, quantization_config=quantization_config(quantization)
+                             or Disabled.DISABLED)
+    client.create_payload_index(live, "source", field_schema=PayloadSchemaType.KEYWORD)
+    return live
+
+
+def stored_hashes(client: QdrantClient, collection: str) -> dict[str, tuple[str, int | None]]:
+    """(content hash, position) of every point of `collection`, by point id."""
+    out: dict[str, tuple[str, int | None]] = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection, limit=1024, offset=offset,
+                                       with_payload=["hash", "position"], with_vectors=False)
+        for p in points:
+            payload = p.payload or {}
+            out[str(p.id)] = (payload.get("hash", ""), payload.get("position"))
+        if offset is None:
+            return out
+
+
+class Ingestor:
+    def __init__(self, client: QdrantClient, embed: EmbedClient, name: str, source: str = "utilitr",
+                 batch: int = 256, workers: int = 4, quantization: str = "scalar"):
+        self.client = client
+        self.embed = embed
+        self.name = name
+        self.source = source
+        self.batch = batch
+        self.workers = workers
+        self.quantization = quantization
+        self.stats: Counter = Counter()
+
+    def _payload(self, c: Chunk) -> dict:
+        return {"source": self.source, "url": c.url, "section": c.section, "text": c.text,
+                "path": c.path, "hash": c.hash, "position": c.position}
+
+    def _ensure(self, target: str, dim: int):
+        if not self.client.collection_exists(target):
+            self.client.create_collection(target, vectors_config=VectorParams(size=dim,
+                                                                              distance=Distance.COSINE),
+                                          quantization_config=quantization_config(self.quantization))
+            # every search filters on `source`
+            self.client.create_payload_index(target, "source", field_schema=PayloadSchemaType.KEYWORD)
+
+    def _upsert(self, target: str, points: list[PointStruct]):
+        if points:
+            self._ensure(target, len(points[0].vector))
+            self.client.upsert(target, points, wait=True)
+
+    def _copy(self, live: str, target: str, batch: list[tuple[str, Chunk]]):
+        # unchanged chunks: stored vector, no embedding call; the payload is rewritten (the
+        # position of a chunk moves when its document changes elsewhere)
+        chunks = dict(batch)
+        recs = self.client.retrieve(live, ids=list(chunks), with_vectors=True, with_payload=False)
+        self._upsert(target, [PointStruct(id=r.id, vector=r.vector,
+                                          payload=self._payload(chunks[str(r.id)]))
+                              for r in recs])
+        self.stats["reused"] += len(recs)
+
+    def run(self, chunks: Iterable[Chunk], in_place: bool = False, keep: int = 1,
+            migrate: bool = False) -> str:
+        """Ingest `chunks`; returns the physical collection now serving `name`."""
+        live = resolve_alias(self.client, self.name)
+        if live == self.name and not in_place and not migrate:
+            raise SystemExit(f"[canar] {self.name} is a plain collection: ingest under a new name "
+                             f"(alias) and point QDRANT_COLLECTIONS at it, use --in-place, or "
+                             f"--migrate to replace it by an alias (not atomic)")
+        old = stored_hashes(self.client, live) if live else {}
+        target = live if in_place and live else f"{self.name}__{time.strftime('%Y%m%d%H%M%S')}"
+        seen: set[str] = set()
+        to_copy: list[tuple[str, Chunk]] = []
+        to_embed: list[tuple[str, Chunk]] = []
+        inflight: deque[Future] = deque()
+
+        def embed_batch(batch: list[tuple[str, Chunk]]):
+            return batch, self.embed.embed_many([c.text for _, c in batch])
+
+        def drain(max_inflight: int):
+            # upsert finished batches in order; bounds the memory held by pending vectors
+            while inflight and (len(inflight) > max_inflight or inflight[0].done()):
+                batch, vecs = inflight.popleft().result()
+                self._upsert(target, [PointStruct(id=pid, vector=v, payload=self._payload(c))
+                                      for (pid, c), v in zip(batch, vecs)])
+                self.stats["embedded"] += len(batch)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="canar-ingest") as pool:
+            for c in chunks:
+                pid = point_id(c)
+                if pid in seen:
+                    continue
+                seen.add(pid)
+                self.stats["chunks"] += 1
+                stored_hash, stored_pos = old.get(pid, ("", None))
+                if stored_hash == c.hash:
+                    if in_place:
+                        if stored_pos != c.position:
+                            self.client.set_payload(live, {"position": c.position}, points=[pid])
+                        self.stats["unchanged"] += 1
+                    else:
+                        to_copy.append((pid, c))
+                        if len(to_copy) >= self.batch:
+                            self._copy(live, target, to_copy)
+                            to_copy = []
+                    continue
+                to_embed.append((pid, c))
+                if len(to_embed) >= self.batch:
+                    inflight.append(pool.submit(embed_batch, to_embed))
+                    to_embed = []
+                    drain(2 * self.workers)
+            if to_embed:
+                inflight.append(pool.submit(embed_batch, to_embed))
+            drain(0)
+        if to_copy:
+            self._copy(live, target, to_copy)
+
+        if in_place and live:
+            gone = [pid for pid in old if pid not in seen]
+            if gone:
+                self.client.delete(live, points_selector=PointIdsList(points=gone))
+            self.stats["deleted"] += len(gone)
+            return live
+        if not self.client.collection_exists(target):
+            raise SystemExit("[canar] no documents found, nothing ingested")
+        self.stats["deleted"] += len(set(old) - seen)
+        self._switch(live, target)
+        self._prune(target, keep)
+        return target
+
+    def _switch(self, live: str | None, target: str):
+        ops = []
+        if live == self.name:
+            # --migrate: a plain collection holds the name, it has to go before the alias can
+            # take it (its content is all in `target`)
+            print(f"[canar] warning: deleting the plain collection {self.name}, searches on it "
+                  f"fail until the alias to {target} exists")
+            self.client.delete_collection(self.name)
+        elif live:
+            ops.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.name)))
+        ops.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=target,
+                                                                 alias_name=self.name)))
+        try:
+            self.client.update_collection_aliases(change_aliases_operations=ops)
+        except Exception:
+            print(f"[canar] alias switch failed: the new version is in {target}")
+            raise
+
+    def _prune(self, target: str, keep: int):
+        versions = sorted(c.name for c in self.client.get_collections().collections
+                          if c.name.startswith(f"{self.name}__") and c.name != target)
+        for name in versions[:max(0, len(versions) - keep)]:
+            self.client.delete_collection(name)
+
+
+def main(argv: list[str] | None = None):
+    cfg = AppConfig()
+    ap = argparse.ArgumentParser(prog="canar-ingest", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", help="documents or directories (.md, .qmd, .Rmd, .html)")
+    ap.add_argument("--collection", default=cfg.qdrant_collections[0])
+    ap.add_argument("--source", default="utilitr", help="`source` payload value")
+    ap.add_argument("--base-url", default="", help="URL prefix of the published documents")
+    ap.add_argument("--max-chars", type=int, default=1500, help="max chunk size")
+    ap.add_argument("--batch", type=int, default=256, help="texts per embedding / upsert batch")
+    ap.add_argument("--workers", type=int, default=4, help="concurrent embedding requests")
+    ap.add_argument("--in-place", action="store_true", help="update the live collection")
+    ap.add_argument("--keep", type=int, default=1, help="previous versions kept for rollback")
+    ap.add_argument("--migrate", action="store_true",
+                    help="replace a plain collection of that name by an alias (not atomic)")
+    ap.add_argument("--snapshot", action="store_true",
+                    help="refresh the local index (LOCAL_INDEX_DIR) afterwards")
+    ap.add_argument("--quantization", choices=["scalar", "binary", "none"],
+                    default=cfg.qdrant_quantization, help="vector quantization of new collections")
+    ap.add_argument("--setup", action="store_true",
+                    help="only apply --quantization and the `source` index to the live collection")
+    args = ap.parse_args(argv)
+    if not args.paths and not args.setup:
+        ap.error("no documents given")
+
+    client = QdrantClient(url=cfg.qdrant_url, api_key=cfg.qdrant_api_key or None, timeout=60)
+    if args.setup:
+        live = setup_collection(client, args.collection, args.quantization)
+        print(f"[canar] {args.collection} -> {live}: quantization={args.quantization}, `source` indexed")
+        return
+    embed = EmbedClient(cfg.embed_base, cfg.embed_model, cfg.embed_key, coalesce=False,
+                        max_batch=args.batch)
+    ing = Ingestor(client, embed, args.collection, args.source, args.batch, args.workers,
+                   args.quantization)
+    t0 = time.perf_counter()
+    target = ing.run(iter_chunks(args.paths, args.base_url, args.max_chars), args.in_place, args.keep,
+                     args.migrate)
+    s = ing.stats
+    print(f"[canar] {args.collection} -> {target}: {s['chunks']} chunks, {s['embedded']} embedded, "
+          f"{s['reused']} reused, {s['unchanged']} unchanged, {s['deleted']} removed "
+          f"in {time.perf_counter() - t0:.1f}s")
+    if args.snapshot:
+        from canar.app.api.local_index import snapshot_collection
+
+        n = snapshot_collection(client, args.collection, cfg.local_index_dir, cfg.local_index_dtype)
+        print(f"[canar] local index: {n} points in {cfg.local_index_dir}")
+    embed.close()
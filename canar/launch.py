@@ -16,8 +16,38 @@ def main():
     argv = ["streamlit", "run", str(app_path)]
     if os.getenv("CANAR_HEADLESS", "true").lower() in {"1", "true", "yes"}:
         argv += ["--server.headless", "true"]
+
+    if (workers := int(os.getenv("CANAR_WORKERS", "1"))) > 1:
+        from canar.cluster import run_cluster
+
+        from dotenv import load_dotenv
+
+        # resolved once here with the app's precedence (.env wins), then inherited as is by
+        # the workers, which do not re-read .env (see config): they all share the login
+        # secret and the LLM/embedding admission budget
+        load_dotenv(override=True)
+        if not os.getenv("CANAR_SECRET"):
+            sys.exit("[canar] CANAR_WORKERS > 1 needs CANAR_SECRET (signs the logins shared by the workers)")
+        os.environ["ADMISSION_STATE"] = os.getenv("ADMISSION_STATE") or "data/admission.sqlite"
+        os.environ["CANAR_CLUSTER_WORKER"] = "1"
+        worker_argv = [sys.executable, "-m", "streamlit", "run", str(app_path),
+                       "--server.headless", "true"]
+        sys.exit(run_cluster(worker_argv, workers,
+                             host=os.getenv("CANAR_HOST", "0.0.0.0"),
+                             port=int(os.getenv("CANAR_PORT", "8501"))))
+
     if (port := os.getenv("CANAR_PORT")):
         argv += ["--server.port", port]
 
     sys.argv = argv
     sys.exit(stcli.main())
+
+
+def api_main():
+    """Headless HTTP API (`canar-api`), served by uvicorn."""
+    import uvicorn
+
+    uvicorn.run("canar.app.server:app",
+                host=os.getenv("CANAR_API_HOST", "0.0.0.0"),
+                port=int(os.getenv("CANAR_API_PORT", "8000")),
+                workers=int(os.getenv("CANAR_API_WORKERS", "1")))
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+import pytest
+from canar.app.api.admission import AdmissionController, CancelToken, Overloaded, _SharedSlots
+
+
+def test_limit_and_queue_timeout():
+    ctrl = AdmissionController("t", initial_limit=2, max_limit=2)
+    a, b = ctrl.acquire(), ctrl.acquire()
+    assert ctrl.try_acquire() is None
+    with pytest.raises(Overloaded) as exc:
+        ctrl.acquire(timeout_s=0.05)
+    assert exc.value.retry_after_s > 0
+    ctrl.release(a)
+    ctrl.release(ctrl.acquire(timeout_s=0.05))
+    ctrl.release(b)
+    assert ctrl.inflight == 0 and ctrl.waiting == 0
+
+
+def test_aimd_limit():
+    ctrl = AdmissionController("t", initial_limit=4, min_limit=1, max_limit=5, target_s=1.0,
+                               backoff=0.5, cooldown_s=60)
+    ctrl.record(latency_s=0.1)
+    assert ctrl.limit == pytest.approx(4.25)
+    ctrl.record(overloaded=True)
+    ctrl.record(latency_s=5.0)  # within the cooldown: no second decrease
+    assert ctrl.limit == pytest.approx(2.125)
+
+
+def test_processes_share_slots_and_limit(tmp_path):
+    path = str(tmp_path / "admission.db")
+    # one controller per process, each with its own connection to the state file
+    a = AdmissionController("llm", initial_limit=1, max_limit=4, state_path=path)
+    b = AdmissionController("llm", initial_limit=1, max_limit=4, state_path=path)
+    lease = a.acquire()
+    assert b.try_acquire() is None
+    # b holds nothing itself but must see a's lease in its wait estimate
+    assert b.inflight == 0 and b.estimated_wait_s() > 0
+    with pytest.raises(Overloaded):
+        asyncio.run(b.aacquire(timeout_s=0.05))
+    a.release(lease)
+    b.release(asyncio.run(b.aacquire(timeout_s=1)))
+    a.record(latency_s=0.1)  # the limit a learns is the one b applies
+    b.release(b.try_acquire())
+    assert a.limit == b.limit == 2
+
+
+def test_held_leases_outlive_their_ttl(tmp_path):
+    slots = _SharedSlots(str(tmp_path / "admission.db"), lease_ttl_s=0.6)
+    held = slots.take("llm", 5)
+    # a lease of a crashed process: nobody renews it
+    slots._conn().execute("INSERT INTO lease (name, pid, ts) VALUES ('llm', 0, ?)", (time.time(),))
+    assert slots.count("llm") == 2
+    time.sleep(1.5)
+    assert slots.count("llm") == 1
+    slots.release(held)
+    assert slots.count("llm") == 0
+
+
+def test_cancel_stops_waiting_and_runs_callbacks():
+    ctrl = AdmissionController("t", initial_limit=1, max_limit=1)
+    lease = ctrl.acquire()
+    cancel, calls = CancelToken(), []
+    unregister = cancel.on_set(lambda: calls.append("dropped"))
+    unregister()
+    cancel.on_set(lambda: calls.append("closed"))
+    threading.Timer(0.05, cancel.set).start()
+    t = time.monotonic()
+    assert ctrl.acquire(timeout_s=5, cancel=cancel) is None
+    assert time.monotonic() - t < 1
+    assert calls == ["closed"] and ctrl.waiting == 0
+    cancel.on_set(lambda: calls.append("late"))  # already set: runs right away
+    assert calls == ["closed", "late"]
+    ctrl.release(lease)
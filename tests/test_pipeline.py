@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from canar.app.pipeline import TurnPipeline
+from canar.app.tracing import NullTrace, Trace
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=4) as p:
+        yield p
+
+
+def test_history_is_read_before_the_question_is_stored(pool):
+    # the stages of a turn in main.py: the question must not show up in its own history
+    stored: list[str] = []
+    gate = threading.Event()
+
+    def load_history():
+        gate.wait(1)  # a slow read
+        return list(stored)
+
+    def store_question(history):
+        stored.append("question")
+        return len(stored)
+
+    pipe = TurnPipeline(pool, NullTrace())
+    pipe.start("history", load_history)
+    pipe.start("persist_question", store_question, after="history")
+    pipe.start("embed", lambda: [0.1])
+    pipe.start("search", lambda qvec, history: (qvec, history), after=("embed", "history"))
+    time.sleep(0.05)
+    assert stored == []
+    gate.set()
+    assert pipe.result("search") == ([0.1], [])
+    assert pipe.result("persist_question") == 1
+    assert pipe.result("history") == []
+
+
+def test_stage_errors_reach_their_dependents(pool):
+    def fail():
+        raise ValueError("embedding down")
+
+    pipe = TurnPipeline(pool, NullTrace())
+    pipe.start("embed", fail)
+    pipe.start("search", lambda qvec: qvec, after="embed")
+    with pytest.raises(ValueError, match="embedding down"):
+        pipe.result("search")
+
+
+def test_trace_records_stages_and_waits(pool):
+    trace = Trace("r_helpdesk")
+    pipe = TurnPipeline(pool, trace)
+    pipe.start("a", time.sleep, 0.05)
+    pipe.start("b", time.sleep, 0.05)
+    pipe.result("a")
+    pipe.result("b")
+    pipe.finish()
+    assert {"a", "b", "wait_a", "wait_b"} <= set(trace.stages)
+    # the two stages ran side by side
+    assert trace.attrs["overlap_saved_ms"] > 20
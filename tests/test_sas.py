@@ -0,0 +1,54 @@
+from canar.app.agents.sas_cache import code_hash, normalize_sas
+from canar.app.agents.sas_pipeline import SasBlock, group_blocks, split_block, split_sas
+
+PROGRAM = """* l'année de référence;
+%let an = 2024;
+data work.out; /* ; inside a comment */
+  set work.in;
+  label x = "a;b";
+run;
+%* macro comment with an apostrophe: don't split here;
+proc means data=work.out;
+  var x;
+run;
+"""
+
+
+def test_split_sas_ignores_semicolons_and_quotes_in_comments_and_strings():
+    blocks = split_sas(PROGRAM)
+    assert [(b.kind, b.start, b.end) for b in blocks] == [
+        ("global", 1, 2), ("data", 3, 6), ("global", 7, 7), ("proc", 8, 10)]
+    assert blocks[1].code.endswith("run;")
+
+
+def test_split_sas_keeps_a_macro_whole():
+    code = "%macro m(x);\ndata a; set &x; run;\nproc print; run;\n%mend;\ndata b; run;\n"
+    assert [(b.kind, b.start, b.end) for b in split_sas(code)] == [("macro", 1, 4), ("data", 5, 5)]
+
+
+def test_split_block_cuts_after_statements():
+    code = "\n".join(["%macro big;"] + [f"  x{i} = {i}" + (";" if i % 3 == 2 else "") for i in range(12)]
+                     + ["%mend;"])
+    b = SasBlock("macro", 10, 10 + code.count("\n"), code)
+    pieces = split_block(b, 5)
+    assert "\n".join(p.code for p in pieces) == code
+    assert all(p.end - p.start + 1 <= 5 for p in pieces)
+    assert [p.start for p in pieces[1:]] == [p.end + 1 for p in pieces[:-1]]
+    assert all(p.code.rstrip().endswith(";") for p in pieces)
+    assert split_block(b, 100) == [b]
+
+
+def test_group_blocks_respects_max_lines():
+    blocks = [SasBlock("data", 1, 3, "a\nb\nc;"), SasBlock("proc", 4, 5, "d\ne;"),
+              SasBlock("macro", 6, 14, "\n".join("f;" for _ in range(9)))]
+    chunks = group_blocks(blocks, max_lines=5)
+    assert [[(b.start, b.end) for b in c] for c in chunks] == [
+        [(1, 3), (4, 5)], [(6, 10)], [(11, 14)]]
+
+
+def test_normalize_sas_folds_cosmetics_outside_strings():
+    a = "DATA Out;  * l'année;\n  SET in; /* note */ y = 'A';\nRUN;"
+    b = "data out;\n%* other comment;\nset in;y='A';run;"
+    assert normalize_sas(a) == normalize_sas(b) == "data out;set in;y='A';run;"
+    assert code_hash(a) == code_hash(b)
+    assert code_hash("y = 'A';") != code_hash("y = 'a';")
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from canar.app import server
+from canar.app.api.admission import AdmissionController, Overloaded
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    """One API stream slot and one model slot, wired into the server resources."""
+    admission = AdmissionController("llm-test", initial_limit=1, max_limit=1)
+    chat = SimpleNamespace(admission=admission, estimated_wait_s=admission.estimated_wait_s)
+    monkeypatch.setattr(server.res, "chat", chat, raising=False)
+    monkeypatch.setattr(server.res, "cfg", SimpleNamespace(admission_queue_timeout_s=0.05),
+                        raising=False)
+    return admission
+
+
+def _run(coro_fn):
+    # the semaphore is created inside the loop it is used by
+    async def main():
+        server.res.slots = asyncio.Semaphore(1)
+        return await coro_fn()
+    return asyncio.run(main())
+
+
+def test_reserve_release_is_idempotent(slots):
+    async def go():
+        s = await server._reserve()
+        assert slots.inflight == 1 and server.res.slots.locked()
+        s.release()
+        s.release()
+        return server.res.slots._value
+    assert _run(go) == 1
+    assert slots.inflight == 0
+
+
+def test_reserve_gives_the_stream_slot_back_when_the_model_is_saturated(slots):
+    lease = slots.try_acquire()
+
+    async def go():
+        with pytest.raises(Overloaded):
+            await asyncio.wait_for(server._reserve(), 1)
+        return server.res.slots.locked()
+    slots.queue_timeout_s = 0.05
+    assert _run(go) is False
+    slots.release(lease)
+
+
+@pytest.mark.parametrize("client_gone", [False, True])
+def test_slot_response_releases_however_it_ends(slots, client_gone):
+    async def body():
+        yield "event: token\ndata: x\n\n"
+
+    async def send(message):
+        if client_gone:
+            raise OSError("client disconnected")
+
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def go():
+        s = await server._reserve()
+        try:
+            await server._SlotResponse(body(), s)({"type": "http", "asgi": {"spec_version": "2.4"}},
+                                                  receive, send)
+        except Exception:  # starlette turns the OSError into ClientDisconnect
+            assert client_gone
+        return s.held, server.res.slots.locked()
+    assert _run(go) == (False, False)
+    assert slots.inflight == 0
@@ -0,0 +1,86 @@
+import pytest
+from canar.app.state import DB
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    monkeypatch.delenv("DB_POSTGRES_URL", raising=False)
+    dbs = []
+
+    def make(**kwargs) -> DB:
+        db = DB(str(tmp_path / "canar.db"), **kwargs)
+        db.init_schema()
+        dbs.append(db)
+        return db
+    yield make
+    for db in dbs:
+        db.close()
+
+
+def _conversation(db: DB) -> tuple[int, int]:
+    uid = db.create_user("alice", "pw")
+    return uid, db.create_conversation(uid, "conv", "r_helpdesk")
+
+
+def _contents(db: DB, uid: int, cid: int) -> list[str]:
+    return [m.content for m in db.get_messages(uid, cid)]
+
+
+def test_write_behind_drops_only_the_rows_that_fail(make_db, monkeypatch):
+    db = make_db(write_behind=True)
+    uid, cid = _conversation(db)
+    write = db._write_messages
+
+    def poisoned(rows):
+        if any(r["content"] == "boom" for r in rows):
+            raise ValueError("bad row")
+        write(rows)
+    monkeypatch.setattr(db, "_write_messages", poisoned)
+    db.append_messages(uid, cid, [("user", "a"), ("assistant", "boom"), ("user", "b")])
+    with pytest.raises(RuntimeError, match="1 messages"):
+        db.flush()
+    assert _contents(db, uid, cid) == ["a", "b"]
+    db.flush()  # the loss is reported once
+
+
+def test_write_behind_retries_while_the_database_is_down(make_db, monkeypatch):
+    db = make_db(write_behind=True)
+    uid, cid = _conversation(db)
+    write = db._write_messages
+    calls = []
+
+    def down_then_up(rows):
+        calls.append(len(rows))
+        if len(calls) <= 3:  # the batch, then each of its 2 rows
+            raise ConnectionError("database down")
+        write(rows)
+    monkeypatch.setattr(db, "_write_messages", down_then_up)
+    db.append_turn(uid, cid, "question", "answer")
+    db.flush()
+    assert _contents(db, uid, cid) == ["question", "answer"]
+    assert calls == [2, 1, 1, 2]
+
+
+def test_conversation_pages_cover_every_row_once(make_db):
+    db = make_db()
+    uid = db.create_user("alice", "pw")
+    ids = [db.create_conversation(uid, f"conv {i}", "r_helpdesk") for i in range(7)]
+    # equal updated_at: the id breaks the tie
+    db.append_turn(uid, ids[2], "q", "a")
+    seen, after = [], None
+    while page := db.list_conversation_page(uid, limit=3, after=after):
+        seen += [r.id for r in page]
+        after = (page[-1].updated_at, page[-1].id)
+    assert seen[0] == ids[2]
+    assert sorted(seen) == sorted(ids) and len(seen) == len(ids)
+    assert [r.title for r in db.list_conversation_page(uid, search="conv 4")] == ["conv 4"]
+    assert db.list_conversation_page(db.create_user("bob", "pw")) == []
+
+
+def test_messages_before_id(make_db):
+    db = make_db()
+    uid, cid = _conversation(db)
+    ids = db.append_messages(uid, cid, [("user", str(i)) for i in range(5)])
+    assert [m.content for m in db.get_messages(uid, cid, limit=2)] == ["3", "4"]
+    assert [m.content for m in db.get_messages(uid, cid, limit=2, before_id=ids[3])] == ["1", "2"]
+    assert db.last_message_id(uid, cid) == ids[-1]